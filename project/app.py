@@ -7,10 +7,15 @@ from sqlalchemy.exc import OperationalError
 from apscheduler.schedulers.background import BackgroundScheduler
 import os
 import time
-from models import db
-from utils.metrics_collector import collect_metrics_job
-from utils.node_updater import check_all_nodes_updates
-from routes import auth, dashboard, settings, updates
+from models import db, ensure_columns
+from utils.proxmox_connection import connection_manager
+from utils.collection_scheduler import collection_scheduler
+from utils.live_updates import live_updates
+from utils.metrics_buffer import metrics_buffer
+from utils.log_sink import log_sink
+from utils.partitioning import ensure_metric_indexes, setup_partitioning
+from utils.jobs import start_jobs
+from routes import auth, dashboard, settings, updates, monitoring, history
 
 app = Flask(__name__)
 
@@ -29,6 +34,91 @@ app.config['SESSION_FILE_THRESHOLD'] = 500  # Maximum number of session files
 app.config['SESSION_COOKIE_DOMAIN'] = None  # Accept all domains
 app.config['SESSION_REFRESH_EACH_REQUEST'] = True  # Refresh session on each request
 
+# Scheduled jobs: disable in the web app when worker.py runs them
+app.config['RUN_SCHEDULER'] = os.environ.get('RUN_SCHEDULER', 'true').lower() == 'true'
+app.config['UPDATE_POLL_INTERVAL'] = int(os.environ.get('UPDATE_POLL_INTERVAL', 30))  # Seconds between checks for due updates
+app.config['COLLECT_REQUEST_POLL_INTERVAL'] = int(os.environ.get('COLLECT_REQUEST_POLL_INTERVAL', 5))  # Seconds between checks for manual collections
+
+# Metrics collection configuration
+app.config['METRICS_COLLECTION_MODE'] = os.environ.get('METRICS_COLLECTION_MODE', 'cluster')  # 'cluster' or 'nodes'
+app.config['METRICS_INTERVAL'] = int(os.environ.get('METRICS_INTERVAL', 30))  # Seconds between cycles on small clusters
+app.config['METRICS_MAX_INTERVAL'] = int(os.environ.get('METRICS_MAX_INTERVAL', 300))  # Upper bound as cycles get slower
+app.config['METRICS_INTERVAL_JITTER'] = float(os.environ.get('METRICS_INTERVAL_JITTER', 0.1))  # +/- fraction of the interval
+app.config['METRICS_COLLECTOR_WORKERS'] = int(os.environ.get('METRICS_COLLECTOR_WORKERS', 8))  # Parallel node workers
+app.config['METRICS_COLLECTOR_BACKEND'] = os.environ.get('METRICS_COLLECTOR_BACKEND', 'threads')  # 'threads' or 'async' (needs aiohttp)
+app.config['METRICS_ASYNC_CONNECTIONS'] = int(os.environ.get('METRICS_ASYNC_CONNECTIONS', 32))  # Open connections to the API host
+app.config['METRICS_ASYNC_PER_NODE'] = int(os.environ.get('METRICS_ASYNC_PER_NODE', 8))  # Concurrent guest requests per node
+app.config['METRICS_ASYNC_TIMEOUT'] = int(os.environ.get('METRICS_ASYNC_TIMEOUT', 60))  # Seconds for a whole async collection, unfinished nodes fail
+app.config['SNAPSHOT_MAX_AGE'] = int(os.environ.get('SNAPSHOT_MAX_AGE', 120))  # Seconds a collection snapshot is trusted
+app.config['GUEST_CONFIG_CACHE_SIZE'] = int(os.environ.get('GUEST_CONFIG_CACHE_SIZE', 5000))  # Cached guest configs (LRU)
+app.config['GUEST_CONFIG_CACHE_TTL'] = int(os.environ.get('GUEST_CONFIG_CACHE_TTL', 600))  # Seconds before a config is refetched
+app.config['METRICS_BULK_METHOD'] = os.environ.get('METRICS_BULK_METHOD', 'auto')  # 'auto', 'copy', 'executemany' or 'orm'
+app.config['METRICS_STORAGE_MODE'] = os.environ.get('METRICS_STORAGE_MODE', 'full')  # 'full' or 'delta' (changed guest samples only)
+app.config['METRICS_DELTA_TOLERANCE'] = float(os.environ.get('METRICS_DELTA_TOLERANCE', 1.0))  # Percentage points ignored in delta mode
+app.config['METRICS_DELTA_HEARTBEAT'] = int(os.environ.get('METRICS_DELTA_HEARTBEAT', 600))  # Seconds between stored samples of an unchanged guest
+
+# Metrics rollups and retention (days kept per tier)
+app.config['METRICS_ROLLUP_INTERVAL'] = int(os.environ.get('METRICS_ROLLUP_INTERVAL', 60))  # Seconds between compaction runs
+app.config['METRICS_RETENTION_DAYS'] = {
+    'raw': int(os.environ.get('METRICS_RETENTION_RAW_DAYS', 7)),
+    '1m': int(os.environ.get('METRICS_RETENTION_1M_DAYS', 14)),
+    '15m': int(os.environ.get('METRICS_RETENTION_15M_DAYS', 90)),
+    '1h': int(os.environ.get('METRICS_RETENTION_1H_DAYS', 730))
+}
+app.config['METRICS_ARCHIVE_DIR'] = os.environ.get('METRICS_ARCHIVE_DIR', '')  # Expired raw samples are kept here as one file per table and day (needs pyarrow); empty to just delete them
+app.config['METRICS_ARCHIVE_FORMAT'] = os.environ.get('METRICS_ARCHIVE_FORMAT', 'parquet')  # 'parquet' or 'arrow' (Arrow IPC)
+app.config['METRICS_ARCHIVE_COMPRESSION'] = os.environ.get('METRICS_ARCHIVE_COMPRESSION', 'zstd')  # 'zstd', 'lz4' or 'none'
+app.config['METRICS_PARTITIONING'] = os.environ.get('METRICS_PARTITIONING', 'false').lower() == 'true'  # Daily partitions, PostgreSQL only
+app.config['METRICS_PARTITION_DAYS_AHEAD'] = int(os.environ.get('METRICS_PARTITION_DAYS_AHEAD', 2))  # Partitions created ahead of time
+
+# In-memory buffer of the latest cycles, answers recent history and top-N without the database
+app.config['METRICS_BUFFER_CYCLES'] = int(os.environ.get('METRICS_BUFFER_CYCLES', 120))  # Cycles kept (an hour at 30 seconds)
+app.config['METRICS_BUFFER_MAX_MB'] = int(os.environ.get('METRICS_BUFFER_MAX_MB', 64))  # Memory budget; entities beyond it are not buffered
+app.config['METRICS_BUFFER_SYNC_INTERVAL'] = int(os.environ.get('METRICS_BUFFER_SYNC_INTERVAL', 5))  # Seconds between reads of new cycles when the worker collects
+
+# Dashboard log entries are queued and inserted in batches by a background writer
+app.config['LOG_SINK_ASYNC'] = os.environ.get('LOG_SINK_ASYNC', 'true').lower() == 'true'  # false commits every entry right away
+app.config['LOG_SINK_FLUSH_MS'] = int(os.environ.get('LOG_SINK_FLUSH_MS', 500))  # Longest an entry waits for its batch
+app.config['LOG_SINK_BATCH_SIZE'] = int(os.environ.get('LOG_SINK_BATCH_SIZE', 200))  # Entries per insert
+app.config['LOG_SINK_MAX_QUEUE'] = int(os.environ.get('LOG_SINK_MAX_QUEUE', 10000))  # Entries held before the policy applies
+app.config['LOG_SINK_POLICY'] = os.environ.get('LOG_SINK_POLICY', 'drop_oldest')  # 'drop_oldest', 'drop_newest' or 'block'
+
+# Live dashboard updates (Server-Sent Events on /api/stream)
+app.config['LIVE_UPDATE_POLL_INTERVAL'] = float(os.environ.get('LIVE_UPDATE_POLL_INTERVAL', 2))  # Seconds between checks for a new cycle
+app.config['LIVE_UPDATE_HEARTBEAT'] = int(os.environ.get('LIVE_UPDATE_HEARTBEAT', 15))  # Seconds between keepalives to idle clients
+
+# Prometheus /metrics: scrapers send 'Authorization: Bearer <token>', without a token only logged-in users may read it
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+
+# Shared Proxmox API session
+app.config['PROXMOX_POOL_SIZE'] = int(os.environ.get('PROXMOX_POOL_SIZE', max(10, app.config['METRICS_COLLECTOR_WORKERS'])))
+app.config['PROXMOX_TICKET_RENEW_AGE'] = int(os.environ.get('PROXMOX_TICKET_RENEW_AGE', 3600))  # Tickets expire after 2 hours
+app.config['PROXMOX_CHECK_INTERVAL'] = int(os.environ.get('PROXMOX_CHECK_INTERVAL', 30))  # Seconds a connection check is reused
+connection_manager.configure(
+    pool_size=app.config['PROXMOX_POOL_SIZE'],
+    ticket_renew_age=app.config['PROXMOX_TICKET_RENEW_AGE'],
+    check_interval=app.config['PROXMOX_CHECK_INTERVAL']
+)
+collection_scheduler.configure(
+    base_interval=app.config['METRICS_INTERVAL'],
+    max_interval=app.config['METRICS_MAX_INTERVAL'],
+    jitter=app.config['METRICS_INTERVAL_JITTER']
+)
+metrics_buffer.configure(
+    cycles=app.config['METRICS_BUFFER_CYCLES'],
+    max_bytes=app.config['METRICS_BUFFER_MAX_MB'] * 1024 * 1024
+)
+log_sink.configure(
+    flush_interval=app.config['LOG_SINK_FLUSH_MS'] / 1000,
+    batch_size=app.config['LOG_SINK_BATCH_SIZE'],
+    max_queue=app.config['LOG_SINK_MAX_QUEUE'],
+    policy=app.config['LOG_SINK_POLICY']
+)
+live_updates.configure(
+    poll_interval=app.config['LIVE_UPDATE_POLL_INTERVAL'],
+    heartbeat=app.config['LIVE_UPDATE_HEARTBEAT']
+)
+
 # Initialize extensions
 Session(app)
 
@@ -59,6 +149,10 @@ while retries > 0:
         with app.app_context():
             # Create tables if they don't exist
             db.create_all()
+            ensure_columns()
+            ensure_metric_indexes()
+            if app.config['METRICS_PARTITIONING']:
+                setup_partitioning(app.config['METRICS_PARTITION_DAYS_AHEAD'])
             
             # Verify tables were created
             from sqlalchemy import inspect
@@ -79,35 +173,15 @@ while retries > 0:
 if retries == 0:
     raise Exception("Could not connect to database after multiple attempts")
 
-# Initialize scheduler and jobs
-scheduler = BackgroundScheduler()
-
-def run_metrics_job():
-    try:
-        print("[Scheduler] Running scheduled metrics collection...")
-        with app.app_context():
-            collect_metrics_job()
-        print("[Scheduler] Scheduled metrics collection completed")
-    except Exception as e:
-        print(f"[Scheduler] Error during scheduled metrics collection: {str(e)}")
-
-def run_updates_check():
-    with app.app_context():
-        check_all_nodes_updates()
-
-scheduler.add_job(func=run_metrics_job, trigger="interval", seconds=30)  # Run every 30 seconds
-scheduler.add_job(func=run_updates_check, trigger="interval", hours=24)
-scheduler.start()
-print("[Scheduler] Started background jobs")
-
-# Run metrics collection immediately
-try:
-    print("[Scheduler] Running initial metrics collection...")
-    with app.app_context():
-        collect_metrics_job()
-    print("[Scheduler] Initial metrics collection completed")
-except Exception as e:
-    print(f"[Scheduler] Error during initial metrics collection: {str(e)}")
+# Scheduled jobs run in the web process unless a dedicated worker (worker.py) owns them
+scheduler = None
+if app.config['RUN_SCHEDULER']:
+    scheduler = BackgroundScheduler()
+    start_jobs(app, scheduler)
+else:
+    print("[Scheduler] RUN_SCHEDULER is disabled, scheduled jobs are left to the worker")
+    # The worker fills its own buffer; this process reads each new cycle from the latest state tables
+    metrics_buffer.follow(app, app.config['METRICS_BUFFER_SYNC_INTERVAL'])
 
 # Add before request handler
 @app.before_request
@@ -123,10 +197,15 @@ auth.register_routes(app)
 dashboard.register_routes(app)
 settings.register_routes(app)
 updates.register_routes(app)
+monitoring.register_routes(app)
+history.register_routes(app)
 
 # Shut down the scheduler when the app exits
 import atexit
-atexit.register(lambda: scheduler.shutdown())
+# Registered first so it runs last, after jobs that may still log have stopped
+atexit.register(log_sink.stop)
+if scheduler:
+    atexit.register(lambda: scheduler.shutdown())
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1 @@
+# Benchmarks, run from the project directory, e.g. python -m benchmarks.bench_bulk_writer
@@ -0,0 +1,71 @@
+"""Compare metrics ingestion rates of the ORM, executemany and COPY paths
+
+Usage (from the project directory):
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_bulk_writer --guests 1000 --cycles 5
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+from benchmarks.common import create_bench_app, print_table
+from models import db, HostMetrics, VMMetrics, ContainerMetrics, ClusterMetrics
+from utils.bulk_writer import write_metrics, _copy_supported
+
+
+def make_batches(nodes, guests):
+    """One collection cycle worth of rows"""
+    timestamp = datetime.utcnow()
+    hosts = [dict(node_name=f"pve{n}", ip_address=f"10.0.0.{n}", cpu_usage=random.random() * 100,
+                  cpu_cores=32, memory_usage=random.random() * 100, memory_total=256 * 1024 ** 3,
+                  disk_usage=random.random() * 100, uptime=86400, uptime_formatted='1d 0h 0m',
+                  timestamp=timestamp) for n in range(nodes)]
+    vms = [dict(node_name=f"pve{g % nodes}", vmid=100 + g, name=f"vm{g}", status='running',
+                cpu_usage=random.random() * 100, memory_usage=random.random() * 100,
+                disk_usage=random.random() * 100, timestamp=timestamp) for g in range(guests // 2)]
+    cts = [dict(node_name=f"pve{g % nodes}", container_id=100000 + g, name=f"ct{g}", status='running',
+                cpu_usage=random.random() * 100, memory_usage=random.random() * 100,
+                disk_usage=random.random() * 100, timestamp=timestamp) for g in range(guests - guests // 2)]
+    cluster = [dict(total_cpu=nodes * 32, used_cpu=50.0, total_memory=nodes * 256 * 1024 ** 3,
+                    used_memory=nodes * 128 * 1024 ** 3, total_disk=0, used_disk=0,
+                    node_count=nodes, timestamp=timestamp)]
+    return {HostMetrics: hosts, VMMetrics: vms, ContainerMetrics: cts, ClusterMetrics: cluster}
+
+
+def run(method, nodes, guests, cycles):
+    rows = 0
+    elapsed = 0.0
+    for _ in range(cycles):
+        batches = make_batches(nodes, guests)
+        started = time.perf_counter()
+        write_metrics(batches, method)
+        db.session.commit()
+        elapsed += time.perf_counter() - started
+        rows += sum(len(batch) for batch in batches.values())
+    return rows, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--nodes', type=int, default=10)
+    parser.add_argument('--guests', type=int, default=1000)
+    parser.add_argument('--cycles', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_bench_app(args.database_url)
+    with app.app_context():
+        db.create_all()
+        methods = ['orm', 'executemany'] + (['copy'] if _copy_supported() else [])
+        results = []
+        baseline = None
+        for method in methods:
+            rows, elapsed = run(method, args.nodes, args.guests, args.cycles)
+            rate = rows / elapsed if elapsed else 0
+            baseline = baseline or rate
+            results.append((method, rows, f"{elapsed:.3f}", f"{rate:,.0f}", f"{rate / baseline:.1f}x"))
+        print(f"{db.engine.dialect.name}: {args.nodes} nodes, {args.guests} guests, {args.cycles} cycles")
+        print_table(('method', 'rows', 'seconds', 'rows/s', 'vs orm'), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Measure collection, drain planning and dashboard queries against a fake cluster
+
+Each size gets its own FakeProxmoxServer. Reported per operation: Proxmox
+API calls, wall time, metrics rows written and rows/s, and peak Python
+memory allocated (tracemalloc, which slows things down a little; pass
+--no-memory for cleaner timings).
+
+Usage (from the project directory):
+    python -m benchmarks.bench_collector --sizes 10,100,1000,5000 --latency 2
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_collector --backends threads,async
+"""
+import argparse
+import time
+import tracemalloc
+import urllib3
+from benchmarks.common import create_bench_app, print_table
+from benchmarks.fake_proxmox import FakeCluster, FakeProxmoxServer
+from models import db, ProxmoxCredentials, HostMetrics, VMMetrics, ContainerMetrics, ClusterMetrics
+from utils.config_cache import guest_config_cache
+from utils.metrics_collector import collect_metrics_job
+from utils.proxmox_connection import connection_manager
+from utils.snapshot import get_latest_snapshot, publish_snapshot
+
+METRICS_MODELS = (HostMetrics, VMMetrics, ContainerMetrics, ClusterMetrics)
+
+
+def count_rows():
+    return sum(model.query.count() for model in METRICS_MODELS)
+
+
+def measure(server, operation, track_memory):
+    """Run operation() and return (api_calls, seconds, peak_bytes, result)"""
+    calls_before = server.total_calls
+    if track_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = operation()
+    finally:
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if track_memory else None
+        if track_memory:
+            tracemalloc.stop()
+    return server.total_calls - calls_before, elapsed, peak, result
+
+
+def make_drainer():
+    """NodeDrainer that starts migrations but does not poll for their completion"""
+    from utils.node_drainer import NodeDrainer
+
+    class PlanningDrainer(NodeDrainer):
+        def migrate_vm(self, node_name, vmid, target_node):
+            self.proxmox.nodes(node_name).qemu(vmid).migrate.post(target=target_node, online=1)
+            return True
+
+        def migrate_container(self, node_name, ctid, target_node):
+            self.proxmox.nodes(node_name).lxc(ctid).migrate.post(target=target_node, restart=1)
+            return True
+
+    return PlanningDrainer()
+
+
+def dashboard_queries(snapshot):
+    from utils.dashboard_summary import hosts_from_db, guest_counts_from_db, hosts_from_snapshot, guest_counts_from_snapshot
+
+    def from_db():
+        ClusterMetrics.query.order_by(ClusterMetrics.timestamp.desc()).first()
+        return hosts_from_db(), guest_counts_from_db()
+
+    def from_snapshot():
+        ClusterMetrics.query.order_by(ClusterMetrics.timestamp.desc()).first()
+        return hosts_from_snapshot(snapshot), guest_counts_from_snapshot(snapshot)
+
+    return from_db, from_snapshot
+
+
+def bench_size(app, guests, nodes, backends, latency, track_memory):
+    results = []
+    cluster = FakeCluster(nodes=nodes, guests=guests)
+    with FakeProxmoxServer(cluster, latency=latency) as server:
+        db.drop_all()
+        db.create_all()
+        db.session.add(ProxmoxCredentials(hostname=server.host, port=server.port, username='root@pam',
+                                          password='secret', verify_ssl=False))
+        db.session.commit()
+        connection_manager.invalidate()
+
+        def row(operation, calls, seconds, peak, rows=None):
+            rate = f"{rows / seconds:,.0f}" if rows else '-'
+            memory = f"{peak / 1024 ** 2:.1f}" if peak is not None else '-'
+            results.append((guests, nodes, operation, calls, f"{seconds:.3f}", rows if rows is not None else '-',
+                            rate, memory))
+
+        for backend in backends:
+            app.config['METRICS_COLLECTOR_BACKEND'] = backend
+            guest_config_cache.clear()
+            for label in ('cold', 'warm'):
+                rows_before = count_rows()
+                calls, seconds, peak, _ = measure(server, collect_metrics_job, track_memory)
+                row(f"collect {backend} ({label})", calls, seconds, peak, count_rows() - rows_before)
+
+        snapshot = get_latest_snapshot()
+        from_db, from_snapshot = dashboard_queries(snapshot)
+        calls, seconds, peak, _ = measure(server, from_db, track_memory)
+        row('dashboard (latest state)', calls, seconds, peak)
+        calls, seconds, peak, _ = measure(server, from_snapshot, track_memory)
+        row('dashboard (snapshot)', calls, seconds, peak)
+
+        drainer = make_drainer()
+        calls, seconds, peak, _ = measure(server, lambda: drainer.drain_node('pve1'), track_memory)
+        row('drain planning pve1', calls, seconds, peak)
+        publish_snapshot(None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--sizes', default='10,100,1000,5000', help='comma separated guest counts')
+    parser.add_argument('--nodes', type=int, default=None, help='default: one node per 50 guests, 2 to 32')
+    parser.add_argument('--backends', default='threads', help="comma separated: threads, async")
+    parser.add_argument('--mode', default='cluster', choices=('cluster', 'nodes'))
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to every API request')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc')
+    args = parser.parse_args()
+
+    urllib3.disable_warnings()
+    app = create_bench_app(args.database_url)
+    app.config['METRICS_COLLECTION_MODE'] = args.mode
+    results = []
+    with app.app_context():
+        for guests in (int(size) for size in args.sizes.split(',')):
+            nodes = args.nodes or max(2, min(32, guests // 50))
+            results.extend(bench_size(app, guests, nodes, args.backends.split(','),
+                                      args.latency / 1000, not args.no_memory))
+        print(f"{db.engine.dialect.name}, mode={args.mode}, latency={args.latency}ms")
+    print_table(('guests', 'nodes', 'operation', 'api calls', 'seconds', 'rows', 'rows/s', 'peak MiB'), results)
+
+
+if __name__ == '__main__':
+    main()
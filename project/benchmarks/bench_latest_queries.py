@@ -0,0 +1,132 @@
+"""Compare "latest row per entity" queries on a large metrics history
+
+Fills host_metrics and vm_metrics with --rows rows of history (skipped with
+--reuse when the tables are already filled), then times each query method
+of utils.latest_queries against the group-by patterns it replaced, and
+prints the query plan of each.
+
+Usage (from the project directory):
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_latest_queries --rows 10000000
+    python -m benchmarks.bench_latest_queries --database-url sqlite:////tmp/latest.db --rows 1000000
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from benchmarks.common import create_bench_app, print_table
+from models import db, HostMetrics, VMMetrics
+from utils.bulk_writer import write_rows
+from utils.latest_queries import latest_rows, _auto_method
+
+CHUNK = 100000
+
+
+def fill_history(rows, nodes, guests, interval=30):
+    """Insert whole collection cycles until about `rows` rows exist"""
+    cycles = max(1, rows // (nodes + guests))
+    start = datetime.utcnow() - timedelta(seconds=cycles * interval)
+    hosts, vms = [], []
+    started = time.perf_counter()
+    for cycle in range(cycles):
+        timestamp = start + timedelta(seconds=cycle * interval)
+        hosts.extend(dict(node_name=f"pve{n}", ip_address=f"10.0.0.{n}", cpu_usage=random.random() * 100,
+                          cpu_cores=32, memory_usage=random.random() * 100, memory_total=256 * 1024 ** 3,
+                          disk_usage=50.0, uptime=cycle * interval, uptime_formatted='', timestamp=timestamp)
+                     for n in range(nodes))
+        # Guests move to another node every 1000 cycles
+        vms.extend(dict(node_name=f"pve{(g + cycle // 1000) % nodes}", vmid=100 + g, name=f"vm{g}",
+                        status='running', cpu_usage=random.random() * 100, memory_usage=50.0,
+                        disk_usage=50.0, timestamp=timestamp)
+                   for g in range(guests))
+        if len(vms) >= CHUNK or cycle == cycles - 1:
+            write_rows(HostMetrics, hosts)
+            write_rows(VMMetrics, vms)
+            db.session.commit()
+            hosts, vms = [], []
+            print(f"\r{cycle + 1}/{cycles} cycles", end='', flush=True)
+    print(f"\nInserted {cycles * (nodes + guests):,} rows in {time.perf_counter() - started:.0f}s")
+
+
+def legacy_queries():
+    """The patterns used before utils.latest_queries"""
+    return {
+        'hosts': select(HostMetrics.node_name, HostMetrics.ip_address, func.max(HostMetrics.timestamp))
+        .group_by(HostMetrics.node_name, HostMetrics.ip_address),
+        'vms': select(VMMetrics.vmid).where(VMMetrics.node_name == 'pve0', VMMetrics.status == 'running').distinct(),
+    }
+
+
+def explain(statement):
+    """Query plan lines of a statement"""
+    engine = db.session.get_bind()
+    compiled = statement.compile(bind=engine)
+    params = tuple(compiled.params[name] for name in compiled.positiontup) if compiled.positional else compiled.params
+    prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if engine.dialect.name == 'postgresql' else 'EXPLAIN QUERY PLAN '
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(prefix + str(compiled), params).all()
+    return [' '.join(str(value) for value in row) for row in rows]
+
+
+def timed(statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = len(db.session.execute(statement).all())
+        timings.append(time.perf_counter() - started)
+    return count, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--nodes', type=int, default=16)
+    parser.add_argument('--guests', type=int, default=500)
+    parser.add_argument('--reuse', action='store_true', help='keep existing history')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-plans', action='store_true')
+    args = parser.parse_args()
+
+    app = create_bench_app(args.database_url)
+    with app.app_context():
+        if not args.reuse:
+            db.drop_all()
+        db.create_all()
+        if not args.reuse or not db.session.query(VMMetrics.id).first():
+            fill_history(args.rows, args.nodes, args.guests)
+            if db.engine.dialect.name == 'postgresql':
+                with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                    connection.exec_driver_sql('VACUUM ANALYZE host_metrics')
+                    connection.exec_driver_sql('VACUUM ANALYZE vm_metrics')
+            else:
+                db.session.execute(db.text('ANALYZE'))
+                db.session.commit()
+
+        newest = db.session.query(func.max(VMMetrics.timestamp)).scalar()
+        since = newest - timedelta(minutes=10)
+        methods = ['row_number', 'max_join'] + (['distinct_on'] if db.engine.dialect.name == 'postgresql' else [])
+        queries = [(f"legacy {name}", statement) for name, statement in legacy_queries().items()]
+        for method in methods:
+            queries += [
+                (f"{method} hosts", latest_rows(HostMetrics, (HostMetrics.node_name,), method=method)),
+                (f"{method} vms", latest_rows(VMMetrics, (VMMetrics.vmid,), method=method)),
+                (f"{method} vms 10m", latest_rows(VMMetrics, (VMMetrics.vmid,), since=since, method=method)),
+            ]
+
+        results = []
+        for label, statement in queries:
+            count, seconds = timed(statement, args.repeat)
+            results.append((label, count, f"{seconds * 1000:.1f}"))
+            if not args.no_plans:
+                print(f"\n== {label}")
+                print('\n'.join(explain(statement)))
+
+        total = db.session.query(func.count(VMMetrics.id)).scalar() + db.session.query(func.count(HostMetrics.id)).scalar()
+        print(f"\n{db.engine.dialect.name}: {total:,} rows, auto method is {_auto_method(db.engine.dialect)}")
+    print_table(('query', 'rows', 'median ms'), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Compare reads from the in-memory metrics buffer with the database queries it replaces
+
+Stores --cycles collection cycles of --nodes hosts and --guests VMs both in
+the database and in utils.metrics_buffer, then times recent history of one
+entity and top-N by latest value and by window average, once answered by
+the buffer and once by the database fallback.
+
+Usage (from the project directory):
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_metrics_buffer --guests 2000
+    python -m benchmarks.bench_metrics_buffer --database-url sqlite:////tmp/buffer.db
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from benchmarks.common import create_bench_app, print_table
+from models import db, HostMetrics, VMMetrics, ContainerMetrics
+from utils.bulk_writer import write_rows
+from utils.history import _raw_samples
+from utils.metrics_buffer import metrics_buffer, top_entities
+
+
+def make_cycles(cycles, nodes, guests, interval=30):
+    """(timestamp, batches) per cycle, ending now, in the shape the collector appends"""
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(seconds=(cycles - 1) * interval)
+    for cycle in range(cycles):
+        timestamp = start + timedelta(seconds=cycle * interval)
+        yield timestamp, {
+            HostMetrics: [dict(node_name=f"pve{n}", cpu_usage=random.random() * 100, memory_usage=50.0,
+                               disk_usage=50.0, timestamp=timestamp) for n in range(nodes)],
+            VMMetrics: [dict(vmid=100 + g, name=f"vm{g}", node_name=f"pve{g % nodes}", status='running',
+                             cpu_usage=random.random() * 100, memory_usage=50.0, disk_usage=50.0,
+                             timestamp=timestamp) for g in range(guests)],
+            ContainerMetrics: [],
+        }
+
+
+def timed(read, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = len(read())
+        timings.append(time.perf_counter() - started)
+    return count, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--cycles', type=int, default=120)
+    parser.add_argument('--nodes', type=int, default=16)
+    parser.add_argument('--guests', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_bench_app(args.database_url)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        metrics_buffer.configure(cycles=args.cycles, max_bytes=1024 * 1024 * 1024)
+        metrics_buffer.clear()
+        for timestamp, batches in make_cycles(args.cycles, args.nodes, args.guests):
+            write_rows(HostMetrics, batches[HostMetrics])
+            write_rows(VMMetrics, batches[VMMetrics])
+            metrics_buffer.append(timestamp, batches)
+        db.session.commit()
+        if db.engine.dialect.name == 'postgresql':
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.exec_driver_sql('VACUUM ANALYZE host_metrics')
+                connection.exec_driver_sql('VACUUM ANALYZE vm_metrics')
+        else:
+            db.session.execute(db.text('ANALYZE'))
+            db.session.commit()
+
+        since = metrics_buffer.oldest()
+        until = datetime.utcnow() + timedelta(seconds=1)
+        reads = [
+            ('history vm', lambda: _raw_samples('vm', 100 + args.guests // 2, since, until)),
+            ('history host', lambda: _raw_samples('host', 'pve0', since, until)),
+            ('top 10 vms latest', lambda: top_entities('vm', 'cpu', 10)),
+            ('top 10 vms 30m avg', lambda: top_entities('vm', 'cpu', 10, timedelta(minutes=30))),
+        ]
+
+        results = []
+        buffered = [timed(read, args.repeat) for _, read in reads]
+        # Without cycles in memory every read falls back to the database
+        metrics_buffer.clear()
+        fallback = [timed(read, args.repeat) for _, read in reads]
+        for (label, _), (count, memory), (_, database) in zip(reads, buffered, fallback):
+            results.append((label, count, f"{memory * 1000:.2f}", f"{database * 1000:.2f}",
+                            f"{database / memory:.0f}x"))
+
+        print(f"\n{db.engine.dialect.name}: {args.cycles} cycles of {args.nodes} hosts and {args.guests} VMs")
+    print_table(('read', 'rows', 'buffer ms', 'database ms', 'speedup'), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""Local stand-in for the Proxmox VE REST API
+
+Simulates a cluster of N nodes and M guests (half VMs, half containers)
+behind HTTPS with a self-signed certificate, so the collector, drainer and
+dashboard can be exercised at scale without a real cluster. Only the
+endpoints this project uses are implemented.
+
+Usage (from the project directory):
+    python -m benchmarks.fake_proxmox --nodes 10 --guests 1000 --latency 5 --port 8006
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import ssl
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from utils.instrumentation import api_endpoint
+
+GiB = 1024 ** 3
+
+
+class NotFound(Exception):
+    pass
+
+
+class FakeCluster:
+    """In-memory cluster state answering Proxmox API paths"""
+
+    def __init__(self, nodes=3, guests=10, seed=1):
+        rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.nodes = {}
+        for index in range(nodes):
+            name = f"pve{index + 1}"
+            self.nodes[name] = {
+                'node': name, 'status': 'online', 'cpu': round(rng.uniform(0.05, 0.6), 4),
+                'maxcpu': 32, 'mem': rng.randint(32, 192) * GiB, 'maxmem': 256 * GiB,
+                'disk': rng.randint(10, 80) * GiB, 'maxdisk': 100 * GiB,
+                'uptime': rng.randint(3600, 90 * 86400), 'ip': f"10.0.{index // 250}.{index % 250 + 1}"
+            }
+        node_names = list(self.nodes)
+        self.guests = {}
+        for index in range(guests):
+            guest_type = 'qemu' if index % 2 == 0 else 'lxc'
+            vmid = 100 + index
+            maxmem = rng.choice([1, 2, 4, 8, 16]) * GiB
+            guest = {
+                'type': guest_type, 'vmid': vmid, 'node': node_names[index % len(node_names)],
+                'name': f"{'vm' if guest_type == 'qemu' else 'ct'}{vmid}",
+                'status': 'running' if rng.random() < 0.9 else 'stopped',
+                'cpus': rng.choice([1, 2, 4, 8]), 'maxmem': maxmem,
+                'mem': int(maxmem * rng.uniform(0.1, 0.9)),
+                'maxdisk': rng.choice([8, 16, 32, 64]) * GiB,
+                'digest': f"{rng.getrandbits(160):040x}"
+            }
+            guest['cpu'] = round(rng.uniform(0, 1), 4) if guest['status'] == 'running' else 0
+            guest['disk'] = int(guest['maxdisk'] * rng.uniform(0.1, 0.9)) if guest_type == 'lxc' else 0
+            self.guests[vmid] = guest
+        self.tasks = []
+
+    # Response builders
+
+    def _node_resource(self, node):
+        return {'type': 'node', 'id': f"node/{node['node']}", **{k: v for k, v in node.items() if k != 'ip'}}
+
+    def _guest_current(self, guest):
+        current = {
+            'vmid': guest['vmid'], 'name': guest['name'], 'status': guest['status'],
+            'cpu': guest['cpu'], 'cpus': guest['cpus'], 'mem': guest['mem'], 'maxmem': guest['maxmem'],
+            'disk': guest['disk'], 'maxdisk': guest['maxdisk'], 'uptime': 3600 if guest['status'] == 'running' else 0
+        }
+        return current
+
+    def _guest_config(self, guest):
+        size = f"{guest['maxdisk'] // GiB}G"
+        if guest['type'] == 'qemu':
+            return {'name': guest['name'], 'cores': guest['cpus'], 'memory': guest['maxmem'] // (1024 ** 2),
+                    'scsi0': f"ceph:vm-{guest['vmid']}-disk-0,size={size}", 'digest': guest['digest']}
+        return {'hostname': guest['name'], 'cores': guest['cpus'], 'memory': guest['maxmem'] // (1024 ** 2),
+                'rootfs': f"ceph:subvol-{guest['vmid']}-disk-0,size={size}", 'digest': guest['digest']}
+
+    def _guest(self, node, guest_type, vmid):
+        guest = self.guests.get(int(vmid))
+        if guest is None or guest['node'] != node or guest['type'] != guest_type:
+            raise NotFound(f"Configuration file 'nodes/{node}/{guest_type}/{vmid}.conf' does not exist")
+        return guest
+
+    def _node(self, name):
+        if name not in self.nodes:
+            raise NotFound(f"no such cluster node '{name}'")
+        return self.nodes[name]
+
+    def _add_task(self, task_type, vmid, node):
+        now = int(time.time())
+        upid = f"UPID:{node}:0000{len(self.tasks):04X}:00000000:{now:08X}:{task_type}:{vmid}:root@pam:"
+        self.tasks.append({'upid': upid, 'type': task_type, 'id': str(vmid), 'node': node,
+                           'starttime': now, 'endtime': now, 'status': 'OK', 'user': 'root@pam'})
+        return upid
+
+    def get(self, path, params=None):
+        """Answer a GET request for an API path (without the /api2/json prefix)"""
+        with self._lock:
+            parts = path.strip('/').split('/')
+            if path == 'version':
+                return {'version': '8.2.2', 'release': '8.2', 'repoid': 'fake'}
+            if path == 'cluster/resources':
+                resources = [self._node_resource(node) for node in self.nodes.values()]
+                for guest in self.guests.values():
+                    current = self._guest_current(guest)
+                    resources.append({'type': guest['type'], 'id': f"{guest['type']}/{guest['vmid']}",
+                                      'node': guest['node'], **current})
+                for node in self.nodes:
+                    resources.append({'type': 'storage', 'id': f"storage/{node}/local", 'node': node,
+                                      'storage': 'local', 'disk': 20 * GiB, 'maxdisk': 100 * GiB})
+                kind = (params or {}).get('type')
+                if kind == 'vm':
+                    resources = [res for res in resources if res['type'] in ('qemu', 'lxc')]
+                elif kind:
+                    resources = [res for res in resources if res['type'] == kind]
+                return resources
+            if path == 'cluster/tasks':
+                return list(self.tasks[-500:])
+            if path == 'nodes':
+                return [{'node': node['node'], 'status': node['status'], 'cpu': node['cpu'],
+                         'maxcpu': node['maxcpu'], 'mem': node['mem'], 'maxmem': node['maxmem'],
+                         'uptime': node['uptime']} for node in self.nodes.values()]
+            if len(parts) >= 3 and parts[0] == 'nodes':
+                node = self._node(parts[1])
+                rest = parts[2:]
+                if rest == ['status']:
+                    return {'cpu': node['cpu'], 'cpuinfo': {'cpus': node['maxcpu']}, 'uptime': node['uptime'],
+                            'memory': {'used': node['mem'], 'total': node['maxmem']},
+                            'rootfs': {'used': node['disk'], 'total': node['maxdisk']}}
+                if rest == ['network']:
+                    return [{'iface': 'eno1', 'type': 'eth'},
+                            {'iface': 'vmbr0', 'type': 'bridge', 'address': node['ip'], 'cidr': f"{node['ip']}/24"}]
+                if rest in (['qemu'], ['lxc']):
+                    return [{'vmid': guest['vmid'], 'name': guest['name'], 'status': guest['status'],
+                             'cpu': guest['cpu'], 'cpus': guest['cpus'], 'mem': guest['mem'],
+                             'maxmem': guest['maxmem']}
+                            for guest in self.guests.values()
+                            if guest['node'] == node['node'] and guest['type'] == rest[0]]
+                if len(rest) >= 3 and rest[0] in ('qemu', 'lxc'):
+                    guest = self._guest(node['node'], rest[0], rest[1])
+                    if rest[2:] == ['status', 'current']:
+                        return self._guest_current(guest)
+                    if rest[2:] == ['config']:
+                        return self._guest_config(guest)
+                if len(rest) == 3 and rest[0] == 'tasks' and rest[2] == 'status':
+                    return {'upid': rest[1], 'status': 'stopped', 'exitstatus': 'OK'}
+            raise NotFound(f"Method 'GET /{path}' not implemented")
+
+    def post(self, path, params=None):
+        """Answer a POST request; migrations complete instantly"""
+        params = params or {}
+        with self._lock:
+            parts = path.strip('/').split('/')
+            if len(parts) >= 5 and parts[0] == 'nodes' and parts[2] in ('qemu', 'lxc'):
+                guest = self._guest(parts[1], parts[2], parts[3])
+                action = parts[4:]
+                if action == ['migrate']:
+                    target = params.get('target')
+                    self._node(target)
+                    source = guest['node']
+                    guest['node'] = target
+                    return self._add_task('qmigrate' if guest['type'] == 'qemu' else 'vzmigrate', guest['vmid'], source)
+                if action in (['status', 'shutdown'], ['status', 'stop']):
+                    guest['status'] = 'stopped'
+                    guest['cpu'] = 0
+                    return self._add_task('qmshutdown' if guest['type'] == 'qemu' else 'vzshutdown',
+                                          guest['vmid'], guest['node'])
+            raise NotFound(f"Method 'POST /{path}' not implemented")
+
+
+def _self_signed_certificate(directory):
+    """Write a throwaway certificate and key for localhost, return their paths"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'localhost')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, 'cert.pem')
+    key_path = os.path.join(directory, 'key.pem')
+    with open(cert_path, 'wb') as cert_file:
+        cert_file.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as key_file:
+        key_file.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                         serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+_API_PREFIX = re.compile(r'^/api2/json/?')
+
+
+class FakeProxmoxServer:
+    """HTTPS server in a background thread answering from a FakeCluster
+
+    Args:
+        cluster: the FakeCluster to serve
+        latency: seconds added to every request
+        port: 0 picks a free port
+    """
+
+    def __init__(self, cluster, latency=0.0, host='127.0.0.1', port=0):
+        self.cluster = cluster
+        self.latency = latency
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        self._tempdir = tempfile.TemporaryDirectory()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json;charset=UTF-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self, method):
+                url = urlparse(self.path)
+                path = _API_PREFIX.sub('', url.path)
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                if method == 'POST':
+                    length = int(self.headers.get('Content-Length') or 0)
+                    params.update({key: values[-1] for key, values in
+                                   parse_qs(self.rfile.read(length).decode()).items()})
+                server.record(method, path)
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if path == 'access/ticket' and method == 'POST':
+                    self._reply(200, {'data': {'ticket': 'PVE:root@pam:00000000::fake', 'username': params.get('username'),
+                                               'CSRFPreventionToken': '00000000:fake'}})
+                    return
+                if 'PVEAuthCookie' not in (self.headers.get('Cookie') or '') and \
+                        not (self.headers.get('Authorization') or '').startswith('PVEAPIToken='):
+                    self._reply(401, {'data': None})
+                    return
+                try:
+                    data = server.cluster.get(path, params) if method == 'GET' else server.cluster.post(path, params)
+                    self._reply(200, {'data': data})
+                except NotFound as e:
+                    self._reply(500, {'data': None, 'message': str(e)})
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*_self_signed_certificate(self._tempdir.name))
+        self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = None
+
+    def record(self, method, path):
+        with self._calls_lock:
+            self.calls[f"{method} {api_endpoint(path)}"] += 1
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self._calls_lock:
+            self.calls.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-proxmox', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._tempdir.cleanup()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--guests', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to every request')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8006)
+    args = parser.parse_args()
+
+    server = FakeProxmoxServer(FakeCluster(args.nodes, args.guests), args.latency / 1000, args.host, args.port)
+    print(f"Fake Proxmox API with {args.nodes} nodes and {args.guests} guests on https://{server.host}:{server.port}")
+    print("Log in with any user and password, e.g. root@pam / secret")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
-import requests
-from proxmoxer import ProxmoxAPI
 import time
 from sqlalchemy.exc import OperationalError
 
@@ -28,32 +26,25 @@ class ProxmoxCredentials(db.Model):
     hostname = db.Column(db.String(255), nullable=False)
     username = db.Column(db.String(255), nullable=True)
     password = db.Column(db.String(255), nullable=True)
+    token_name = db.Column(db.String(255), nullable=True)  # API token ID, used together with username
+    token_value = db.Column(db.String(255), nullable=True)  # API token secret
     port = db.Column(db.Integer, default=8006)
     verify_ssl = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    @property
+    def auth_type(self):
+        return 'API Token' if self.token_name and self.token_value else 'Password Auth'
+
+    def has_auth(self):
+        """True if either a password or an API token is configured"""
+        return bool(self.username and (self.password or (self.token_name and self.token_value)))
+
     def get_proxmox_connection(self):
-        verify = self.verify_ssl
-        if not verify:
-            requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
-        
-        try:
-            proxmox = ProxmoxAPI(
-                self.hostname,
-                user=self.username,
-                password=self.password,
-                verify_ssl=verify,
-                port=self.port
-            )
-            
-            # Test connection
-            nodes = proxmox.nodes.get()
-            print(f"[DEBUG] Successfully connected! Found {len(nodes)} nodes")
-            return proxmox
-        except Exception as e:
-            print(f"[ERROR] Failed to connect: {str(e)}")
-            raise
+        """Return the shared, pooled Proxmox API session for these credentials"""
+        from utils.proxmox_connection import connection_manager
+        return connection_manager.get_connection(self)
 
 class NodeUpdateStatus(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -75,6 +66,11 @@ class HostMetrics(db.Model):
     uptime_formatted = db.Column(db.String(255))  # Human readable format
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_host_metrics_node_time', 'node_name', 'timestamp'),
+        db.Index('ix_host_metrics_time', 'timestamp'),
+    )
+
 class ClusterMetrics(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     total_cpu = db.Column(db.Float)
@@ -86,6 +82,10 @@ class ClusterMetrics(db.Model):
     node_count = db.Column(db.Integer)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_cluster_metrics_time', 'timestamp'),
+    )
+
 class VMMetrics(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     node_name = db.Column(db.String(255), nullable=False)
@@ -97,6 +97,12 @@ class VMMetrics(db.Model):
     disk_usage = db.Column(db.Float)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_vm_metrics_vmid_time', 'vmid', 'timestamp'),
+        db.Index('ix_vm_metrics_node_time', 'node_name', 'timestamp'),
+        db.Index('ix_vm_metrics_time', 'timestamp'),
+    )
+
 class ContainerMetrics(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     node_name = db.Column(db.String(255), nullable=False)
@@ -108,6 +114,88 @@ class ContainerMetrics(db.Model):
     disk_usage = db.Column(db.Float)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_container_metrics_ct_time', 'container_id', 'timestamp'),
+        db.Index('ix_container_metrics_node_time', 'node_name', 'timestamp'),
+        db.Index('ix_container_metrics_time', 'timestamp'),
+    )
+
+class LatestHostState(db.Model):
+    """Most recent metrics of each node, upserted by the collector every cycle"""
+    __tablename__ = 'latest_host_state'
+
+    node_name = db.Column(db.String(255), primary_key=True)
+    ip_address = db.Column(db.String(255))
+    cpu_usage = db.Column(db.Float)
+    cpu_cores = db.Column(db.Integer)
+    memory_usage = db.Column(db.Float)
+    memory_total = db.Column(db.BigInteger)  # Store in bytes
+    disk_usage = db.Column(db.Float)
+    uptime = db.Column(db.Integer)
+    uptime_formatted = db.Column(db.String(255))
+    cycle_id = db.Column(db.Integer)  # ClusterMetrics id of the cycle that wrote the row
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+class LatestGuestState(db.Model):
+    """Most recent metrics of each VM ('qemu') or container ('lxc')"""
+    __tablename__ = 'latest_guest_state'
+
+    guest_type = db.Column(db.String(8), primary_key=True)
+    vmid = db.Column(db.Integer, primary_key=True)
+    node_name = db.Column(db.String(255), nullable=False)
+    name = db.Column(db.String(255))
+    status = db.Column(db.String(50))
+    cpu_usage = db.Column(db.Float)
+    memory_usage = db.Column(db.Float)
+    disk_usage = db.Column(db.Float)
+    cycle_id = db.Column(db.Integer)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_latest_guest_state_node', 'node_name', 'status'),
+    )
+
+class MetricsRollup(db.Model):
+    """Downsampled host/VM/container metrics (min/avg/max per time bucket)"""
+    __tablename__ = 'metrics_rollup'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tier = db.Column(db.String(8), nullable=False)  # '1m', '15m' or '1h'
+    entity_type = db.Column(db.String(16), nullable=False)  # 'host', 'vm' or 'container'
+    entity_id = db.Column(db.String(255), nullable=False)  # Node name or vmid
+    node_name = db.Column(db.String(255))  # Node the entity was last seen on in the bucket
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    samples = db.Column(db.Integer, default=0)
+    cpu_min = db.Column(db.Float)
+    cpu_avg = db.Column(db.Float)
+    cpu_max = db.Column(db.Float)
+    memory_min = db.Column(db.Float)
+    memory_avg = db.Column(db.Float)
+    memory_max = db.Column(db.Float)
+    disk_min = db.Column(db.Float)
+    disk_avg = db.Column(db.Float)
+    disk_max = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_metrics_rollup_entity', 'tier', 'entity_type', 'entity_id', 'bucket_start'),
+        db.Index('ix_metrics_rollup_bucket', 'tier', 'bucket_start'),
+    )
+
+class RollupWatermark(db.Model):
+    """Point up to which a rollup tier has been compacted"""
+    __tablename__ = 'rollup_watermark'
+
+    tier = db.Column(db.String(8), primary_key=True)
+    processed_until = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class CollectionRequest(db.Model):
+    """Manual metrics collection asked for by a process that is not the collector leader"""
+    __tablename__ = 'collection_request'
+
+    id = db.Column(db.Integer, primary_key=True)
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class DashboardLog(db.Model):
     __tablename__ = 'dashboard_log'
     
@@ -118,6 +206,20 @@ class DashboardLog(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     details = db.Column(db.Text)
 
+    __table_args__ = (
+        db.Index('ix_dashboard_log_status_time', 'status', 'created_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'node_name': self.node_name,
+            'action': self.action,
+            'status': self.status,
+            'created_at': self.created_at.isoformat(),
+            'details': self.details
+        }
+
     def __repr__(self):
         return f'<DashboardLog {self.id}: {self.action}>'
 
@@ -170,3 +272,33 @@ class User(db.Model):
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
+
+# Columns added to tables that existed before them; db.create_all() does not alter existing tables
+ADDED_COLUMNS = (
+    (ProxmoxCredentials, 'token_name'),
+    (ProxmoxCredentials, 'token_value'),
+)
+
+def ensure_columns():
+    """Add columns from ADDED_COLUMNS that an existing database does not have yet"""
+    from sqlalchemy import inspect, text
+    from sqlalchemy.exc import SQLAlchemyError
+
+    engine = db.engine
+    preparer = engine.dialect.identifier_preparer
+    for model, name in ADDED_COLUMNS:
+        table = model.__table__
+        if name in {column['name'] for column in inspect(engine).get_columns(table.name)}:
+            continue
+        column = table.c[name]
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                    f"{preparer.format_column(column)} {column.type.compile(engine.dialect)}"
+                ))
+            print(f"[DEBUG] Added column {table.name}.{name}")
+        except SQLAlchemyError:
+            # Another process starting at the same time may have added it first
+            if name not in {column['name'] for column in inspect(engine).get_columns(table.name)}:
+                raise
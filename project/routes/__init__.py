@@ -2,5 +2,7 @@ from . import auth
 from . import dashboard
 from . import settings
 from . import updates
+from . import monitoring
+from . import history
 
-__all__ = ['auth', 'dashboard', 'settings', 'updates']
+__all__ = ['auth', 'dashboard', 'settings', 'updates', 'monitoring', 'history']
@@ -1,21 +1,37 @@
-from flask import render_template, jsonify, session, redirect, request
+from flask import render_template, jsonify, session, redirect, request, Response
 from datetime import datetime, timedelta
 import os
-import json
 from models import (
     HostMetrics, VMMetrics, ContainerMetrics, 
-    ClusterMetrics, DashboardLog, NodeUpdateStatus, db
+    DashboardLog, db
 )
-from utils.node_drainer import NodeDrainer
+from utils.node_drainer import NodeDrainer, get_node_vms
+from utils.dashboard_summary import dashboard_summary
+from utils.delta_storage import recent_guest_samples
+from utils.collection_scheduler import collection_scheduler
+from utils.jobs import trigger_collection
+from utils.live_updates import live_updates
+from utils.log_sink import log_sink
+from utils.http_cache import conditional, metrics_version, logs_version
+from utils.latest_queries import latest_hosts
+from utils.metrics_buffer import metrics_buffer, top_entities, METRICS
+from utils.rollups import RAW_SOURCES
 
 # Initialize NodeDrainer
 node_drainer = NodeDrainer()
 
+# Page sizes for GET /api/logs
+DEFAULT_LOG_PAGE = 200
+MAX_LOG_PAGE = 1000
+
+# Most entries returned by GET /api/metrics/top
+MAX_TOP = 100
+
 def verify_migration_completion(node_name, vm_id):
     """Verify if a VM/container has completed migration by checking config files"""
     try:
         # Check if config exists on other nodes
-        for host in HostMetrics.query.with_entities(HostMetrics.node_name).distinct():
+        for host in latest_hosts(since=datetime.utcnow() - timedelta(hours=1)):
             if host.node_name != node_name:
                 # This is a placeholder path - adjust based on actual Proxmox config location
                 config_path = f"/etc/pve/nodes/{host.node_name}/qemu-server/{vm_id}.conf"
@@ -26,20 +42,6 @@ def verify_migration_completion(node_name, vm_id):
         print(f"Error verifying migration: {str(e)}")
         return False
 
-def get_node_vms(node_name):
-    """Get all VMs and containers running on a node"""
-    vms = VMMetrics.query.filter_by(
-        node_name=node_name,
-        status='running'
-    ).with_entities(VMMetrics.vmid).distinct().all()
-    
-    containers = ContainerMetrics.query.filter_by(
-        node_name=node_name,
-        status='running'
-    ).with_entities(ContainerMetrics.container_id).distinct().all()
-    
-    return [vm.vmid for vm in vms], [ct.container_id for ct in containers]
-
 def register_routes(app):
     # Drain node endpoint
     @app.route('/api/nodes/drain', methods=['POST'])
@@ -59,17 +61,10 @@ def register_routes(app):
             
             # Log any failures
             if failed_vms or failed_containers:
-                log = DashboardLog(
-                    node_name=node_name,
-                    action=f"Some VMs/containers could not be migrated",
-                    status='warning',
-                    details=json.dumps({
-                        'failed_vms': failed_vms,
-                        'failed_containers': failed_containers
-                    })
-                )
-                db.session.add(log)
-                db.session.commit()
+                log_sink.log(node_name, f"Some VMs/containers could not be migrated", 'warning', {
+                    'failed_vms': failed_vms,
+                    'failed_containers': failed_containers
+                })
             
             return jsonify({
                 'message': 'Drain process completed',
@@ -158,189 +153,160 @@ def register_routes(app):
         if 'user_id' not in session:
             return redirect('/')
         
-        print("\n[DEBUG] ===== Dashboard Metrics =====")
-        
-        # Get cluster-wide metrics
-        cluster_metrics = ClusterMetrics.query.order_by(ClusterMetrics.timestamp.desc()).first()
-        print(f"[DEBUG] Cluster metrics found: {cluster_metrics is not None}")
-        if cluster_metrics:
-            print(f"[DEBUG] Cluster metrics timestamp: {cluster_metrics.timestamp}")
-            print(f"[DEBUG] Total CPU: {cluster_metrics.total_cpu}")
-            print(f"[DEBUG] Used CPU: {cluster_metrics.used_cpu}")
-            print(f"[DEBUG] Total Memory: {cluster_metrics.total_memory}")
-            print(f"[DEBUG] Used Memory: {cluster_metrics.used_memory}")
-            print(f"[DEBUG] Node Count: {cluster_metrics.node_count}")
-        
-        # Get individual node metrics
-        hosts_metrics = {}
-        latest_host_metrics = db.session.query(
-            HostMetrics.node_name,
-            db.func.max(HostMetrics.timestamp).label('max_timestamp')
-        ).group_by(HostMetrics.node_name).all()
-        
-        print(f"[DEBUG] Found {len(latest_host_metrics)} host metrics entries")
-        for host_name, _ in latest_host_metrics:
-            metric = HostMetrics.query.filter_by(node_name=host_name).order_by(HostMetrics.timestamp.desc()).first()
-            print(f"[DEBUG] Host {host_name} metrics found: {metric is not None}")
-            if metric:
-                update_status = NodeUpdateStatus.query.filter_by(node_name=host_name).first()
-                hosts_metrics[host_name] = {
-                    'ip_address': metric.ip_address,
-                    'cpu_usage': metric.cpu_usage,
-                    'cpu_cores': metric.cpu_cores,
-                    'memory_usage': metric.memory_usage,
-                    'memory_total': metric.memory_total,
-                    'disk_usage': metric.disk_usage,
-                    'uptime': metric.uptime,
-                    'uptime_formatted': metric.uptime_formatted,
-                    'update_status': {
-                        'updates_available': update_status.updates_available if update_status else 0,
-                        'reboot_required': update_status.reboot_required if update_status else False,
-                        'last_checked': update_status.last_checked if update_status else None
-                    }
-                }
-
-        # Calculate cluster utilization percentages
-        cpu_percent = (cluster_metrics.used_cpu / cluster_metrics.total_cpu) * 100 if cluster_metrics and cluster_metrics.total_cpu > 0 else 0
-        memory_percent = (cluster_metrics.used_memory / cluster_metrics.total_memory) * 100 if cluster_metrics and cluster_metrics.total_memory > 0 else 0
-        print(f"[DEBUG] CPU Usage: {cpu_percent:.1f}%")
-        print(f"[DEBUG] Memory Usage: {memory_percent:.1f}%")
-
-        vm_metrics = db.session.query(
-            VMMetrics.vmid,
-            db.func.max(VMMetrics.timestamp).label('max_timestamp')
-        ).group_by(VMMetrics.vmid).all()
-        
-        print(f"[DEBUG] Found {len(vm_metrics)} VM metrics entries")
-        total_vms = len(vm_metrics)
-        online_vms = VMMetrics.query.filter(
-            db.tuple_(VMMetrics.vmid, VMMetrics.timestamp).in_([
-                (vm[0], vm[1]) for vm in vm_metrics
-            ]),
-            VMMetrics.status == 'running'
-        ).count()
-
-        container_metrics = db.session.query(
-            ContainerMetrics.container_id,
-            db.func.max(ContainerMetrics.timestamp).label('max_timestamp')
-        ).group_by(ContainerMetrics.container_id).all()
-        
-        print(f"[DEBUG] Found {len(container_metrics)} container metrics entries")
-        total_containers = len(container_metrics)
-        online_containers = ContainerMetrics.query.filter(
-            db.tuple_(ContainerMetrics.container_id, ContainerMetrics.timestamp).in_([
-                (ct[0], ct[1]) for ct in container_metrics
-            ]),
-            ContainerMetrics.status == 'running'
-        ).count()
-        
-        # Sort hosts by node name
-        sorted_hosts = dict(sorted(hosts_metrics.items()))
-        
-        # Format memory values to GiB
-        total_memory_gib = f"{cluster_metrics.total_memory / (1024**3):.1f}GiB" if cluster_metrics else "0GiB"
-        used_memory_gib = f"{cluster_metrics.used_memory / (1024**3):.1f}GiB" if cluster_metrics else "0GiB"
-
-        metrics = {
-            'vms': {
-                'current': online_vms,
-                'total': total_vms
-            },
-            'containers': {
-                'current': online_containers,
-                'total': total_containers
-            },
-            'cpu': {
-                'usage': round(cpu_percent),
-                'cores': cluster_metrics.total_cpu if cluster_metrics else 0
-            },
-            'memory': {
-                'usage': round(memory_percent),
-                'used': used_memory_gib,
-                'total': total_memory_gib
-            }
-        }
-
+        # Computed once per collection cycle and shared with /api/dashboard/summary
+        _, summary, _ = dashboard_summary.get()
         return render_template('dashboard.html',
-                            hosts=sorted_hosts,
-                            metrics=metrics,
-                            total_nodes=cluster_metrics.node_count if cluster_metrics else 0,
-                            last_updated=cluster_metrics.timestamp if cluster_metrics else datetime.utcnow())
+                            hosts=summary['hosts'],
+                            metrics=summary['metrics'],
+                            total_nodes=summary['total_nodes'],
+                            last_updated=summary['last_updated'] or datetime.utcnow())
+
+    @app.route('/api/dashboard/summary', methods=['GET'])
+    def get_dashboard_summary():
+        """Metric cards and per-host entries of the dashboard"""
+        if 'user_id' not in session:
+            return jsonify({'error': 'Unauthorized'}), 401
+        key, _, body = dashboard_summary.get()
+        return conditional(key, lambda: Response(body, mimetype='application/json'))
 
     @app.route('/api/metrics/hosts', methods=['GET'])
     def get_host_metrics():
         if 'user_id' not in session:
             return jsonify({'error': 'Unauthorized'}), 401
-        hosts = HostMetrics.query.order_by(HostMetrics.timestamp.desc()).limit(100).all()
-        return jsonify([{
-            'node_name': h.node_name,
-            'cpu_usage': h.cpu_usage,
-            'memory_usage': h.memory_usage,
-            'disk_usage': h.disk_usage,
-            'uptime': h.uptime,
-            'timestamp': h.timestamp.isoformat()
-        } for h in hosts])
+
+        def build():
+            hosts = HostMetrics.query.order_by(HostMetrics.timestamp.desc()).limit(100).all()
+            return jsonify([{
+                'node_name': h.node_name,
+                'cpu_usage': h.cpu_usage,
+                'memory_usage': h.memory_usage,
+                'disk_usage': h.disk_usage,
+                'uptime': h.uptime,
+                'timestamp': h.timestamp.isoformat()
+            } for h in hosts])
+
+        # Only changes once per collection cycle
+        etag, last_modified = metrics_version()
+        return conditional(etag, build, last_modified)
 
     @app.route('/api/metrics/vms', methods=['GET'])
     def get_vm_metrics():
         if 'user_id' not in session:
             return jsonify({'error': 'Unauthorized'}), 401
-        vms = VMMetrics.query.order_by(VMMetrics.timestamp.desc()).limit(100).all()
-        return jsonify([{
-            'node_name': vm.node_name,
-            'vmid': vm.vmid,
-            'name': vm.name,
-            'status': vm.status,
-            'cpu_usage': vm.cpu_usage,
-            'memory_usage': vm.memory_usage,
-            'disk_usage': vm.disk_usage,
-            'timestamp': vm.timestamp.isoformat()
-        } for vm in vms])
+
+        def build():
+            # Forward-filled, so change-only (delta) storage returns a row per guest and cycle
+            vms = recent_guest_samples(VMMetrics, limit=100)
+            return jsonify([{
+                'node_name': vm['node_name'],
+                'vmid': vm['vmid'],
+                'name': vm['name'],
+                'status': vm['status'],
+                'cpu_usage': vm['cpu_usage'],
+                'memory_usage': vm['memory_usage'],
+                'disk_usage': vm['disk_usage'],
+                'timestamp': vm['timestamp'].isoformat()
+            } for vm in vms])
+
+        # Only changes once per collection cycle
+        etag, last_modified = metrics_version()
+        return conditional(etag, build, last_modified)
 
     @app.route('/api/metrics/containers', methods=['GET'])
     def get_container_metrics():
         if 'user_id' not in session:
             return jsonify({'error': 'Unauthorized'}), 401
-        containers = ContainerMetrics.query.order_by(ContainerMetrics.timestamp.desc()).limit(100).all()
-        return jsonify([{
-            'node_name': c.node_name,
-            'container_id': c.container_id,
-            'name': c.name,
-            'status': c.status,
-            'cpu_usage': c.cpu_usage,
-            'memory_usage': c.memory_usage,
-            'disk_usage': c.disk_usage,
-            'timestamp': c.timestamp.isoformat()
-        } for c in containers])
+
+        def build():
+            containers = recent_guest_samples(ContainerMetrics, limit=100)
+            return jsonify([{
+                'node_name': c['node_name'],
+                'container_id': c['container_id'],
+                'name': c['name'],
+                'status': c['status'],
+                'cpu_usage': c['cpu_usage'],
+                'memory_usage': c['memory_usage'],
+                'disk_usage': c['disk_usage'],
+                'timestamp': c['timestamp'].isoformat()
+            } for c in containers])
+
+        # Only changes once per collection cycle
+        etag, last_modified = metrics_version()
+        return conditional(etag, build, last_modified)
+
+    @app.route('/api/metrics/top', methods=['GET'])
+    def get_top_metrics():
+        """Hosts, VMs or containers with the highest usage
+
+        Query parameters:
+            entity: host, vm or container (default vm)
+            metric: cpu, memory or disk (default cpu)
+            n: entries returned, at most MAX_TOP (default 10)
+            window: seconds to average over, 0 for the newest sample (default 0)
+        """
+        if 'user_id' not in session:
+            return jsonify({'error': 'Unauthorized'}), 401
+
+        entity = request.args.get('entity', 'vm')
+        metric = request.args.get('metric', 'cpu')
+        if entity not in RAW_SOURCES or metric not in METRICS:
+            return jsonify({'error': 'Unknown entity or metric'}), 400
+        n = min(max(request.args.get('n', 10, type=int), 1), MAX_TOP)
+        window = request.args.get('window', 0, type=int)
+
+        def build():
+            top = top_entities(entity, metric, n, timedelta(seconds=window) if window > 0 else None)
+            return jsonify([{'id': entity_id, 'node_name': node_name, 'value': value}
+                            for entity_id, node_name, value in top])
+
+        # Only changes once per collection cycle
+        etag, last_modified = metrics_version()
+        return conditional(etag, build, last_modified)
 
     @app.route('/api/logs', methods=['GET'])
     def get_logs():
+        """Dashboard log entries, newest first
+
+        Query parameters:
+            limit: entries returned, at most MAX_LOG_PAGE (default DEFAULT_LOG_PAGE)
+            before_id: page backwards, entries older than this entry
+            since_id: only entries added after this one; the oldest `limit` of
+                them are returned, so repeat with the highest id to catch up
+            status: comma separated statuses (default info,warning)
+            node: only entries for this node
+        """
         if 'user_id' not in session:
             return jsonify({'error': 'Unauthorized'}), 401
-        
+
         try:
-            # Get info and warning logs
-            logs = DashboardLog.query.filter(
-                DashboardLog.status.in_(['info', 'warning'])  # Get both info and warning logs
-            ).order_by(DashboardLog.created_at.desc()).all()
-
-            # Debug print
-            print("\n[DEBUG] All logs from database:")
-            for log in logs:
-                print(f"[LOG] id={log.id}, action='{log.action}', status='{log.status}', created_at={log.created_at}")
-
-            # Convert to JSON
-            log_list = [{
-                'id': log.id,
-                'node_name': log.node_name,
-                'action': log.action,
-                'status': log.status,
-                'created_at': log.created_at.isoformat(),
-                'details': log.details
-            } for log in logs]
-
-            print("[DEBUG] Returning logs:", log_list)
-            return jsonify(log_list)
+            limit = min(max(request.args.get('limit', DEFAULT_LOG_PAGE, type=int), 1), MAX_LOG_PAGE)
+            before_id = request.args.get('before_id', type=int)
+            since_id = request.args.get('since_id', type=int)
+            statuses = [status for status in request.args.get('status', 'info,warning').split(',') if status]
+            cursor = db.session.get(DashboardLog, before_id) if before_id is not None else None
+            if before_id is not None and cursor is None:
+                return jsonify({'error': f'Unknown before_id {before_id}'}), 400
+
+            def build():
+                query = DashboardLog.query.filter(DashboardLog.status.in_(statuses))
+                if request.args.get('node'):
+                    query = query.filter(DashboardLog.node_name == request.args['node'])
+
+                if since_id is not None:
+                    logs = query.filter(DashboardLog.id > since_id).order_by(DashboardLog.id).limit(limit).all()
+                    logs.reverse()
+                else:
+                    if cursor is not None:
+                        # Keyset on (created_at, id), matching the sort order
+                        query = query.filter(db.or_(
+                            DashboardLog.created_at < cursor.created_at,
+                            db.and_(DashboardLog.created_at == cursor.created_at, DashboardLog.id < cursor.id)
+                        ))
+                    logs = query.order_by(DashboardLog.created_at.desc(), DashboardLog.id.desc()).limit(limit).all()
+
+                return jsonify([log.to_dict() for log in logs])
+
+            return conditional(logs_version(), build)
 
         except Exception as e:
             print(f"[ERROR] Failed to fetch logs: {str(e)}")
@@ -352,13 +318,34 @@ def register_routes(app):
             return jsonify({'error': 'Unauthorized'}), 401
         
         try:
-            from utils.metrics_collector import collect_metrics_job
-            collect_metrics_job()
+            result = trigger_collection()
+            if result == 'running':
+                return jsonify({'error': 'Metrics collection is already running'}), 409
+            if result == 'requested':
+                # Another process collects; the new cycle shows up on /api/stream when it is done
+                return jsonify({'message': 'Metrics collection requested from the collector'}), 202
             return jsonify({'message': 'Metrics collection triggered successfully'})
         except Exception as e:
             print(f"[ERROR] Failed to collect metrics: {str(e)}")
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/api/metrics/collector', methods=['GET'])
+    def get_collector_status():
+        if 'user_id' not in session:
+            return jsonify({'error': 'Unauthorized'}), 401
+        return jsonify(dict(collection_scheduler.stats(), buffer=metrics_buffer.stats(), log_sink=log_sink.stats()))
+
+    @app.route('/api/stream', methods=['GET'])
+    def live_stream():
+        """Server-Sent Events: dashboard state after each collection cycle and new log entries"""
+        if 'user_id' not in session:
+            return jsonify({'error': 'Unauthorized'}), 401
+        live_updates.start(app)
+        return Response(live_updates.stream(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Disable response buffering in nginx
+        })
+
     @app.route('/api/logs', methods=['POST'])
     def create_log():
         if 'user_id' not in session:
@@ -377,11 +364,4 @@ def register_routes(app):
         db.session.add(log)
         db.session.commit()
         
-        return jsonify({
-            'id': log.id,
-            'node_name': log.node_name,
-            'action': log.action,
-            'status': log.status,
-            'created_at': log.created_at.isoformat(),
-            'details': log.details
-        }), 201
+        return jsonify(log.to_dict()), 201
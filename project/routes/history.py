@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta, timezone
+from flask import jsonify, session, request, Response, stream_with_context
+from utils.history import history, METRICS, DEFAULT_POINTS, MAX_POINTS
+from utils.http_cache import conditional, metrics_version
+from utils.export import EXPORT_FORMATS, export_batches, export_rows, gzip_chunks
+from utils.archive import archive_enabled, usage_profile
+from utils.rollups import RAW_SOURCES, TIERS
+
+# Range shown when no ?from= is given
+DEFAULT_RANGE = timedelta(hours=1)
+# Range exported when no ?from= is given
+DEFAULT_EXPORT_RANGE = timedelta(days=1)
+# Range of archived samples profiled when no ?from= is given
+DEFAULT_PROFILE_RANGE = timedelta(days=30)
+
+
+def parse_time(value):
+    """ISO 8601 string to a naive UTC datetime, None for a missing value"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def register_routes(app):
+    @app.route('/api/history/<entity>/<entity_id>', methods=['GET'])
+    def get_history(entity, entity_id):
+        """Downsampled usage history of a host, VM or container for charts
+
+        Query parameters:
+            from, to: ISO 8601 range (default the last hour)
+            points: points per metric, at most MAX_POINTS (default DEFAULT_POINTS)
+            metric: comma separated cpu, memory, disk (default all)
+        """
+        if 'user_id' not in session:
+            return jsonify({'error': 'Unauthorized'}), 401
+
+        if entity not in RAW_SOURCES:
+            return jsonify({'error': f'Unknown entity {entity}'}), 404
+        try:
+            if entity != 'host':
+                entity_id = int(entity_id)
+            end = parse_time(request.args.get('to')) or datetime.utcnow()
+            start = parse_time(request.args.get('from')) or end - DEFAULT_RANGE
+        except ValueError as e:
+            return jsonify({'error': f'Invalid request: {str(e)}'}), 400
+        if start >= end:
+            return jsonify({'error': 'from must be before to'}), 400
+        points = min(max(request.args.get('points', DEFAULT_POINTS, type=int), 3), MAX_POINTS)
+        metrics = [metric for metric in request.args.get('metric', ','.join(METRICS)).split(',') if metric]
+        if not metrics or any(metric not in METRICS for metric in metrics):
+            return jsonify({'error': f'metric must be one of {", ".join(METRICS)}'}), 400
+
+        def build():
+            result = history(entity, entity_id, start, end, points, metrics)
+            result.update(entity=entity, id=entity_id, points=points,
+                          **{'from': start.isoformat(), 'to': end.isoformat()})
+            return jsonify(result)
+
+        try:
+            # Only changes once per collection cycle
+            etag, last_modified = metrics_version()
+            return conditional(etag, build, last_modified)
+        except Exception as e:
+            print(f"[ERROR] Failed to fetch history: {str(e)}")
+            return jsonify({'error': 'Failed to fetch history'}), 500
+
+    @app.route('/api/export/metrics', methods=['GET'])
+    def export_metrics():
+        """Stream metrics history as NDJSON or CSV, gzipped when the client accepts it
+
+        Query parameters:
+            entity: host, vm, container or cluster (default host)
+            tier: raw or a rollup tier, e.g. 1h (default raw); raw guest samples
+                are forward filled onto every cycle in delta storage mode
+            from, to: ISO 8601 range (default the last day)
+            id: comma separated node names or guest ids
+            node: only rows recorded on this node
+            format: ndjson or csv (default ndjson)
+        """
+        if 'user_id' not in session:
+            return jsonify({'error': 'Unauthorized'}), 401
+
+        entity = request.args.get('entity', 'host')
+        tier = request.args.get('tier', 'raw')
+        fmt = request.args.get('format', 'ndjson')
+        if entity not in RAW_SOURCES and not (entity == 'cluster' and tier == 'raw'):
+            return jsonify({'error': f'Unknown entity {entity}'}), 400
+        if tier != 'raw' and tier not in TIERS:
+            return jsonify({'error': f'Unknown tier {tier}'}), 400
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': f'format must be one of {", ".join(EXPORT_FORMATS)}'}), 400
+        try:
+            ids = [entity_id for entity_id in request.args.get('id', '').split(',') if entity_id]
+            if entity in ('vm', 'container'):
+                ids = [int(entity_id) for entity_id in ids]
+            end = parse_time(request.args.get('to')) or datetime.utcnow()
+            start = parse_time(request.args.get('from')) or end - DEFAULT_EXPORT_RANGE
+        except ValueError as e:
+            return jsonify({'error': f'Invalid request: {str(e)}'}), 400
+
+        columns, batches = export_batches(entity, start, end, ids, request.args.get('node'), tier)
+        chunks = export_rows(columns, batches, fmt)
+        headers = {
+            'Content-Disposition': f'attachment; filename="{entity}-{tier}-{start:%Y%m%d%H%M}.{fmt}"',
+            'Vary': 'Accept-Encoding'
+        }
+        if 'gzip' in request.accept_encodings:
+            chunks = gzip_chunks(chunks)
+            headers['Content-Encoding'] = 'gzip'
+        # The request context, and with it the database session, stays open while streaming
+        return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt], headers=headers)
+
+    @app.route('/api/archive/usage', methods=['GET'])
+    def get_archived_usage():
+        """Usage percentiles per host, VM or container from the archive, for right-sizing
+
+        Query parameters:
+            entity: host, vm or container (default vm)
+            from, to: ISO 8601 range (default the 30 days before now)
+            id: comma separated node names or guest ids
+            quantile: percentile to report, between 0 and 1 (default 0.95)
+        """
+        if 'user_id' not in session:
+            return jsonify({'error': 'Unauthorized'}), 401
+
+        entity = request.args.get('entity', 'vm')
+        if entity not in RAW_SOURCES:
+            return jsonify({'error': f'Unknown entity {entity}'}), 400
+        try:
+            if not archive_enabled():
+                return jsonify({'error': 'The metrics archive is not enabled'}), 404
+            ids = [entity_id for entity_id in request.args.get('id', '').split(',') if entity_id]
+            if entity != 'host':
+                ids = [int(entity_id) for entity_id in ids]
+            end = parse_time(request.args.get('to')) or datetime.utcnow()
+            start = parse_time(request.args.get('from')) or end - DEFAULT_PROFILE_RANGE
+            quantile = request.args.get('quantile', 0.95, type=float)
+            if not 0 <= quantile <= 1:
+                raise ValueError('quantile must be between 0 and 1')
+        except ValueError as e:
+            return jsonify({'error': f'Invalid request: {str(e)}'}), 400
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 503
+
+        model, column = RAW_SOURCES[entity]
+        filters = {column.key: ids} if ids else None
+        return jsonify(usage_profile(model, start, end, quantile, filters))
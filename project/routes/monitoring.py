@@ -0,0 +1,29 @@
+import time
+from flask import Response, jsonify, request, session, g
+from utils.instrumentation import registry, bearer_token_valid, CONTENT_TYPE, HTTP_REQUEST_SECONDS
+
+
+def register_routes(app):
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.monotonic()
+
+    @app.after_request
+    def record_request_latency(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            HTTP_REQUEST_SECONDS.observe(
+                time.monotonic() - started,
+                route=request.url_rule.rule if request.url_rule else 'unmatched',
+                method=request.method,
+                status=response.status_code
+            )
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus metrics, for a scraper with the METRICS_TOKEN bearer token or a logged-in user"""
+        token = app.config.get('METRICS_TOKEN')
+        if not (token and bearer_token_valid(request.headers.get('Authorization'), token)) and 'user_id' not in session:
+            return jsonify({'error': 'Unauthorized'}), 401
+        return Response(registry.render(), mimetype=CONTENT_TYPE)
@@ -3,6 +3,8 @@ import json
 from flask import render_template, jsonify, request, session, redirect, current_app
 from models import ProxmoxCredentials, BalanceSettings, UpdateSettings, db
 from utils.metrics_collector import collect_metrics_job
+from utils.proxmox_connection import connection_manager
+from utils.http_cache import conditional
 
 def register_routes(app):
     @app.route('/api/connection-status')
@@ -14,25 +16,28 @@ def register_routes(app):
             
         credentials = ProxmoxCredentials.query.first()
         if not credentials:
-            return jsonify({
+            return conditional('connection-none', lambda: jsonify({
                 'connected': False,
                 'auth_type': 'No Credentials'
-            })
+            }))
             
-        try:
-            proxmox = credentials.get_proxmox_connection()
-            proxmox.nodes.get()  # Test connection
-            
-            return jsonify({
-                'connected': True,
-                'auth_type': 'Password Auth'
-            })
-        except Exception as e:
-            return jsonify({
-                'connected': False,
-                'auth_type': 'Password Auth',
-                'error': str(e)
-            })
+        # Reuses the shared session and a recent check instead of logging in per poll
+        connected, error = connection_manager.check_connection(credentials)
+
+        def build():
+            status = {
+                'connected': connected,
+                'auth_type': credentials.auth_type,
+                'pool': connection_manager.stats()
+            }
+            if error:
+                status['error'] = error
+            return jsonify(status)
+
+        # A new version with every real check, so pool statistics refresh every PROXMOX_CHECK_INTERVAL
+        updated_at = credentials.updated_at.timestamp() if credentials.updated_at else 0
+        etag = f"connection-{credentials.id}-{updated_at:.0f}-{connection_manager.last_check_time() or 0:.3f}"
+        return conditional(etag, build)
 
     @app.route('/settings')
     def settings():
@@ -250,8 +255,17 @@ def register_routes(app):
                 credentials.password = data['password']
                 print("[DEBUG] Password auth configured for user:", credentials.username)
 
+            # Handle API token authentication (no login needed)
+            if 'token_name' in data:
+                credentials.token_name = data['token_name'] or None
+            if 'token_value' in data and data['token_value']:
+                print("[DEBUG] Setting up API token authentication")
+                credentials.token_value = data['token_value']
+            if not credentials.token_name:
+                credentials.token_value = None
+
             # Test connection if all required fields are present
-            if credentials.hostname and credentials.username and credentials.password:
+            if credentials.hostname and credentials.has_auth():
                 try:
                     proxmox = credentials.get_proxmox_connection()
                     proxmox.nodes.get()
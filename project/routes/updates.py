@@ -1,15 +1,12 @@
 from flask import jsonify, request, session
-from apscheduler.schedulers.background import BackgroundScheduler
 from flask import current_app
-
-scheduler = BackgroundScheduler()
-scheduler.start()
-from datetime import datetime
+from datetime import datetime, timezone
 from models import (
-    UpdateSchedule, DashboardLog, NodeUpdateStatus, 
+    UpdateSchedule, NodeUpdateStatus, 
     ProxmoxCredentials, db
 )
-from utils.node_updater import check_all_nodes_updates, execute_update
+from utils.node_updater import check_all_nodes_updates
+from utils.log_sink import log_sink
 
 def register_routes(app):
     @app.route('/api/updates/check', methods=['POST'])
@@ -19,23 +16,13 @@ def register_routes(app):
         
         try:
             # Log that update check was initiated
-            log_entry = DashboardLog(
-                action="Manual update check initiated",
-                status='info'
-            )
-            db.session.add(log_entry)
-            db.session.commit()
+            log_sink.log(None, "Manual update check initiated")
             
             check_all_nodes_updates()
             return jsonify({'message': 'Update check initiated successfully'}), 200
         except Exception as e:
             # Log the error
-            log_entry = DashboardLog(
-                action=f"Update check failed: {str(e)}",
-                status='error'
-            )
-            db.session.add(log_entry)
-            db.session.commit()
+            log_sink.log(None, f"Update check failed: {str(e)}", 'error')
             return jsonify({'error': f'Failed to check updates: {str(e)}'}), 500
 
     @app.route('/api/updates/schedule', methods=['POST'])
@@ -49,6 +36,9 @@ def register_routes(app):
         
         try:
             scheduled_time = datetime.fromisoformat(data['scheduled_time'].replace('Z', '+00:00'))
+            if scheduled_time.tzinfo:
+                # Stored as naive UTC, like every other timestamp
+                scheduled_time = scheduled_time.astimezone(timezone.utc).replace(tzinfo=None)
             update = UpdateSchedule(
                 node_name=data.get('node_name'),
                 scheduled_time=scheduled_time
@@ -56,13 +46,7 @@ def register_routes(app):
             db.session.add(update)
             db.session.commit()
             
-            scheduler.add_job(
-                func=execute_update,
-                trigger='date',
-                run_date=scheduled_time,
-                args=[update.id],
-                id=f'update_{update.id}'
-            )
+            # Picked up by the scheduler's run_due_updates job once it is due
             
             return jsonify({'message': 'Update scheduled successfully', 'id': update.id}), 200
         except Exception as e:
@@ -64,11 +64,60 @@ function updateConnectionStatusUI(data) {
     }
 }
 
-// Auto-refresh dashboard every 30 seconds
-let autoRefreshInterval = setInterval(function() {
-    console.log('[Dashboard] Auto-refreshing page...');
-    window.location.reload();
-}, 30000);
+// Live updates pushed by the server after each collection cycle (Server-Sent Events)
+let liveStream;
+const liveState = { hosts: {}, guests: {} };
+
+function updateMetricCards(summary) {
+    document.getElementById('metric-vms').textContent = `${summary.vms.current}/${summary.vms.total}`;
+    document.getElementById('metric-containers').textContent = `${summary.containers.current}/${summary.containers.total}`;
+    document.getElementById('metric-cpu').textContent = `${summary.cpu.usage}%`;
+    document.getElementById('metric-cpu-detail').textContent = `${summary.cpu.cores} Cores Total`;
+    document.getElementById('metric-memory').textContent = `${summary.memory.usage}%`;
+    document.getElementById('metric-memory-detail').textContent = `${summary.memory.used} out of ${summary.memory.total}`;
+}
+
+function applyChanges(target, changed, removed) {
+    Object.assign(target, changed);
+    (removed || []).forEach(key => delete target[key]);
+}
+
+function startLiveUpdates() {
+    if (!window.EventSource) {
+        // Fall back to reloading the page every 30 seconds
+        setInterval(() => window.location.reload(), 30000);
+        return;
+    }
+    liveStream = new EventSource('/api/stream');
+
+    // Full state, sent when connecting
+    liveStream.addEventListener('state', event => {
+        const data = JSON.parse(event.data);
+        liveState.hosts = data.hosts;
+        liveState.guests = data.guests;
+        updateMetricCards(data.summary);
+    });
+
+    // Only the hosts and guests that changed in a collection cycle
+    liveStream.addEventListener('cycle', event => {
+        const data = JSON.parse(event.data);
+        console.log(`[Dashboard] Cycle ${data.cycle_id}: ${Object.keys(data.hosts).length} hosts, ${Object.keys(data.guests).length} guests changed`);
+        applyChanges(liveState.hosts, data.hosts, data.removed_hosts);
+        applyChanges(liveState.guests, data.guests, data.removed_guests);
+        updateMetricCards(data.summary);
+    });
+
+    liveStream.addEventListener('logs', event => {
+        const data = JSON.parse(event.data);
+        // Newest first, as returned by /api/logs
+        dashboardLogs = data.logs.reverse().concat(dashboardLogs).slice(0, MAX_LOG_ENTRIES);
+        renderLogs();
+    });
+
+    liveStream.onerror = () => {
+        console.log('[Dashboard] Live updates disconnected, reconnecting...');
+    };
+}
 
 // Connection status check interval
 let connectionCheckInterval;
@@ -86,14 +135,13 @@ async function triggerMetricsCollection() {
             credentials: 'same-origin'
         });
         
+        const data = await response.json();
         if (!response.ok) {
-            const data = await response.json();
             throw new Error(data.error || 'Failed to collect metrics');
         }
         
-        console.log('[Dashboard] Metrics collection triggered successfully');
-        alert('Metrics collection triggered successfully');
-        window.location.reload();
+        console.log('[Dashboard] ' + data.message);
+        alert(data.message);
     } catch (error) {
         console.error('[Dashboard] Failed to collect metrics:', error);
         alert('Failed to collect metrics: ' + error.message);
@@ -124,7 +172,11 @@ async function checkUpdates() {
     }
 }
 
-// Function to load logs from the database
+// Log entries shown in the log sections, newest first
+let dashboardLogs = [];
+const MAX_LOG_ENTRIES = 1000;
+
+// Function to load logs from the database; new entries then arrive through the live stream
 async function loadLogs() {
     try {
         const response = await fetch('/api/logs', {
@@ -133,70 +185,76 @@ async function loadLogs() {
                 'X-CSRFToken': getCsrfToken()
             }
         });
-        const logs = await response.json();
-        
-        // Update each log section
-        const sections = ['migration-log', 'resource-log', 'updates-log', 'dashboard-log'];
-        sections.forEach(sectionId => {
-            const container = document.getElementById(sectionId);
-            container.innerHTML = ''; // Clear existing logs
-            
-            // Filter logs based on section
-            let sectionLogs = [];
-            if (sectionId === 'migration-log') {
-                sectionLogs = logs.filter(log => log.action.toLowerCase().includes('migrat'));
-            } else if (sectionId === 'resource-log') {
-                sectionLogs = logs.filter(log => log.action.toLowerCase().includes('resource'));
-            } else if (sectionId === 'updates-log') {
-                sectionLogs = logs.filter(log => {
-                    const action = log.action.toLowerCase();
-                    return action.includes('update') || 
-                           action.includes('checking for updates') || 
-                           action.includes('no updates found') || 
-                           action.includes('updates found') || 
-                           action.includes('requires reboot') ||
-                           action.includes('package:');  // Include package update entries
-                });
-            } else if (sectionId === 'dashboard-log') {
-                // Show metrics logs and errors
-                sectionLogs = logs.filter(log => {
-                    const action = log.action.toLowerCase();
-                    return action.includes('gathering metrics') || 
-                           action.includes('failed to collect metrics') ||
-                           log.status === 'error';  // Include error logs
-                });
-            }
+        dashboardLogs = await response.json();
+        renderLogs();
+    } catch (error) {
+        console.error('Failed to load logs:', error);
+    }
+}
 
-            // Get checkbox states from the log controls
-            const controls = container.parentElement.querySelector('.log-controls');
-            const checkboxes = controls.querySelectorAll('input[type="checkbox"]');
-            const showInfo = checkboxes[0].checked;
-            const showWarn = checkboxes[1].checked;
-            const showCritical = checkboxes[2].checked;
-            
-            // Filter and display logs based on checkbox states
-            const filteredLogs = sectionLogs.filter(log => {
-                const status = (log.status || '').toLowerCase();
-                if (status === 'info' && !showInfo) return false;
-                if (status === 'warning' && !showWarn) return false;
-                if (status === 'error' && !showCritical) return false;
-                return true;
-            });
+function renderLogs() {
+    const logs = dashboardLogs;
 
-            // Display the filtered logs
-            filteredLogs.forEach(log => {
-                const logEntry = document.createElement('div');
-                logEntry.className = 'log-entry';
-                logEntry.innerHTML = `
-                    <span class="log-time">${new Date(log.created_at).toLocaleTimeString()}</span>
-                    <span class="log-message ${log.status}">${log.action}</span>
-                `;
-                container.appendChild(logEntry);
+    // Update each log section
+    const sections = ['migration-log', 'resource-log', 'updates-log', 'dashboard-log'];
+    sections.forEach(sectionId => {
+        const section = document.getElementById(sectionId);
+        const container = section.querySelector('.log-content');
+        container.innerHTML = ''; // Clear existing logs
+        
+        // Filter logs based on section
+        let sectionLogs = [];
+        if (sectionId === 'migration-log') {
+            sectionLogs = logs.filter(log => log.action.toLowerCase().includes('migrat'));
+        } else if (sectionId === 'resource-log') {
+            sectionLogs = logs.filter(log => log.action.toLowerCase().includes('resource'));
+        } else if (sectionId === 'updates-log') {
+            sectionLogs = logs.filter(log => {
+                const action = log.action.toLowerCase();
+                return action.includes('update') || 
+                       action.includes('checking for updates') || 
+                       action.includes('no updates found') || 
+                       action.includes('updates found') || 
+                       action.includes('requires reboot') ||
+                       action.includes('package:');  // Include package update entries
             });
+        } else if (sectionId === 'dashboard-log') {
+            // Show metrics logs and errors
+            sectionLogs = logs.filter(log => {
+                const action = log.action.toLowerCase();
+                return action.includes('gathering metrics') || 
+                       action.includes('failed to collect metrics') ||
+                       log.status === 'error';  // Include error logs
+            });
+        }
+
+        // Get checkbox states from the log controls
+        const controls = section.querySelector('.log-controls');
+        const checkboxes = controls.querySelectorAll('input[type="checkbox"]');
+        const showInfo = checkboxes[0].checked;
+        const showWarn = checkboxes[1].checked;
+        const showCritical = checkboxes[2].checked;
+        
+        // Filter and display logs based on checkbox states
+        const filteredLogs = sectionLogs.filter(log => {
+            const status = (log.status || '').toLowerCase();
+            if (status === 'info' && !showInfo) return false;
+            if (status === 'warning' && !showWarn) return false;
+            if (status === 'error' && !showCritical) return false;
+            return true;
         });
-    } catch (error) {
-        console.error('Failed to load logs:', error);
-    }
+
+        // Display the filtered logs
+        filteredLogs.forEach(log => {
+            const logEntry = document.createElement('div');
+            logEntry.className = 'log-entry';
+            logEntry.innerHTML = `
+                <span class="log-time">${new Date(log.created_at).toLocaleTimeString()}</span>
+                <span class="log-message ${log.status}">${log.action}</span>
+            `;
+            container.appendChild(logEntry);
+        });
+    });
 }
 
 // Modal handling
@@ -248,18 +306,15 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
-    // Add event listeners to checkboxes to reload logs when changed
+    // Add event listeners to checkboxes to re-filter logs when changed
     document.querySelectorAll('.log-controls input[type="checkbox"]').forEach(checkbox => {
-        checkbox.addEventListener('change', loadLogs);
+        checkbox.addEventListener('change', renderLogs);
     });
 
-    // Load logs initially and refresh every 5 seconds
+    // Load logs once; metrics and new log entries are pushed by the server
     console.log('[Dashboard] Loading initial logs...');
     loadLogs();
-    setInterval(() => {
-        console.log('[Dashboard] Refreshing logs...');
-        loadLogs();
-    }, 5000);
+    startLiveUpdates();
 });
 
 function openUpdateModal() {
@@ -280,18 +335,14 @@ function openUpdateModal() {
     const defaultTime = `${year}-${month}-${day}T${hours}:${minutes}`;
     document.getElementById('updateTime').value = defaultTime;
     
-    // Clear auto-refresh and connection check while modal is open
-    clearInterval(autoRefreshInterval);
+    // Pause the connection check while modal is open
     clearInterval(connectionCheckInterval);
 }
 
 function closeUpdateModal() {
     isModalOpen = false;
     updateModal.style.display = 'none';
-    // Restore auto-refresh and connection check when modal is closed
-    autoRefreshInterval = setInterval(function() {
-        window.location.reload();
-    }, 30000);
+    // Restore the connection check when modal is closed
     connectionCheckInterval = setInterval(checkConnectionStatus, 30000);
 }
 
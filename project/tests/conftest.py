@@ -13,7 +13,8 @@ def app():
     flask_app.config.update({
         'TESTING': True,
         'SQLALCHEMY_DATABASE_URI': os.getenv('DATABASE_URL'),
-        'WTF_CSRF_ENABLED': False  # Disable CSRF for testing
+        'WTF_CSRF_ENABLED': False,  # Disable CSRF for testing
+        'LOG_SINK_ASYNC': False  # Commit log entries right away so tests can read them
     })
     with flask_app.app_context():
         db.create_all()
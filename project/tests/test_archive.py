@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+import pytest
+from models import db, HostMetrics, VMMetrics, MetricsRollup
+
+pa = pytest.importorskip('pyarrow')
+
+from utils.archive import archived_days, read_archive, scan_archive, usage_profile
+from utils.rollups import apply_retention, compact_rollups
+
+NOW = datetime(2024, 2, 1, 6, 0, 0)
+DAY1 = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def archive(app, tmp_path):
+    app.config.update(METRICS_ARCHIVE_DIR=str(tmp_path), METRICS_RETENTION_DAYS={'raw': 7})
+    yield tmp_path
+    app.config.update(METRICS_ARCHIVE_DIR='', METRICS_ARCHIVE_FORMAT='parquet', METRICS_RETENTION_DAYS={})
+
+
+def add_days(days, per_day=48):
+    """Host and two VM samples every 30 minutes from DAY1; vm 101 runs at twice the CPU"""
+    rows = []
+    for i in range(days * per_day):
+        timestamp = DAY1 + timedelta(minutes=30 * i)
+        rows.append(HostMetrics(node_name='pve1', cpu_usage=float(i % 10), memory_usage=50.0, timestamp=timestamp))
+        for vmid in (100, 101):
+            rows.append(VMMetrics(vmid=vmid, name=f'vm{vmid}', node_name='pve1', status='running',
+                                  cpu_usage=float(i % 10) * (vmid - 99), memory_usage=25.0, timestamp=timestamp))
+    db.session.add_all(rows)
+    db.session.commit()
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_retention_archives_whole_days_before_deleting(app, archive, fmt):
+    app.config['METRICS_ARCHIVE_FORMAT'] = fmt
+    add_days(3)
+    db.session.add(VMMetrics(vmid=100, name='vm100', node_name='pve1', cpu_usage=1.0, timestamp=NOW))
+    db.session.commit()
+    compact_rollups(now=NOW)
+    assert MetricsRollup.query.count()
+
+    apply_retention(now=NOW)
+
+    days = archived_days(VMMetrics)
+    assert [day for day, _ in days] == [DAY1, DAY1 + timedelta(days=1), DAY1 + timedelta(days=2)]
+    assert all(path.endswith('.parquet' if fmt == 'parquet' else '.arrow') for _, path in days)
+    # Archived days are gone from the database, the recent sample stays
+    assert VMMetrics.query.count() == 1
+
+    table = read_archive(VMMetrics, DAY1, DAY1 + timedelta(days=3), columns=['vmid', 'cpu_usage'])
+    assert table.num_rows == 3 * 48 * 2
+    assert table.column_names == ['vmid', 'cpu_usage']
+    assert read_archive(VMMetrics, DAY1 + timedelta(hours=1), DAY1 + timedelta(hours=2),
+                        filters={'vmid': 101}).column('cpu_usage').to_pylist() == [4.0, 6.0]
+    assert sum(batch.num_rows for batch in scan_archive(HostMetrics, DAY1, NOW)) == 3 * 48
+
+
+def test_usage_profile_for_right_sizing(user, archive):
+    add_days(2)
+    compact_rollups(now=NOW)
+    apply_retention(now=NOW)
+
+    profiles = usage_profile(VMMetrics, DAY1, NOW)
+    assert [profile['id'] for profile in profiles] == [100, 101]
+    assert profiles[1]['samples'] == 96
+    assert profiles[1]['cpu']['max'] == 18.0 and profiles[1]['cpu']['mean'] == 8.75
+    assert 14.0 <= profiles[1]['cpu']['p95'] <= 18.0
+
+    response = user.get(f'/api/archive/usage?entity=vm&id=100&from={DAY1.isoformat()}&to={NOW.isoformat()}')
+    assert [profile['id'] for profile in response.get_json()] == [100]
+
+
+def test_usage_requires_an_archive(user):
+    assert user.get('/api/archive/usage').status_code == 404
+
+
+@pytest.fixture
+def user(client):
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
@@ -0,0 +1,136 @@
+import threading
+import time
+import pytest
+from models import CollectionRequest
+from utils.collection_scheduler import CollectionScheduler
+from utils.jobs import run_requested_collection
+
+
+class FakeScheduler:
+    """Records jobs instead of running them"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def add_listener(self, callback, mask):
+        pass
+
+    def add_job(self, **kwargs):
+        self.jobs.append(kwargs)
+
+
+def test_overlapping_cycle_is_skipped():
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_job():
+        started.set()
+        release.wait(5)
+
+    collector = CollectionScheduler()
+    collector.set_job(slow_job)
+    thread = threading.Thread(target=collector.run_cycle)
+    thread.start()
+    started.wait(5)
+
+    assert collector.run_cycle() is False
+    release.set()
+    thread.join()
+
+    stats = collector.stats()
+    assert stats['cycles'] == 1
+    assert stats['skipped'] == 1
+    assert stats['running'] is False
+
+
+def test_cycles_on_a_non_leader_are_skipped(app, monkeypatch):
+    from utils.jobs import _leader_job
+    from utils.leader import leader_election
+    collected = []
+    collector = CollectionScheduler()
+    collector.set_job(_leader_job(app, 'metrics collection', lambda: collected.append(time.sleep(0.05))))
+
+    monkeypatch.setattr(leader_election, 'is_leader', lambda: False)
+    assert collector.run_cycle() is False
+    stats = collector.stats()
+    assert (stats['cycles'], stats['skipped'], stats['last_duration'], stats['avg_duration']) == (0, 1, None, None)
+
+    monkeypatch.setattr(leader_election, 'is_leader', lambda: True)
+    assert collector.run_cycle() is True
+    stats = collector.stats()
+    assert collected and (stats['cycles'], stats['skipped']) == (1, 1)
+    assert stats['avg_duration'] >= 0.05
+
+
+def test_interval_grows_with_cycle_duration():
+    collector = CollectionScheduler(base_interval=30, max_interval=300, jitter=0)
+    assert collector.next_interval() == 30
+
+    collector._avg_duration = 40
+    assert collector.next_interval() == 80
+
+    collector._avg_duration = 500
+    assert collector.next_interval() == 300
+
+
+def test_scheduled_cycle_reschedules_and_records_lateness():
+    scheduler = FakeScheduler()
+    collector = CollectionScheduler(base_interval=30, jitter=0.1, late_after=5)
+    collector.start(scheduler, lambda: None, delay=0)
+    assert scheduler.jobs[-1]['max_instances'] == 1
+
+    # Pretend the job was planned 10 seconds ago
+    collector._planned_at = time.time() - 10
+    collector._run_scheduled()
+
+    stats = collector.stats()
+    assert stats['late'] == 1
+    assert stats['cycles'] == 1
+    assert 27 <= stats['interval'] <= 33
+    assert len(scheduler.jobs) == 2
+
+
+@pytest.fixture
+def collector(app, client, monkeypatch):
+    """A fresh collection scheduler in place of the app's, whose own background jobs are paused"""
+    import app as app_module
+    if app_module.scheduler:
+        app_module.scheduler.pause()
+    collector = CollectionScheduler()
+    collector.runs = []
+    collector.set_job(lambda: collector.runs.append(time.time()))
+    monkeypatch.setattr('utils.jobs.collection_scheduler', collector)
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    yield collector
+    if app_module.scheduler:
+        app_module.scheduler.resume()
+
+
+def test_manual_collection_runs_on_the_leader(collector, client):
+    collector.start(FakeScheduler(), collector._job)
+
+    response = client.post('/api/metrics/collect')
+    assert response.status_code == 200
+    assert len(collector.runs) == 1
+    assert CollectionRequest.query.count() == 0
+
+
+def test_manual_collection_elsewhere_is_left_to_the_leader(collector, client, monkeypatch):
+    # The web app with RUN_SCHEDULER=false does not collect itself
+    response = client.post('/api/metrics/collect')
+    assert response.status_code == 202
+    assert 'requested' in response.get_json()['message']
+
+    # Neither does a replica that runs the scheduled jobs but lost the election
+    collector.start(FakeScheduler(), collector._job)
+    monkeypatch.setattr('utils.jobs.leader_election.is_leader', lambda: False)
+    assert client.post('/api/metrics/collect').status_code == 202
+    assert collector.runs == []
+    assert CollectionRequest.query.count() == 2
+
+    # The leader answers both requests with one cycle
+    run_requested_collection()
+    run_requested_collection()
+    assert len(collector.runs) == 1
+    assert CollectionRequest.query.count() == 0
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+from models import VMMetrics
+from utils.delta_storage import DeltaFilter, forward_fill
+
+T0 = datetime(2024, 1, 1, 12, 0)
+
+
+def sample(vmid, seconds, cpu=10.0, status='running'):
+    return dict(node_name='pve1', vmid=vmid, name=f'vm{vmid}', status=status, cpu_usage=cpu,
+                memory_usage=50.0, disk_usage=20.0, timestamp=T0 + timedelta(seconds=seconds))
+
+
+def test_delta_filter_keeps_changes_and_heartbeats():
+    delta = DeltaFilter(tolerance=1.0, heartbeat=120)
+    assert len(delta.filter(VMMetrics, [sample(100, 0), sample(101, 0)])) == 2
+    delta.commit()
+
+    kept = delta.filter(VMMetrics, [sample(100, 30, cpu=10.5), sample(101, 30, status='stopped')])
+    assert [row['vmid'] for row in kept] == [101]
+    delta.commit()
+
+    # A failed commit forgets what was passed, so the sample is offered again
+    assert delta.filter(VMMetrics, [sample(100, 60, cpu=12.0)])
+    delta.rollback()
+    assert delta.filter(VMMetrics, [sample(100, 90, cpu=12.0)])
+    delta.commit()
+
+    # Heartbeat: stored again once the last stored sample is old enough
+    assert not delta.filter(VMMetrics, [sample(100, 180, cpu=12.0)])
+    assert delta.filter(VMMetrics, [sample(100, 210, cpu=12.0)])
+
+
+def test_forward_fill_carries_samples_until_max_age():
+    cycles = [T0 + timedelta(seconds=30 * i) for i in range(4)]
+    samples = [sample(100, 0), sample(101, 0), sample(101, 60, cpu=80.0)]
+    rows = forward_fill(samples, cycles, lambda row: row['vmid'], timedelta(seconds=60))
+
+    assert [(row['vmid'], row['cpu_usage'], row['filled']) for row in rows if row['timestamp'] == cycles[1]] == \
+        [(100, 10.0, True), (101, 10.0, True)]
+    assert [(row['vmid'], row['cpu_usage']) for row in rows if row['timestamp'] == cycles[3]] == [(101, 80.0)]
+
+
+def test_full_mode_reads_rows_stamped_slightly_off_their_cycle(app):
+    from models import ClusterMetrics, LatestGuestState, db
+    from utils.delta_storage import filled_guest_samples, recent_guest_samples
+    cycles = [T0 + timedelta(seconds=30 * i) for i in range(3)]
+    db.session.add_all(ClusterMetrics(node_count=1, timestamp=timestamp) for timestamp in cycles)
+    db.session.add(LatestGuestState(guest_type='qemu', vmid=100, node_name='pve1'))
+    offsets = [timedelta(0), timedelta(microseconds=250), -timedelta(milliseconds=3)]
+    db.session.add_all(VMMetrics(**sample(100, 30 * i, cpu=float(i))) for i in range(3))
+    db.session.flush()
+    for row, offset in zip(VMMetrics.query.order_by(VMMetrics.timestamp), offsets):
+        row.timestamp += offset
+    db.session.commit()
+
+    rows = recent_guest_samples(VMMetrics)
+    assert [(row['timestamp'], row['cpu_usage'], row['filled']) for row in rows] == [
+        (cycles[2], 2.0, False), (cycles[1], 1.0, False), (cycles[0], 0.0, False)]
+    filled = [row for batch in filled_guest_samples(VMMetrics, cycles[1], cycles[2] + timedelta(seconds=1), batch_rows=1)
+              for row in batch]
+    assert [(row['timestamp'], row['cpu_usage']) for row in filled] == [(cycles[1], 1.0), (cycles[2], 2.0)]
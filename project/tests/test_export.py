@@ -0,0 +1,99 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+import pytest
+from models import db, ClusterMetrics, HostMetrics, VMMetrics
+from utils.rollups import compact_rollups
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+RANGE = f'from={START.isoformat()}&to={(START + timedelta(hours=1)).isoformat()}'
+
+
+@pytest.fixture
+def user(client):
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
+
+
+@pytest.fixture
+def samples(app):
+    rows = []
+    for i in range(20):
+        timestamp = START + timedelta(seconds=30 * i)
+        rows.append(HostMetrics(node_name='pve1', cpu_usage=float(i), memory_usage=50.0, timestamp=timestamp))
+        for vmid, node in ((100, 'pve1'), (101, 'pve2')):
+            rows.append(VMMetrics(vmid=vmid, name=f'vm{vmid}', node_name=node, status='running',
+                                  cpu_usage=float(i), memory_usage=10.0, disk_usage=5.0, timestamp=timestamp))
+    db.session.add_all(rows)
+    db.session.commit()
+
+
+def test_export_streams_ndjson(user, samples):
+    response = user.get(f'/api/export/metrics?entity=vm&id=101&{RANGE}')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.is_streamed
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert len(rows) == 20
+    assert {row['vmid'] for row in rows} == {101}
+    assert rows[0]['timestamp'] == START.isoformat() and rows[-1]['cpu_usage'] == 19.0
+
+
+def test_export_csv_filters_by_node_and_gzips(user, samples):
+    response = user.get(f'/api/export/metrics?entity=vm&node=pve1&format=csv&{RANGE}',
+                        headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.data).decode())))
+    assert len(rows) == 20
+    assert {row['node_name'] for row in rows} == {'pve1'}
+
+    empty = user.get(f'/api/export/metrics?entity=vm&id=999&format=csv&{RANGE}')
+    assert empty.data.decode().splitlines() == ['id,node_name,vmid,name,status,cpu_usage,memory_usage,disk_usage,timestamp']
+
+
+def test_export_rollup_tier(user, samples):
+    compact_rollups(now=START + timedelta(minutes=15))
+    response = user.get(f'/api/export/metrics?entity=host&tier=1m&{RANGE}')
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert len(rows) == 10
+    assert rows[0]['entity_id'] == 'pve1' and rows[0]['cpu_max'] == 1.0
+
+    assert user.get('/api/export/metrics?entity=cluster&tier=1m').status_code == 400
+    assert user.get('/api/export/metrics?format=xml').status_code == 400
+
+
+def test_export_fills_guest_samples_in_delta_mode(app, user, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_STORAGE_MODE', 'delta')
+    # A few cycles per window, so stored samples are carried from one window to the next
+    monkeypatch.setattr('utils.export.EXPORT_BATCH', 3)
+    cycles = [START + timedelta(seconds=30 * i) for i in range(20)]
+    db.session.add_all(ClusterMetrics(node_count=2, timestamp=timestamp) for timestamp in cycles)
+
+    def stored(vmid, timestamp, cpu, node='pve1'):
+        db.session.add(VMMetrics(vmid=vmid, name=f'vm{vmid}', node_name=node, status='running',
+                                 cpu_usage=cpu, timestamp=timestamp))
+
+    stored(100, cycles[0], 10.0)
+    stored(100, cycles[10], 20.0)
+    # vm101 migrates to pve2, vm102 last changed before the export range
+    stored(101, cycles[0], 30.0)
+    stored(101, cycles[5], 30.0, node='pve2')
+    stored(102, START - timedelta(minutes=1), 40.0)
+    db.session.commit()
+
+    rows = [json.loads(line) for line in user.get(f'/api/export/metrics?entity=vm&{RANGE}').data.decode().splitlines()]
+    assert len(rows) == 3 * 20
+    vm100 = [row for row in rows if row['vmid'] == 100]
+    assert [row['cpu_usage'] for row in vm100] == [10.0] * 10 + [20.0] * 10
+    assert [row['filled'] for row in vm100[9:12]] == [True, False, True]
+    assert [row['timestamp'] for row in vm100] == [timestamp.isoformat() for timestamp in cycles]
+
+    pve2 = user.get(f'/api/export/metrics?entity=vm&node=pve2&format=csv&{RANGE}').data.decode()
+    rows = list(csv.DictReader(io.StringIO(pve2)))
+    assert {row['vmid'] for row in rows} == {'101'} and len(rows) == 15
+
+    filtered = user.get(f'/api/export/metrics?entity=vm&id=102&{RANGE}').data.decode().splitlines()
+    assert len(filtered) == 20 and json.loads(filtered[0])['filled']
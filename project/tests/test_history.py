@@ -0,0 +1,76 @@
+import math
+from datetime import datetime, timedelta
+import pytest
+from models import db, HostMetrics, VMMetrics
+from utils.history import lttb
+from utils.rollups import compact_rollups, floor_time
+
+
+@pytest.fixture
+def user(client):
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
+
+
+def add_samples(start, minutes):
+    """One host and one VM sample every 30 seconds, the VM with a spike in the middle"""
+    rows = []
+    for i in range(minutes * 2):
+        timestamp = start + timedelta(seconds=30 * i)
+        rows.append(HostMetrics(node_name='pve1', cpu_usage=10.0 + i % 5, memory_usage=50.0,
+                                disk_usage=20.0, uptime='1d', timestamp=timestamp))
+        rows.append(VMMetrics(vmid=100, name='vm100', node_name='pve1', status='running',
+                              cpu_usage=100.0 if i == minutes else 5.0, memory_usage=10.0,
+                              disk_usage=5.0, timestamp=timestamp))
+    db.session.add_all(rows)
+    db.session.commit()
+
+
+def test_lttb_keeps_ends_and_peaks():
+    points = [(x, math.sin(x / 10)) for x in range(1000)]
+    points[500] = (500, 50.0)
+    sampled = lttb(points, 50)
+
+    assert len(sampled) == 50
+    assert sampled[0] == points[0] and sampled[-1] == points[-1]
+    assert (500, 50.0) in sampled
+    assert [x for x, _ in sampled] == sorted(x for x, _ in sampled)
+    assert lttb(points[:10], 50) == points[:10]
+
+
+def test_short_range_is_read_from_raw_samples(user):
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(hours=1)
+    add_samples(start, 60)
+
+    response = user.get(f'/api/history/vm/100?from={start.isoformat()}&points=40&metric=cpu')
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['source'] == 'raw' and body['samples'] == 120
+    assert list(body['series']) == ['cpu']
+    assert len(body['series']['cpu']) == 40
+    # The spike survives downsampling
+    assert max(value for _, value in body['series']['cpu']) == 100.0
+
+
+def test_long_range_uses_rollups_and_raw_tail(app, user):
+    start = floor_time(datetime.utcnow(), 3600) - timedelta(hours=3)
+    add_samples(start, 180)
+    compact_rollups(now=start + timedelta(hours=2, minutes=5))
+
+    # 3 hours at 10 points is too many raw or 1m samples, 15m buckets fit
+    response = user.get(f'/api/history/host/pve1?from={start.isoformat()}'
+                        f'&to={(start + timedelta(hours=3)).isoformat()}&points=10')
+    body = response.get_json()
+    assert body['source'] == '15m'
+    # 8 quarters up to the 15m watermark, 4 minutes up to the 1m watermark, then raw samples
+    assert body['samples'] == 8 + 4 + 112
+    assert len(body['series']['memory']) == 10
+    assert body['series']['memory'][0] == [int((start - datetime(1970, 1, 1)).total_seconds() * 1000), 50.0]
+
+
+def test_history_rejects_bad_requests(user):
+    assert user.get('/api/history/storage/local').status_code == 404
+    assert user.get('/api/history/vm/abc').status_code == 400
+    assert user.get('/api/history/vm/100?metric=network').status_code == 400
+    assert user.get('/api/history/vm/100?from=2024-01-02T00:00:00&to=2024-01-01T00:00:00').status_code == 400
@@ -0,0 +1,86 @@
+from datetime import datetime
+import pytest
+from models import ClusterMetrics, DashboardLog, HostMetrics, db
+
+
+@pytest.fixture
+def user(client):
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
+
+
+def add_cycle():
+    timestamp = datetime(2024, 1, 1, 12, 0, ClusterMetrics.query.count())
+    db.session.add(ClusterMetrics(total_cpu=8, used_cpu=1, total_memory=1, used_memory=1, node_count=1,
+                                  timestamp=timestamp))
+    db.session.add(HostMetrics(node_name='pve1', cpu_usage=10.0, timestamp=timestamp))
+    db.session.commit()
+
+
+def test_metrics_are_not_modified_until_the_next_cycle(user):
+    add_cycle()
+    response = user.get('/api/metrics/hosts')
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and len(response.get_json()) == 1
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    cached = user.get('/api/metrics/hosts', headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.data == b''
+    assert user.get('/api/metrics/vms', headers={'If-Modified-Since': response.headers['Last-Modified']}).status_code == 304
+
+    add_cycle()
+    response = user.get('/api/metrics/hosts', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and len(response.get_json()) == 2
+    assert response.headers['ETag'] != etag
+
+
+def test_logs_are_not_modified_until_an_entry_is_added(user):
+    etag = user.get('/api/logs').headers['ETag']
+    assert user.get('/api/logs', headers={'If-None-Match': etag}).status_code == 304
+
+    db.session.add(DashboardLog(action='Checking for updates', status='info'))
+    db.session.commit()
+    response = user.get('/api/logs', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert [log['action'] for log in response.get_json()] == ['Checking for updates']
+
+
+def test_dashboard_summary_is_computed_once_per_cycle(user, monkeypatch):
+    from utils.dashboard_summary import dashboard_summary
+    dashboard_summary.invalidate()
+    add_cycle()
+    computed = []
+    compute = dashboard_summary._compute
+    monkeypatch.setattr(dashboard_summary, '_compute', lambda: computed.append(1) or compute())
+
+    first = user.get('/api/dashboard/summary')
+    assert first.get_json()['metrics']['cpu'] == {'usage': 12, 'cores': 8.0}
+    assert user.get('/dashboard').status_code == 200
+    assert user.get('/api/dashboard/summary', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert len(computed) == 1
+
+    add_cycle()
+    assert user.get('/api/dashboard/summary').get_json()['cycle_id'] == first.get_json()['cycle_id'] + 1
+    assert len(computed) == 2
+
+
+def test_dashboard_summary_ignores_a_snapshot_of_another_cycle(user):
+    from models import LatestHostState
+    from utils.dashboard_summary import dashboard_summary
+    from utils.snapshot import CollectionSnapshot, NodeState, publish_snapshot
+    dashboard_summary.invalidate()
+    add_cycle()
+    node = NodeState.from_dict({'node': 'pve-old', 'status': 'online', 'maxcpu': 4, 'maxmem': 1, 'maxdisk': 1})
+    publish_snapshot(CollectionSnapshot(nodes=[node]), ClusterMetrics.query.one().id)
+    try:
+        assert list(user.get('/api/dashboard/summary').get_json()['hosts']) == ['pve-old']
+
+        # A cycle committed by another process (the worker) is read from the latest state tables
+        add_cycle()
+        db.session.add(LatestHostState(node_name='pve1', cpu_usage=10.0))
+        db.session.commit()
+        assert list(user.get('/api/dashboard/summary').get_json()['hosts']) == ['pve1']
+    finally:
+        publish_snapshot(None)
+        dashboard_summary.invalidate()
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+import pytest
+from models import HostMetrics, VMMetrics, db
+from utils.latest_queries import latest_rows, latest_hosts, latest_vms
+
+T0 = datetime(2024, 1, 1, 12, 0)
+METHODS = ['row_number', 'max_join', 'distinct_on']
+
+
+@pytest.fixture(params=METHODS)
+def method(request, app):
+    if request.param == 'distinct_on' and db.engine.dialect.name != 'postgresql':
+        pytest.skip('DISTINCT ON needs PostgreSQL')
+    return request.param
+
+
+@pytest.fixture
+def history(app):
+    for minute in range(3):
+        timestamp = T0 + timedelta(minutes=minute)
+        for node in ('pve1', 'pve2'):
+            db.session.add(HostMetrics(node_name=node, ip_address=f'10.0.0.{minute}', cpu_usage=minute,
+                                       timestamp=timestamp))
+        # vm100 migrates from pve1 to pve2 in the last cycle, vm101 stays on pve1
+        db.session.add(VMMetrics(node_name='pve2' if minute == 2 else 'pve1', vmid=100, status='running',
+                                 cpu_usage=minute, timestamp=timestamp))
+        db.session.add(VMMetrics(node_name='pve1', vmid=101, status='running', cpu_usage=minute,
+                                 timestamp=timestamp))
+    db.session.commit()
+
+
+def test_latest_row_per_entity(history, method):
+    hosts = sorted((h.node_name, h.ip_address) for h in latest_hosts(method=method))
+    assert hosts == [('pve1', '10.0.0.2'), ('pve2', '10.0.0.2')]
+
+    # A VM that migrated away is no longer listed on its old node
+    assert [vm.vmid for vm in latest_vms(node_name='pve1', method=method)] == [101]
+    assert [vm.vmid for vm in latest_vms(node_name='pve2', method=method)] == [100]
+
+
+def test_latest_row_as_of_and_within_a_window(history, method):
+    before = sorted((vm.vmid, vm.node_name, vm.cpu_usage) for vm in latest_vms(before=T0 + timedelta(minutes=2), method=method))
+    assert before == [(100, 'pve1', 1.0), (101, 'pve1', 1.0)]
+    assert latest_hosts(since=T0 + timedelta(minutes=5), method=method) == []
+
+    statement = latest_rows(VMMetrics, (VMMetrics.vmid,), filters=(VMMetrics.node_name == 'pve1',), method=method)
+    assert sorted((row.vmid, row.cpu_usage) for row in db.session.execute(statement)) == [(100, 1.0), (101, 2.0)]
+
+
+def test_ties_on_timestamp_yield_one_row(app, method):
+    db.session.add_all([HostMetrics(node_name='pve1', cpu_usage=value, timestamp=T0) for value in (1.0, 2.0)])
+    db.session.commit()
+    assert [h.cpu_usage for h in latest_hosts(method=method)] == [2.0]
@@ -0,0 +1,60 @@
+import json
+from datetime import datetime
+from models import ClusterMetrics, DashboardLog, LatestHostState, LatestGuestState, db
+from utils.live_updates import LiveUpdates
+
+GiB = 1024 ** 3
+
+
+def add_cycle(guest_cpu):
+    cycle = ClusterMetrics(total_cpu=8, used_cpu=2, total_memory=16 * GiB, used_memory=4 * GiB, node_count=1)
+    db.session.add(cycle)
+    db.session.flush()
+    db.session.merge(LatestHostState(node_name='pve1', cpu_usage=25.0, memory_usage=25.0, cycle_id=cycle.id))
+    for vmid, cpu in guest_cpu.items():
+        db.session.merge(LatestGuestState(guest_type='qemu', vmid=vmid, node_name='pve1', status='running',
+                                          cpu_usage=cpu, memory_usage=10.0, disk_usage=10.0, cycle_id=cycle.id))
+    db.session.commit()
+    return cycle.id
+
+
+def events(subscriber):
+    messages = []
+    while not subscriber.queue.empty():
+        name, *_, data = subscriber.queue.get_nowait().decode().strip().split('\n')
+        messages.append((name.split(': ', 1)[1], json.loads(data.split(': ', 1)[1])))
+    return messages
+
+
+def test_one_delta_per_cycle_is_fanned_out(app):
+    live = LiveUpdates()
+    add_cycle({100: 5.0, 101: 5.0})
+    first, state = live.subscribe()
+    assert state is None
+    live.poll()
+
+    (name, data), = events(first)
+    assert name == 'state'
+    assert data['summary']['vms'] == {'current': 2, 'total': 2}
+    assert data['summary']['cpu']['usage'] == 25
+
+    # A client connecting later starts from the current full state
+    second, state = live.subscribe()
+    assert state.startswith(b'event: state')
+
+    cycle_id = add_cycle({100: 5.0, 101: 80.0})
+    db.session.add(DashboardLog(action='Gathering metrics', status='info', created_at=datetime.utcnow()))
+    db.session.commit()
+    live.poll()
+    live.poll()
+
+    for subscriber in (first, second):
+        (logs_name, logs), (cycle_name, delta) = events(subscriber)
+        assert logs_name == 'logs' and [log['action'] for log in logs['logs']] == ['Gathering metrics']
+        assert cycle_name == 'cycle' and delta['cycle_id'] == cycle_id
+        assert list(delta['guests']) == ['qemu/101']
+        assert delta['hosts'] == {}
+
+
+def test_stream_requires_login(client):
+    assert client.get('/api/stream').status_code == 401
@@ -0,0 +1,52 @@
+import json
+import pytest
+from models import DashboardLog
+from utils.log_sink import LogSink
+
+
+@pytest.fixture
+def async_logs(app):
+    app.config['LOG_SINK_ASYNC'] = True
+    yield
+    app.config['LOG_SINK_ASYNC'] = False
+
+
+def test_entries_are_written_in_batches(app, async_logs):
+    sink = LogSink(flush_interval=60, batch_size=3)
+    for i in range(5):
+        sink.log('pve1', f'Package: pkg{i} -> 1.0', details={'index': i})
+
+    # A full batch goes out right away, the rest waits for the interval or a flush
+    assert sink.flush(timeout=5)
+    sink.stop()
+    logs = DashboardLog.query.order_by(DashboardLog.id).all()
+    assert [log.action for log in logs] == [f'Package: pkg{i} -> 1.0' for i in range(5)]
+    assert json.loads(logs[4].details) == {'index': 4} and logs[0].node_name == 'pve1'
+    assert sink.stats() == {'queued': 5, 'written': 5, 'dropped': 0, 'failed_batches': 0, 'pending': 0}
+
+
+@pytest.mark.parametrize('policy, kept', [
+    ('drop_oldest', ['entry 2', 'entry 3']),
+    ('drop_newest', ['entry 0', 'entry 1']),
+    ('block', ['entry 0', 'entry 1']),
+])
+def test_full_queue_applies_the_drop_policy(app, async_logs, policy, kept):
+    sink = LogSink(max_queue=2, policy=policy, block_timeout=0.01)
+    # Hold the queue lock so the writer cannot take entries while it fills up
+    with sink._cond:
+        sink._start(app)
+        results = [sink.log(None, f'entry {i}') for i in range(4)]
+        assert [entry['action'] for entry in sink._queue] == kept
+    sink.stop()
+
+    assert results == ([True] * 4 if policy == 'drop_oldest' else [True, True, False, False])
+    assert sink.stats()['dropped'] == 2
+    assert [log.action for log in DashboardLog.query.order_by(DashboardLog.id)] == kept
+
+
+def test_sync_mode_commits_right_away(app):
+    sink = LogSink()
+    sink.log(None, 'x' * 300, 'warning')
+    log = DashboardLog.query.one()
+    assert len(log.action) == 255 and log.status == 'warning'
+    assert sink.stats()['queued'] == 0
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+import pytest
+from models import DashboardLog, db
+
+
+@pytest.fixture
+def logs(app):
+    start = datetime(2024, 1, 1)
+    for index in range(10):
+        db.session.add(DashboardLog(
+            node_name='pve1' if index % 2 else 'pve2',
+            action=f'entry {index}',
+            status='error' if index == 9 else 'info',
+            created_at=start + timedelta(minutes=index)
+        ))
+    db.session.commit()
+    return [log.id for log in DashboardLog.query.order_by(DashboardLog.id)]
+
+
+@pytest.fixture
+def user(client):
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
+
+
+def actions(response):
+    assert response.status_code == 200
+    return [log['action'] for log in response.get_json()]
+
+
+def test_logs_are_paged_with_before_id(user, logs):
+    first = user.get('/api/logs?limit=4').get_json()
+    assert [log['action'] for log in first] == ['entry 8', 'entry 7', 'entry 6', 'entry 5']
+    assert actions(user.get(f"/api/logs?limit=4&before_id={first[-1]['id']}")) == \
+        ['entry 4', 'entry 3', 'entry 2', 'entry 1']
+    assert user.get('/api/logs?before_id=999999').status_code == 400
+
+
+def test_logs_since_id_returns_new_entries_oldest_page_first(user, logs):
+    assert actions(user.get(f'/api/logs?since_id={logs[4]}&limit=2')) == ['entry 6', 'entry 5']
+    assert actions(user.get(f'/api/logs?since_id={logs[8]}')) == []
+
+
+def test_logs_filter_by_status_and_node(user, logs):
+    assert actions(user.get('/api/logs?status=error')) == ['entry 9']
+    assert actions(user.get('/api/logs?node=pve2&limit=2')) == ['entry 8', 'entry 6']
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+import pytest
+from models import db, HostMetrics, VMMetrics, ContainerMetrics
+from utils.metrics_buffer import MetricsBuffer, metrics_buffer
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def user(client):
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
+
+
+def cycle(i, vms=(100, 101), start=START):
+    timestamp = start + timedelta(seconds=30 * i)
+    return timestamp, {
+        HostMetrics: [dict(node_name='pve1', cpu_usage=10.0 + i, memory_usage=50.0, disk_usage=20.0)],
+        VMMetrics: [dict(vmid=vmid, node_name='pve1', cpu_usage=float(vmid - 100 + i), memory_usage=10.0,
+                         disk_usage=None) for vmid in vms],
+        ContainerMetrics: [],
+    }
+
+
+def test_buffer_keeps_the_last_cycles():
+    buffer = MetricsBuffer(cycles=3)
+    for i in range(5):
+        buffer.append(*cycle(i))
+
+    assert buffer.oldest() == START + timedelta(seconds=60)
+    assert buffer.covers(START + timedelta(seconds=60)) and not buffer.covers(START)
+    samples = buffer.series('vm', 101)
+    assert [sample['cpu_usage'] for sample in samples] == [3.0, 4.0, 5.0]
+    assert samples[0]['disk_usage'] is None and samples[0]['timestamp'] == START + timedelta(seconds=60)
+    assert buffer.series('vm', 999) is None
+
+    assert buffer.latest('host') == {'pve1': 14.0}
+    assert buffer.averages('vm', since=START + timedelta(seconds=90)) == {100: 3.5, 101: 4.5}
+    assert buffer.top('vm', n=1) == [(101, 'pve1', 5.0)]
+
+
+def test_buffer_reuses_slots_and_respects_its_budget():
+    buffer = MetricsBuffer(cycles=2)
+    buffer.append(*cycle(0, vms=range(100, 116)))
+    width = buffer.stats()['bytes']
+    buffer.append(*cycle(1, vms=()))
+    buffer.append(*cycle(2, vms=()))
+    buffer.append(*cycle(3, vms=range(200, 216)))
+    # The first 16 VMs dropped out of the ring, their slots were reused
+    stats = buffer.stats()
+    assert stats['evicted'] == 16 and stats['bytes'] == width
+    assert stats['entities']['vm'] == 16
+
+    small = MetricsBuffer(cycles=2, max_bytes=width)
+    small.append(*cycle(0, vms=range(100, 200)))
+    assert small.stats()['rejected'] > 0
+    assert small.nbytes() <= width
+
+
+def test_top_and_history_are_served_from_the_buffer(user):
+    metrics_buffer.clear()
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(minutes=10)
+    for i in range(20):
+        metrics_buffer.append(*cycle(i, start=start))
+
+    # Nothing in the database, so the answers come from memory
+    response = user.get('/api/metrics/top?entity=vm&metric=cpu&n=1')
+    assert response.get_json() == [{'id': 101, 'node_name': 'pve1', 'value': 20.0}]
+    body = user.get(f'/api/history/host/pve1?from={start.isoformat()}').get_json()
+    assert body['source'] == 'raw' and body['samples'] == 20
+    assert user.get('/api/metrics/collector').get_json()['buffer']['cycles'] == 20
+    metrics_buffer.clear()
+
+
+def test_top_falls_back_to_the_database(user):
+    metrics_buffer.clear()
+    now = datetime.utcnow()
+    db.session.add_all([
+        VMMetrics(vmid=100, name='a', node_name='pve1', status='running', cpu_usage=30.0, timestamp=now),
+        VMMetrics(vmid=101, name='b', node_name='pve2', status='running', cpu_usage=50.0, timestamp=now),
+    ])
+    db.session.commit()
+
+    top = user.get('/api/metrics/top?n=1').get_json()
+    assert top == [{'id': 101, 'node_name': 'pve2', 'value': 50.0}]
+    assert len(user.get('/api/metrics/top?window=600').get_json()) == 2
+    assert user.get('/api/metrics/top?metric=network').status_code == 400
+
+
+def test_buffer_follows_cycles_committed_by_another_process(app):
+    from models import ClusterMetrics, LatestHostState, LatestGuestState
+    buffer = MetricsBuffer(cycles=10)
+
+    def commit_cycle(i, guests=True):
+        cycle = ClusterMetrics(node_count=1, timestamp=START + timedelta(seconds=30 * i))
+        db.session.add(cycle)
+        db.session.flush()
+        db.session.merge(LatestHostState(node_name='pve1', cpu_usage=10.0 + i, cycle_id=cycle.id))
+        if guests:
+            db.session.merge(LatestGuestState(guest_type='qemu', vmid=100, node_name='pve1',
+                                              cpu_usage=float(i), cycle_id=cycle.id))
+        db.session.commit()
+        return cycle.id
+
+    assert buffer.sync() is False
+    commit_cycle(0)
+    # A guest whose fetch failed keeps the state of an older cycle and is not taken for this one
+    cycle_id = commit_cycle(1, guests=False)
+    assert buffer.sync() is True and buffer.sync() is False
+    assert (buffer.stats()['cycle_id'], buffer.stats()['source']) == (cycle_id, 'database')
+    commit_cycle(2)
+    assert buffer.sync() is True
+
+    assert buffer.series('host', 'pve1') == [
+        {'cpu_usage': 11.0, 'memory_usage': None, 'disk_usage': None, 'timestamp': START + timedelta(seconds=30)},
+        {'cpu_usage': 12.0, 'memory_usage': None, 'disk_usage': None, 'timestamp': START + timedelta(seconds=60)},
+    ]
+    assert buffer.latest('vm') == {100: 2.0}
+    assert buffer.covers(START + timedelta(seconds=30))
+
+    # Two cycles between syncs: the buffer starts over rather than hold a gap
+    commit_cycle(3)
+    commit_cycle(4)
+    assert buffer.sync() is True
+    assert buffer.oldest() == START + timedelta(seconds=120)
+    assert buffer.stats()['restarts'] == 1
@@ -0,0 +1,355 @@
+import json
+import pytest
+from models import (
+    ProxmoxCredentials, HostMetrics, VMMetrics,
+    ContainerMetrics, ClusterMetrics, DashboardLog,
+    LatestHostState, LatestGuestState, db
+)
+from utils.metrics_collector import collect_metrics_job
+from utils.node_drainer import NodeDrainer, get_node_vms
+from utils.snapshot import get_latest_snapshot, publish_snapshot
+from utils.config_cache import guest_config_cache
+from utils.latest_state import latest_guest_counts
+
+GiB = 1024 ** 3
+
+
+class FakeResource:
+    """Minimal stand-in for a proxmoxer resource path"""
+
+    def __init__(self, api, path=()):
+        self._api = api
+        self._path = path
+
+    def __getattr__(self, name):
+        return FakeResource(self._api, self._path + (name,))
+
+    def __call__(self, *args):
+        return FakeResource(self._api, self._path + tuple(str(a) for a in args))
+
+    def get(self):
+        path = '/'.join(self._path)
+        self._api.calls.append(path)
+        return self._api.responses[path]
+
+
+class FakeProxmox(FakeResource):
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+        super().__init__(self)
+
+
+def make_cluster():
+    """Two nodes with one VM and one container each"""
+    responses = {
+        'cluster/resources': [],
+        'cluster/tasks': [],
+        'nodes': [],
+    }
+    for index, node_name in enumerate(['pve1', 'pve2']):
+        vmid = 100 + index
+        ctid = 200 + index
+        responses['cluster/resources'] += [
+            {'type': 'node', 'node': node_name, 'status': 'online', 'cpu': 0.25,
+             'maxcpu': 8, 'mem': 4 * GiB, 'maxmem': 16 * GiB, 'disk': 10 * GiB,
+             'maxdisk': 100 * GiB, 'uptime': 90061},
+            {'type': 'qemu', 'node': node_name, 'vmid': vmid, 'name': f'vm{vmid}',
+             'status': 'running', 'cpu': 0.5, 'mem': GiB, 'maxmem': 2 * GiB, 'disk': 0},
+            {'type': 'lxc', 'node': node_name, 'vmid': ctid, 'name': f'ct{ctid}',
+             'status': 'running', 'cpu': 0.1, 'mem': GiB, 'maxmem': 4 * GiB, 'disk': 2 * GiB},
+            {'type': 'storage', 'node': node_name, 'storage': 'local', 'disk': GiB, 'maxdisk': 10 * GiB},
+        ]
+        responses['nodes'].append({'node': node_name, 'status': 'online', 'cpu': 0.25})
+        responses[f'nodes/{node_name}/status'] = {
+            'cpu': 0.25, 'cpuinfo': {'cpus': 8}, 'uptime': 90061,
+            'memory': {'used': 4 * GiB, 'total': 16 * GiB},
+            'rootfs': {'used': 10 * GiB, 'total': 100 * GiB},
+        }
+        responses[f'nodes/{node_name}/network'] = [
+            {'iface': 'eth0'},
+            {'iface': 'vmbr0', 'address': f'10.0.0.{index + 1}/24'},
+        ]
+        responses[f'nodes/{node_name}/qemu'] = [{'vmid': vmid, 'name': f'vm{vmid}', 'status': 'running'}]
+        responses[f'nodes/{node_name}/lxc'] = [{'vmid': ctid, 'name': f'ct{ctid}', 'status': 'running'}]
+        responses[f'nodes/{node_name}/qemu/{vmid}/status/current'] = {
+            'cpu': 0.5, 'mem': GiB, 'maxmem': 2 * GiB, 'disk': 0}
+        responses[f'nodes/{node_name}/lxc/{ctid}/status/current'] = {
+            'cpu': 0.1, 'mem': GiB, 'maxmem': 4 * GiB, 'disk': 2 * GiB}
+        responses[f'nodes/{node_name}/qemu/{vmid}/config'] = {'scsi0': 'local-lvm:vm-disk-0,size=32G'}
+        responses[f'nodes/{node_name}/lxc/{ctid}/config'] = {'rootfs': 'local-lvm:subvol,size=8G'}
+    return FakeProxmox(responses)
+
+
+@pytest.fixture
+def fake_proxmox(app, monkeypatch):
+    db.session.add(ProxmoxCredentials(hostname='pve', username='root@pam', password='secret'))
+    db.session.commit()
+    proxmox = make_cluster()
+    guest_config_cache.clear()
+    monkeypatch.setattr(ProxmoxCredentials, 'get_proxmox_connection', lambda self: proxmox)
+    yield proxmox
+    publish_snapshot(None)
+
+
+def snapshot_rows():
+    hosts = sorted((h.node_name, h.ip_address, h.cpu_usage, h.cpu_cores, h.memory_usage,
+                    h.memory_total, h.disk_usage, h.uptime, h.uptime_formatted)
+                   for h in HostMetrics.query.all())
+    vms = sorted((v.node_name, v.vmid, v.name, v.status, v.cpu_usage, v.memory_usage, v.disk_usage)
+                 for v in VMMetrics.query.all())
+    cts = sorted((c.node_name, c.container_id, c.name, c.status, c.cpu_usage, c.memory_usage, c.disk_usage)
+                 for c in ContainerMetrics.query.all())
+    cluster = [(c.total_cpu, c.used_cpu, c.total_memory, c.used_memory, c.total_disk, c.used_disk, c.node_count)
+               for c in ClusterMetrics.query.all()]
+    return hosts, vms, cts, cluster
+
+
+def test_cluster_mode_collects_metrics(app, fake_proxmox):
+    """Cluster mode fills all metrics tables from /cluster/resources"""
+    app.config['METRICS_COLLECTION_MODE'] = 'cluster'
+    collect_metrics_job()
+
+    hosts, vms, cts, cluster = snapshot_rows()
+    assert hosts[0] == ('pve1', '10.0.0.1', 25.0, 8, 25.0, 16 * GiB, 10.0, 90061, '1d 1h 1m')
+    assert [vm[:4] for vm in vms] == [('pve1', 100, 'vm100', 'running'), ('pve2', 101, 'vm101', 'running')]
+    assert vms[0][4:6] == (50.0, 50.0)
+    assert cts[0][4:] == (10.0, 25.0, 25.0)
+    assert cluster == [(16, 50.0, 32 * GiB, 8 * GiB, 200 * GiB, 20 * GiB, 2)]
+
+    # No per-guest status requests are needed in cluster mode
+    assert fake_proxmox.calls.count('cluster/resources') == 1
+    assert not [call for call in fake_proxmox.calls if call.endswith('status/current')]
+
+
+def test_cluster_mode_matches_per_node_mode(app, fake_proxmox):
+    """Both collection modes produce identical rows"""
+    app.config['METRICS_COLLECTION_MODE'] = 'nodes'
+    collect_metrics_job()
+    per_node_rows = snapshot_rows()
+
+    for model in (HostMetrics, VMMetrics, ContainerMetrics, ClusterMetrics):
+        model.query.delete()
+    db.session.commit()
+
+    app.config['METRICS_COLLECTION_MODE'] = 'cluster'
+    collect_metrics_job()
+    assert snapshot_rows() == per_node_rows
+
+
+def test_failed_node_does_not_stop_collection(app, fake_proxmox):
+    """A node whose API calls fail is reported without losing the other nodes"""
+    app.config['METRICS_COLLECTION_MODE'] = 'cluster'
+    app.config['METRICS_COLLECTOR_WORKERS'] = 4
+    del fake_proxmox.responses['nodes/pve2/network']
+    collect_metrics_job()
+
+    assert [h.node_name for h in HostMetrics.query.all()] == ['pve1']
+    assert [v.vmid for v in VMMetrics.query.all()] == [100]
+
+    log = DashboardLog.query.filter(DashboardLog.action.like('Gathering metrics%')).one()
+    details = json.loads(log.details)
+    assert log.status == 'warning'
+    assert details['failed_nodes'] == ['pve2']
+    assert set(details['node_timings']) == {'pve1', 'pve2'}
+
+
+def test_snapshot_is_shared_with_drainer(app, fake_proxmox):
+    """The drainer plans from the cycle snapshot instead of calling the API"""
+    app.config['METRICS_COLLECTION_MODE'] = 'cluster'
+    collect_metrics_job()
+
+    snapshot = get_latest_snapshot()
+    assert snapshot.totals()['node_count'] == 2
+    assert ClusterMetrics.query.one().total_memory == snapshot.totals()['total_memory']
+    # The snapshot is tagged with the cycle that wrote it
+    assert get_latest_snapshot(cycle_id=ClusterMetrics.query.one().id) is snapshot
+    assert get_latest_snapshot(cycle_id=ClusterMetrics.query.one().id + 1) is None
+    with pytest.raises(AttributeError):
+        snapshot.nodes[0].cpu = 1
+
+    calls_before = len(fake_proxmox.calls)
+    drainer = NodeDrainer.__new__(NodeDrainer)
+    assert drainer.get_available_nodes('pve1') == ['pve2']
+    assert drainer.get_node_resources('pve2') == {'cpu': 2.0, 'maxcpu': 8, 'mem': 4 * GiB, 'maxmem': 16 * GiB}
+    assert get_node_vms('pve1') == ([100], [200])
+    assert len(fake_proxmox.calls) == calls_before
+
+
+def test_guest_configs_are_cached_until_a_task_touches_them(app, fake_proxmox):
+    """Configs are fetched once and refetched only after a config-changing task"""
+    app.config['METRICS_COLLECTION_MODE'] = 'cluster'
+    collect_metrics_job()
+    collect_metrics_job()
+    config_calls = [call for call in fake_proxmox.calls if call.endswith('/config')]
+    assert len(config_calls) == 4
+
+    fake_proxmox.responses['cluster/tasks'] = [
+        {'type': 'qmigrate', 'id': '100', 'starttime': 1700000000, 'endtime': 1700000060},
+        {'type': 'vncproxy', 'id': '101', 'starttime': 1700000000},
+    ]
+    fake_proxmox.calls.clear()
+    collect_metrics_job()
+    assert [call for call in fake_proxmox.calls if call.endswith('/config')] == ['nodes/pve1/qemu/100/config']
+
+
+def test_latest_state_is_upserted_each_cycle(app, fake_proxmox):
+    """Latest state holds one row per host and guest, stamped with the cycle id"""
+    app.config['METRICS_COLLECTION_MODE'] = 'cluster'
+    collect_metrics_job()
+    fake_proxmox.responses['cluster/resources'] = [
+        resource for resource in fake_proxmox.responses['cluster/resources']
+        if resource.get('vmid') != 101
+    ]
+    collect_metrics_job()
+
+    cycle_id = ClusterMetrics.query.order_by(ClusterMetrics.id.desc()).first().id
+    assert VMMetrics.query.count() == 3
+    assert sorted(h.node_name for h in LatestHostState.query.all()) == ['pve1', 'pve2']
+    guests = sorted((g.guest_type, g.vmid, g.node_name, g.cycle_id) for g in LatestGuestState.query.all())
+    assert guests == [('lxc', 200, 'pve1', cycle_id), ('lxc', 201, 'pve2', cycle_id),
+                      ('qemu', 100, 'pve1', cycle_id)]
+    assert latest_guest_counts() == ((1, 1), (2, 2))
+
+    # Without a fresh snapshot the drainer reads the latest state table
+    publish_snapshot(None)
+    assert get_node_vms('pve1') == ([100], [200])
+    assert get_node_vms('pve2') == ([], [201])
+
+
+def test_latest_state_keeps_listed_guests_that_failed_to_collect(app, fake_proxmox):
+    """A guest still listed on its node but not fetched this cycle keeps its stale row"""
+    app.config['METRICS_COLLECTION_MODE'] = 'nodes'
+    collect_metrics_job()
+    first_cycle = ClusterMetrics.query.one().id
+    del fake_proxmox.responses['nodes/pve2/qemu/101/status/current']
+    fake_proxmox.responses['nodes/pve1/lxc'] = []
+    collect_metrics_job()
+
+    cycle_id = ClusterMetrics.query.order_by(ClusterMetrics.id.desc()).first().id
+    guests = sorted((g.guest_type, g.vmid, g.cycle_id) for g in LatestGuestState.query.all())
+    assert guests == [('lxc', 201, cycle_id), ('qemu', 100, cycle_id), ('qemu', 101, first_cycle)]
+
+
+@pytest.fixture
+def async_api(fake_proxmox, monkeypatch):
+    """Serve the fake cluster over HTTP for the async backend"""
+    pytest.importorskip('aiohttp')
+    import asyncio
+    import threading
+    from aiohttp import web
+    from utils import async_collector
+
+    async def handle(request):
+        path = request.match_info['path']
+        if path not in fake_proxmox.responses:
+            return web.json_response({'data': None}, status=404)
+        fake_proxmox.calls.append(path)
+        await asyncio.sleep(fake_proxmox.delays.get(path, 0))
+        return web.json_response({'data': fake_proxmox.responses[path]})
+
+    loop = asyncio.new_event_loop()
+    app_runner = web.AppRunner(web.Application())
+    app_runner.app.router.add_post('/api2/json/access/ticket',
+                                   lambda request: web.json_response({'data': {'ticket': 'PVE:root@pam:TICKET'}}))
+    app_runner.app.router.add_get('/api2/json/{path:.*}', handle)
+    loop.run_until_complete(app_runner.setup())
+    site = web.TCPSite(app_runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    original_init = async_collector.AsyncProxmoxClient.__init__
+
+    def plain_http(self, credentials, session):
+        original_init(self, credentials, session)
+        self.base_url = f"http://127.0.0.1:{port}/api2/json"
+    monkeypatch.setattr(async_collector.AsyncProxmoxClient, '__init__', plain_http)
+    # Seconds the server waits before answering, per path
+    fake_proxmox.delays = {}
+    yield fake_proxmox
+
+    asyncio.run_coroutine_threadsafe(app_runner.cleanup(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+
+@pytest.mark.parametrize('mode', ['cluster', 'nodes'])
+def test_async_backend_matches_threaded_backend(app, async_api, mode):
+    """Both backends write identical rows"""
+    app.config['METRICS_COLLECTION_MODE'] = mode
+    try:
+        app.config['METRICS_COLLECTOR_BACKEND'] = 'threads'
+        collect_metrics_job()
+        threaded = snapshot_rows()
+        for model in (HostMetrics, VMMetrics, ContainerMetrics, ClusterMetrics):
+            model.query.delete()
+        db.session.commit()
+        guest_config_cache.clear()
+
+        app.config['METRICS_COLLECTOR_BACKEND'] = 'async'
+        collect_metrics_job()
+        assert snapshot_rows() == threaded
+        assert len(threaded[1]) == 2
+    finally:
+        app.config['METRICS_COLLECTOR_BACKEND'] = 'threads'
+
+
+def test_async_timeout_bounds_the_whole_collection(app, async_api):
+    """Nodes still being collected when the timeout runs out fail, the others are kept"""
+    import time
+    from utils.async_collector import collect_async
+    # Each request answers within the timeout, the two on pve2 together do not
+    async_api.delays = {'nodes/pve2/network': 0.4, 'nodes/pve2/qemu/101/config': 0.4}
+
+    started = time.monotonic()
+    nodes, _, results = collect_async(ProxmoxCredentials.query.first(), 'cluster', timeout=0.6)
+    assert time.monotonic() - started < 1.5
+
+    errors = {result['node']['node']: result['error'] for result in results}
+    assert errors['pve1'] is None and 'Timed out' in errors['pve2']
+    assert len(nodes) == 2 and len(results[0]['guests']) == 2
+
+
+def test_collection_is_instrumented(app, fake_proxmox):
+    """Cycles, phases and rows written show up in the metrics registry"""
+    from utils.instrumentation import COLLECTION_CYCLES, COLLECTION_PHASE_SECONDS, ROWS_WRITTEN
+    app.config['METRICS_COLLECTION_MODE'] = 'nodes'
+    cycles = COLLECTION_CYCLES.value(result='success')
+    vm_rows = ROWS_WRITTEN.value(table='vm_metrics')
+    details = COLLECTION_PHASE_SECONDS.count(phase='guest_details')
+
+    collect_metrics_job()
+
+    assert COLLECTION_CYCLES.value(result='success') == cycles + 1
+    assert ROWS_WRITTEN.value(table='vm_metrics') == vm_rows + 2
+    assert COLLECTION_PHASE_SECONDS.count(phase='guest_details') == details + 2
+
+
+def test_delta_mode_stores_changes_and_fills_gaps(app, client, fake_proxmox, monkeypatch):
+    """Unchanged guests are not stored again, but readers still see them every cycle"""
+    from utils.delta_storage import delta_filter
+    app.config['METRICS_COLLECTION_MODE'] = 'cluster'
+    monkeypatch.setitem(app.config, 'METRICS_STORAGE_MODE', 'delta')
+    delta_filter.clear()
+
+    collect_metrics_job()
+    # Only vm101's CPU moves beyond the tolerance
+    for resource in fake_proxmox.responses['cluster/resources']:
+        if resource.get('vmid') == 101:
+            resource['cpu'] = 0.9
+        elif resource.get('vmid') == 100:
+            resource['cpu'] = 0.505
+    collect_metrics_job()
+
+    assert VMMetrics.query.count() == 3
+    assert ContainerMetrics.query.count() == 2
+    assert HostMetrics.query.count() == 4
+
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    vms = client.get('/api/metrics/vms').get_json()
+    assert sorted((vm['vmid'], vm['cpu_usage']) for vm in vms) == [(100, 50.0), (100, 50.0), (101, 50.0), (101, 90.0)]
+    assert len({vm['timestamp'] for vm in vms}) == 2
+    assert len(client.get('/api/metrics/containers').get_json()) == 4
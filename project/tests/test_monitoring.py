@@ -0,0 +1,64 @@
+import urllib.error
+import urllib.request
+import pytest
+from utils.instrumentation import Registry, api_endpoint, start_metrics_server, HTTP_REQUEST_SECONDS
+
+
+def test_metrics_endpoint_renders_registry(client):
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    client.get('/metrics')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert '# TYPE pcm_collection_cycle_seconds histogram' in body
+    assert 'pcm_http_request_seconds_count{route="/metrics",method="GET",status="200"}' in body
+    assert HTTP_REQUEST_SECONDS.count(route='/metrics', method='GET', status='200') >= 1
+
+
+def test_metrics_endpoint_requires_the_token_or_a_session(app, client, monkeypatch):
+    assert client.get('/metrics').status_code == 401
+
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scrape-secret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'}).status_code == 200
+
+
+def test_worker_metrics_server_requires_the_token():
+    server = start_metrics_server(0, host='127.0.0.1', token='scrape-secret')
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+    try:
+        with pytest.raises(urllib.error.HTTPError) as refused:
+            urllib.request.urlopen(url, timeout=5)
+        assert refused.value.code == 401
+        request = urllib.request.Request(url, headers={'Authorization': 'Bearer scrape-secret'})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            assert response.status == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_histogram_text_format():
+    registry = Registry()
+    latency = registry.histogram('test_seconds', 'Test latency', ('endpoint',), buckets=(0.1, 1))
+    latency.observe(0.05, endpoint='a')
+    latency.observe(0.5, endpoint='a')
+    latency.observe(5, endpoint='a')
+    calls = registry.counter('test_calls_total', 'Test calls', ('endpoint',))
+    calls.inc(endpoint='a "quoted"')
+
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{endpoint="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{endpoint="a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{endpoint="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_sum{endpoint="a"} 5.55' in lines
+    assert 'test_calls_total{endpoint="a \\"quoted\\""} 1' in lines
+
+
+def test_api_endpoints_are_grouped():
+    assert api_endpoint('/api2/json/nodes/pve1/qemu/100/status/current') == 'nodes/{node}/qemu/{vmid}/status/current'
+    assert api_endpoint('https://pve:8006/api2/json/cluster/resources?type=vm') == 'cluster/resources'
+    assert api_endpoint('nodes/pve2/lxc/200/config') == 'nodes/{node}/lxc/{vmid}/config'
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, time
+import pytest
+from sqlalchemy import text
+from models import db, HostMetrics, VMMetrics
+from utils.partitioning import PARTITIONED_MODELS, _partitions, is_partitioned, setup_partitioning
+
+
+def recreate_plain_tables():
+    db.session.remove()
+    for model in PARTITIONED_MODELS:
+        # Drops the partitions of a converted table along with it
+        model.__table__.drop(db.engine, checkfirst=True)
+        model.__table__.create(db.engine)
+
+
+@pytest.fixture
+def postgres(app):
+    if db.engine.dialect.name != 'postgresql':
+        pytest.skip('Partitioning needs PostgreSQL')
+    recreate_plain_tables()
+    yield
+    recreate_plain_tables()
+
+
+def test_converts_a_table_with_rows_from_today(postgres):
+    now = datetime.utcnow()
+    db.session.add_all([
+        HostMetrics(node_name='pve1', cpu_usage=1.0, timestamp=now - timedelta(days=3)),
+        HostMetrics(node_name='pve1', cpu_usage=2.0, timestamp=now),
+        VMMetrics(vmid=100, name='vm100', node_name='pve1', cpu_usage=3.0, timestamp=now),
+    ])
+    db.session.commit()
+    # Rows without a timestamp are stamped with the time of the conversion
+    db.session.execute(text('UPDATE vm_metrics SET "timestamp" = NULL'))
+    db.session.commit()
+
+    assert setup_partitioning(days_ahead=2)
+
+    assert all(is_partitioned(model.__table__.name) for model in PARTITIONED_MODELS)
+    assert HostMetrics.query.count() == 2 and VMMetrics.query.count() == 1
+    # Today stays in the legacy partition, the daily partitions start tomorrow
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), time.min)
+    for name in ('host_metrics', 'vm_metrics'):
+        assert _partitions(name) == [
+            (f'{name}_legacy', tomorrow),
+            (f'{name}_p{tomorrow:%Y%m%d}', tomorrow + timedelta(days=1)),
+            (f'{name}_p{tomorrow + timedelta(days=1):%Y%m%d}', tomorrow + timedelta(days=2)),
+        ]
+    # An empty table starts its daily partitions today
+    assert _partitions('container_metrics')[1][1] == tomorrow
+
+    db.session.add(HostMetrics(node_name='pve1', cpu_usage=4.0, timestamp=now + timedelta(days=1)))
+    db.session.commit()
+    assert HostMetrics.query.count() == 3
+    # Running again on every start leaves the converted tables alone
+    assert setup_partitioning(days_ahead=2)
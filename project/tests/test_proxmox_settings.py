@@ -107,3 +107,36 @@ def test_unauthorized_access(client):
     })
     assert response.status_code == 401
     assert 'unauthorized' in response.get_json().get('error', '').lower()
+
+
+def test_upgrade_adds_token_columns(app):
+    """A proxmox_credentials table from before API token support gets the token columns"""
+    from sqlalchemy import MetaData, Table, Column, Integer, String, Boolean, DateTime, inspect
+    from models import ensure_columns
+
+    table = ProxmoxCredentials.__table__
+    baseline = Table(
+        table.name, MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('hostname', String(255), nullable=False),
+        Column('username', String(255)),
+        Column('password', String(255)),
+        Column('port', Integer),
+        Column('verify_ssl', Boolean),
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime)
+    )
+    db.session.remove()
+    table.drop(db.engine)
+    baseline.create(db.engine)
+    with db.engine.begin() as connection:
+        connection.execute(baseline.insert().values(hostname='pve.example', username='root@pam', password='secret'))
+
+    ensure_columns()
+    # Running again on an up to date database does nothing
+    ensure_columns()
+
+    assert {'token_name', 'token_value'} <= {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+    credentials = ProxmoxCredentials.query.one()
+    assert credentials.hostname == 'pve.example' and credentials.token_name is None
+    assert credentials.auth_type == 'Password Auth'
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+import pytest
+from models import db, HostMetrics, VMMetrics, ClusterMetrics, MetricsRollup, RollupWatermark
+from utils.rollups import compact_rollups, apply_retention
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def add_samples(minutes, start=START):
+    """One host and one VM sample every 30 seconds"""
+    rows = []
+    for i in range(minutes * 2):
+        timestamp = start + timedelta(seconds=30 * i)
+        rows.append(HostMetrics(node_name='pve1', cpu_usage=float(i % 10), memory_usage=50.0,
+                                disk_usage=20.0, uptime='1d', timestamp=timestamp))
+        rows.append(VMMetrics(vmid=100, name='vm100', node_name='pve1', status='running',
+                              cpu_usage=float(i), memory_usage=10.0, disk_usage=5.0, timestamp=timestamp))
+    db.session.add_all(rows)
+    db.session.commit()
+
+
+def rollups(tier, entity_type):
+    return MetricsRollup.query.filter_by(tier=tier, entity_type=entity_type).order_by(MetricsRollup.bucket_start).all()
+
+
+def test_compaction_builds_every_tier(app):
+    add_samples(120)
+    written = compact_rollups(now=START + timedelta(hours=2, minutes=5))
+
+    assert written['1m'] == 240
+    minute = rollups('1m', 'vm')
+    assert len(minute) == 120
+    assert minute[0].samples == 2
+    assert (minute[0].cpu_min, minute[0].cpu_avg, minute[0].cpu_max) == (0.0, 0.5, 1.0)
+
+    quarter = rollups('15m', 'vm')
+    assert len(quarter) == 8
+    assert quarter[0].samples == 30
+    assert quarter[0].cpu_avg == sum(range(30)) / 30
+
+    hour = rollups('1h', 'host')
+    assert len(hour) == 2
+    assert hour[0].entity_id == 'pve1'
+    assert (hour[0].cpu_min, hour[0].cpu_max) == (0.0, 9.0)
+    assert hour[0].cpu_avg == 4.5
+
+
+def test_compaction_is_incremental(app):
+    add_samples(10)
+    compact_rollups(now=START + timedelta(minutes=5, seconds=40))
+    assert len(rollups('1m', 'vm')) == 5
+
+    # A second run only picks up the buckets completed since the watermark
+    compact_rollups(now=START + timedelta(minutes=10, seconds=40))
+    assert len(rollups('1m', 'vm')) == 10
+    assert db.session.get(RollupWatermark, '1m').processed_until == START + timedelta(minutes=10)
+
+
+def test_compaction_works_off_a_backlog_of_several_spans(app):
+    # Twelve hours from 00:10: two 6 hour spans per tier, the last one partial
+    start = datetime(2024, 1, 1, 0, 10)
+    db.session.add_all([HostMetrics(node_name='pve1', cpu_usage=1.0, timestamp=start + timedelta(minutes=i))
+                        for i in range(717)])
+    db.session.commit()
+
+    written = compact_rollups(now=datetime(2024, 1, 1, 12, 7))
+
+    assert written == {'1m': 716, '15m': 48, '1h': 12}
+    watermarks = {tier: db.session.get(RollupWatermark, tier).processed_until for tier in ('1m', '15m', '1h')}
+    assert watermarks == {'1m': datetime(2024, 1, 1, 12, 6), '15m': datetime(2024, 1, 1, 12, 0),
+                          '1h': datetime(2024, 1, 1, 12, 0)}
+
+
+def test_delta_mode_weights_stored_values_by_the_cycles_they_stood_for(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_STORAGE_MODE', 'delta')
+    cycles = [START + timedelta(seconds=30 * i) for i in range(30)]
+    db.session.add_all(ClusterMetrics(node_count=1, timestamp=timestamp) for timestamp in cycles)
+    # Idle for 29 cycles, one spike in the last one: only the two changes are stored
+    for timestamp, cpu in ((cycles[0], 10.0), (cycles[-1], 90.0)):
+        db.session.add(VMMetrics(vmid=100, name='vm100', node_name='pve1', status='running',
+                                 cpu_usage=cpu, memory_usage=10.0, timestamp=timestamp))
+    db.session.commit()
+
+    compact_rollups(now=START + timedelta(minutes=15, seconds=40))
+
+    minute = rollups('1m', 'vm')
+    assert len(minute) == 15 and all(rollup.samples == 2 for rollup in minute)
+    quarter = rollups('15m', 'vm')
+    assert len(quarter) == 1 and quarter[0].samples == 30
+    assert quarter[0].cpu_avg == pytest.approx((29 * 10.0 + 90.0) / 30)
+    assert (quarter[0].cpu_min, quarter[0].cpu_max) == (10.0, 90.0)
+
+
+def test_retention_waits_for_next_tier(app):
+    add_samples(10)
+    app.config['METRICS_RETENTION_DAYS'] = {'raw': 1, '1m': 14, '15m': 90, '1h': 730}
+    try:
+        # Nothing has been compacted yet, so nothing may be deleted
+        deleted = apply_retention(now=START + timedelta(days=2))
+        assert deleted['raw'] == 0
+
+        compact_rollups(now=START + timedelta(minutes=10, seconds=40))
+        deleted = apply_retention(now=START + timedelta(days=2))
+        assert deleted['raw'] == 40
+        assert HostMetrics.query.count() == 0
+        assert len(rollups('1m', 'host')) == 10
+    finally:
+        app.config['METRICS_RETENTION_DAYS'] = {'raw': 7, '1m': 14, '15m': 90, '1h': 730}
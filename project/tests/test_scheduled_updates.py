@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+from models import UpdateSchedule, db
+from utils import node_updater
+
+
+def test_due_updates_are_run_by_the_scheduler(app, monkeypatch):
+    """Scheduled updates are stored and executed by run_due_updates once due"""
+    executed = []
+    monkeypatch.setattr(node_updater, 'execute_update', executed.append)
+    db.session.add_all([
+        UpdateSchedule(node_name='pve1', scheduled_time=datetime.utcnow() - timedelta(minutes=1)),
+        UpdateSchedule(node_name='pve2', scheduled_time=datetime.utcnow() + timedelta(hours=1)),
+        UpdateSchedule(node_name='pve3', scheduled_time=datetime.utcnow() - timedelta(hours=1), status='completed'),
+    ])
+    db.session.commit()
+
+    node_updater.run_due_updates()
+
+    assert executed == [UpdateSchedule.query.filter_by(node_name='pve1').one().id]
+
+
+def test_schedule_route_stores_naive_utc(client, app):
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    response = client.post('/api/updates/schedule', json={'node_name': 'pve1', 'scheduled_time': '2030-01-01T12:00:00+02:00'})
+    assert response.status_code == 200
+    assert UpdateSchedule.query.one().scheduled_time == datetime(2030, 1, 1, 10, 0)
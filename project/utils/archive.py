@@ -0,0 +1,220 @@
+import os
+from datetime import datetime, timedelta, time as day_time
+from flask import current_app
+from sqlalchemy import func, select
+from models import HostMetrics, VMMetrics, ContainerMetrics, ClusterMetrics, db
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:  # Optional, only needed for METRICS_ARCHIVE_DIR
+    pa = None
+
+# Raw tables moved to the archive when they expire, and the column identifying an entity
+ARCHIVE_MODELS = (HostMetrics, VMMetrics, ContainerMetrics, ClusterMetrics)
+ENTITY_KEYS = {HostMetrics: 'node_name', VMMetrics: 'vmid', ContainerMetrics: 'container_id'}
+
+# File extension and pyarrow.dataset format per archive format
+ARCHIVE_FORMATS = {'parquet': ('.parquet', 'parquet'), 'arrow': ('.arrow', 'ipc')}
+
+# Rows fetched from the database and written per record batch
+ARCHIVE_BATCH = 50000
+
+DAY = timedelta(days=1)
+
+
+def day_start(timestamp):
+    return datetime.combine(timestamp.date(), day_time.min)
+
+
+def archive_dir():
+    return current_app.config.get('METRICS_ARCHIVE_DIR') or None
+
+
+def archive_enabled():
+    """Whether expired raw samples are archived before they are deleted"""
+    if not archive_dir():
+        return False
+    if pa is None:
+        # Refuse to go on deleting samples that were meant to be archived
+        raise RuntimeError("METRICS_ARCHIVE_DIR is set but pyarrow is not installed")
+    return True
+
+
+def archive_schema(model):
+    """Arrow schema matching the columns of a metrics table"""
+    types = {int: pa.int64(), float: pa.float64(), str: pa.string(), bool: pa.bool_(),
+             datetime: pa.timestamp('us')}
+    return pa.schema([pa.field(column.name, types[column.type.python_type])
+                      for column in model.__table__.columns])
+
+
+def _day_path(model, day, fmt):
+    name = model.__table__.name
+    return os.path.join(archive_dir(), name, f"{name}-{day:%Y-%m-%d}{ARCHIVE_FORMATS[fmt][0]}")
+
+
+def archive_day(model, day):
+    """Write the rows of one UTC day of a raw metrics table to a columnar file
+
+    The file is written under a temporary name and renamed when complete, so
+    an interrupted run leaves no partial file behind; running again for the
+    same day replaces the file.
+
+    Returns:
+        int: rows archived, no file is written for a day without rows
+    """
+    fmt = current_app.config.get('METRICS_ARCHIVE_FORMAT', 'parquet')
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format: {fmt}")
+    compression = current_app.config.get('METRICS_ARCHIVE_COMPRESSION', 'zstd')
+    compression = None if compression == 'none' else compression
+
+    table = model.__table__
+    schema = archive_schema(model)
+    path = _day_path(model, day, fmt)
+    partial = path + '.tmp'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    query = select(table).where(table.c.timestamp >= day, table.c.timestamp < day + DAY).order_by(table.c.timestamp, table.c.id)
+    result = db.session.execute(query.execution_options(yield_per=ARCHIVE_BATCH))
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(partial, schema, compression=compression or 'none')
+    else:
+        writer = pa.ipc.new_file(partial, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+
+    rows = 0
+    try:
+        with writer:
+            for batch in result.partitions():
+                columns = zip(*batch)
+                writer.write_batch(pa.record_batch(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+                rows += len(batch)
+    except Exception:
+        os.remove(partial)
+        raise
+
+    if rows:
+        os.replace(partial, path)
+    else:
+        os.remove(partial)
+    return rows
+
+
+def archive_expired(model, cutoff):
+    """Archive every whole day of a raw metrics table that ends at or before cutoff
+
+    Returns:
+        list: days archived
+    """
+    table = model.__table__
+    first = db.session.query(func.min(table.c.timestamp)).filter(table.c.timestamp < cutoff).scalar()
+    if first is None:
+        return []
+    archived = []
+    day = day_start(first)
+    while day + DAY <= cutoff:
+        rows = archive_day(model, day)
+        if rows:
+            print(f"[Archive] Archived {rows} {table.name} rows of {day:%Y-%m-%d}")
+            archived.append(day)
+        day += DAY
+    return archived
+
+
+def archived_days(model):
+    """(day, path) of every archive file of a raw metrics table, oldest first"""
+    directory = os.path.join(archive_dir() or '', model.__table__.name)
+    if not archive_dir() or not os.path.isdir(directory):
+        return []
+    prefix = f"{model.__table__.name}-"
+    extensions = {extension for extension, _ in ARCHIVE_FORMATS.values()}
+    days = []
+    for filename in os.listdir(directory):
+        stem, extension = os.path.splitext(filename)
+        if extension in extensions and stem.startswith(prefix):
+            days.append((datetime.strptime(stem[len(prefix):], '%Y-%m-%d'), os.path.join(directory, filename)))
+    return sorted(days)
+
+
+def _dataset(model, start, end):
+    """Memory-mapped dataset over the archive files overlapping [start, end), None if there are none"""
+    filesystem = pafs.LocalFileSystem(use_mmap=True)
+    schema = archive_schema(model)
+    datasets = []
+    for extension, fmt in ARCHIVE_FORMATS.values():
+        paths = [path for day, path in archived_days(model)
+                 if path.endswith(extension) and day < end and day + DAY > start]
+        if paths:
+            datasets.append(ds.dataset(paths, schema=schema, format=fmt, filesystem=filesystem))
+    if not datasets:
+        return None
+    return datasets[0] if len(datasets) == 1 else ds.dataset(datasets)
+
+
+def _expression(start, end, filters):
+    expression = (ds.field('timestamp') >= pa.scalar(start, pa.timestamp('us'))) & \
+                 (ds.field('timestamp') < pa.scalar(end, pa.timestamp('us')))
+    for column, value in (filters or {}).items():
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        expression &= ds.field(column).isin(values)
+    return expression
+
+
+def scan_archive(model, start, end, columns=None, filters=None):
+    """Stream archived rows of a raw metrics table in [start, end) as Arrow record batches
+
+    Only files of days in the range are opened; they are memory mapped and
+    only the requested columns are read.
+
+    Args:
+        columns: column names to read, all by default
+        filters: column -> value or list of values, e.g. {'vmid': [100, 101]}
+    """
+    if not archive_enabled():
+        return
+    dataset = _dataset(model, start, end)
+    if dataset is None:
+        return
+    yield from dataset.to_batches(columns=columns, filter=_expression(start, end, filters))
+
+
+def read_archive(model, start, end, columns=None, filters=None):
+    """scan_archive() collected into one pyarrow Table"""
+    schema = archive_schema(model)
+    if columns:
+        schema = pa.schema([schema.field(column) for column in columns])
+    return pa.Table.from_batches(list(scan_archive(model, start, end, columns, filters)), schema=schema)
+
+
+def usage_profile(model, start, end, quantile=0.95, filters=None):
+    """CPU and memory usage per host or guest over an archived range, for right-sizing
+
+    Returns:
+        list: per entity a dict with its id, the number of samples and the
+        mean, `quantile` percentile and maximum of cpu and memory usage
+    """
+    key = ENTITY_KEYS[model]
+    table = read_archive(model, start, end, columns=[key, 'cpu_usage', 'memory_usage'], filters=filters)
+    if not table.num_rows:
+        return []
+    aggregations = [('cpu_usage', 'count')]
+    for column in ('cpu_usage', 'memory_usage'):
+        aggregations += [(column, 'mean'), (column, 'tdigest', pc.TDigestOptions(q=quantile)), (column, 'max')]
+
+    profiles = []
+    for row in table.group_by(key).aggregate(aggregations).to_pylist():
+        profile = {'id': row[key], 'samples': row['cpu_usage_count']}
+        for metric in ('cpu', 'memory'):
+            percentile = row[f'{metric}_usage_tdigest']
+            profile[metric] = {
+                'mean': row[f'{metric}_usage_mean'],
+                'p' + format(quantile * 100, 'g'): percentile[0] if percentile else None,
+                'max': row[f'{metric}_usage_max'],
+            }
+        profiles.append(profile)
+    return sorted(profiles, key=lambda profile: profile['id'])
@@ -0,0 +1,105 @@
+import csv
+import io
+import time
+from models import db
+
+BULK_METHODS = ('auto', 'copy', 'executemany', 'orm')
+
+
+def _copy_supported():
+    """True if the session is bound to PostgreSQL through psycopg2"""
+    bind = db.session.get_bind()
+    return bind.dialect.name == 'postgresql' and bind.dialect.driver == 'psycopg2'
+
+
+def _csv_value(value):
+    if value is None:
+        return r'\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return value
+
+
+def _write_copy(model, rows):
+    """Stream rows into the model's table with PostgreSQL COPY"""
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_csv_value(row[column]) for column in columns])
+    buffer.seek(0)
+
+    # Use the session's own connection so the rows are part of its transaction
+    dbapi_connection = db.session.connection().connection
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {model.__table__.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def _write_executemany(model, rows):
+    db.session.execute(db.insert(model.__table__), rows)
+
+
+def _write_orm(model, rows):
+    for row in rows:
+        db.session.add(model(**row))
+    db.session.flush()
+
+
+def write_rows(model, rows, method='auto'):
+    """Insert one batch of rows (dicts of column values) into a model's table
+
+    The rows are written inside the current session transaction. The caller
+    commits.
+
+    Args:
+        model: mapped model class, e.g. VMMetrics
+        rows: list of dicts with the same keys
+        method: 'auto' (COPY on PostgreSQL, executemany otherwise),
+            'copy', 'executemany' or 'orm'
+
+    Returns:
+        str: the method that was used
+    """
+    if not rows:
+        return None
+    if method not in BULK_METHODS:
+        raise ValueError(f"Unknown bulk write method: {method}")
+
+    if method == 'auto':
+        method = 'copy' if _copy_supported() else 'executemany'
+
+    if method == 'copy':
+        _write_copy(model, rows)
+    elif method == 'executemany':
+        _write_executemany(model, rows)
+    else:
+        _write_orm(model, rows)
+    return method
+
+
+def write_metrics(batches, method='auto'):
+    """Write one batch per table for a collection cycle
+
+    Args:
+        batches: mapping of model class to a list of row dicts
+        method: see write_rows
+
+    Returns:
+        dict: rows written and seconds spent per table name
+    """
+    written = {}
+    for model, rows in batches.items():
+        started = time.monotonic()
+        used = write_rows(model, rows, method)
+        written[model.__table__.name] = {
+            'rows': len(rows),
+            'method': used,
+            'seconds': round(time.monotonic() - started, 4)
+        }
+    return written
@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from apscheduler.events import EVENT_JOB_MISSED
+from utils.instrumentation import COLLECTION_SKIPPED, COLLECTION_LATE, COLLECTION_INTERVAL
+
+JOB_ID = 'metrics_collection'
+
+
+class CollectionScheduler:
+    """Runs the metrics collection as a self-rescheduling, non-overlapping job
+
+    Each cycle schedules the next one when it finishes. The interval starts
+    at base_interval and grows with the measured cycle duration, so large
+    clusters are collected less often instead of piling up runs. A random
+    jitter spreads the load when several instances start together. A cycle
+    that is triggered while another one is still running, or whose job
+    returns False because it did not collect, is counted as skipped and
+    leaves the cycle stats alone. One that starts well after its planned
+    time is counted as late.
+    """
+
+    def __init__(self, base_interval=30, max_interval=300, jitter=0.1, headroom=2.0, late_after=5):
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.headroom = headroom
+        self.late_after = late_after
+        self._job = None
+        self._scheduler = None
+        self._running = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._planned_at = None
+        self._avg_duration = None
+        self._stats = {
+            'cycles': 0,
+            'failed': 0,
+            'skipped': 0,
+            'late': 0,
+            'last_duration': None,
+            'last_lateness': None,
+            'interval': base_interval
+        }
+
+    def configure(self, base_interval=None, max_interval=None, jitter=None, headroom=None, late_after=None):
+        if base_interval is not None:
+            self.base_interval = base_interval
+        if max_interval is not None:
+            self.max_interval = max_interval
+        if jitter is not None:
+            self.jitter = jitter
+        if headroom is not None:
+            self.headroom = headroom
+        if late_after is not None:
+            self.late_after = late_after
+
+    def next_interval(self):
+        """Seconds until the next cycle, based on the average cycle duration"""
+        interval = self.base_interval
+        if self._avg_duration is not None:
+            interval = max(interval, self._avg_duration * self.headroom)
+        interval = min(interval, max(self.max_interval, self.base_interval))
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def set_job(self, job):
+        self._job = job
+
+    def start(self, scheduler, job, delay=0):
+        """Schedule job on an APScheduler scheduler, first run after delay seconds"""
+        self.set_job(job)
+        self._scheduler = scheduler
+        scheduler.add_listener(self._on_missed, EVENT_JOB_MISSED)
+        self._schedule(delay)
+
+    def _schedule(self, delay):
+        self._planned_at = time.time() + delay
+        self._scheduler.add_job(
+            func=self._run_scheduled,
+            trigger='date',
+            run_date=datetime.now() + timedelta(seconds=delay),
+            id=JOB_ID,
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=max(1, int(self.base_interval))
+        )
+
+    def _on_missed(self, event):
+        if event.job_id == JOB_ID:
+            with self._stats_lock:
+                self._stats['skipped'] += 1
+            COLLECTION_SKIPPED.inc()
+            print("[Scheduler] Metrics collection cycle missed its run time, skipping")
+            self._schedule(0)
+
+    def _run_scheduled(self):
+        planned_at = self._planned_at
+        try:
+            if planned_at is not None:
+                lateness = max(0.0, time.time() - planned_at)
+                with self._stats_lock:
+                    self._stats['last_lateness'] = round(lateness, 3)
+                    if lateness > self.late_after:
+                        self._stats['late'] += 1
+                        COLLECTION_LATE.inc()
+                        print(f"[Scheduler] Metrics collection cycle started {lateness:.1f}s late")
+            self.run_cycle()
+        finally:
+            interval = self.next_interval()
+            with self._stats_lock:
+                self._stats['interval'] = round(interval, 3)
+            COLLECTION_INTERVAL.set(round(interval, 3))
+            self._schedule(interval)
+
+    def run_cycle(self):
+        """Run one collection cycle now unless one is already running
+
+        Returns:
+            bool: False if the cycle was skipped, because one was already
+            running or the job did not collect
+        """
+        if not self._running.acquire(blocking=False):
+            with self._stats_lock:
+                self._stats['skipped'] += 1
+            COLLECTION_SKIPPED.inc()
+            print("[Scheduler] Metrics collection still running, skipping cycle")
+            return False
+
+        started = time.monotonic()
+        failed = False
+        collected = True
+        try:
+            # The job returns False when it did not collect, e.g. on a non-leader
+            collected = self._job() is not False
+        except Exception as e:
+            failed = True
+            print(f"[Scheduler] Error during metrics collection: {str(e)}")
+        finally:
+            duration = time.monotonic() - started
+            self._running.release()
+
+        if not collected:
+            with self._stats_lock:
+                self._stats['skipped'] += 1
+            COLLECTION_SKIPPED.inc()
+            return False
+
+        with self._stats_lock:
+            self._stats['cycles'] += 1
+            self._stats['failed'] += int(failed)
+            self._stats['last_duration'] = round(duration, 3)
+            # Exponentially weighted so a single slow cycle does not double the interval
+            self._avg_duration = duration if self._avg_duration is None else 0.7 * self._avg_duration + 0.3 * duration
+        return True
+
+    @property
+    def scheduled(self):
+        """Whether this process runs the scheduled collection"""
+        return self._scheduler is not None
+
+    @property
+    def running(self):
+        return self._running.locked()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats['running'] = self.running
+            stats['avg_duration'] = round(self._avg_duration, 3) if self._avg_duration is not None else None
+            stats['next_run'] = (datetime.utcfromtimestamp(self._planned_at).isoformat()
+                                 if self._planned_at else None)
+        return stats
+
+
+collection_scheduler = CollectionScheduler()
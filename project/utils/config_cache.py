@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Task types after which a guest's config can no longer be trusted
+CONFIG_CHANGING_TASKS = {
+    'qmigrate', 'vzmigrate',
+    'qmconfig', 'vzconfig',
+    'qmresize', 'resize', 'vzresize',
+    'qmmove', 'move_volume', 'vzmove', 'move_disk',
+    'qmrestore', 'vzrestore',
+    'qmclone', 'vzclone',
+    'qmdestroy', 'vzdestroy',
+}
+
+
+class LRUCache:
+    """Small thread-safe least-recently-used mapping"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class GuestConfigCache:
+    """Guest configs keyed by (node, vmid)
+
+    Entries are dropped when a migration or config-changing task is seen for
+    the guest, evicted least-recently-used, and refetched after max_age
+    seconds since config edits through the API do not always create a task.
+    The config digest tells whether a refetched config actually changed.
+    """
+
+    def __init__(self, max_entries=5000, max_age=600):
+        self.max_age = max_age
+        self._entries = LRUCache(max_entries)
+        self._last_task_time = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def configure(self, max_entries=None, max_age=None):
+        if max_entries is not None:
+            self._entries.max_entries = max_entries
+        if max_age is not None:
+            self.max_age = max_age
+
+    def get(self, node, vmid):
+        """Return the cached config for a guest, or None if missing or expired"""
+        entry = self._entries.get((node, int(vmid)))
+        if entry is None or time.time() - entry['fetched_at'] > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['config']
+
+    def put(self, node, vmid, config):
+        """Store a freshly fetched config
+
+        Returns:
+            bool: True if the config differs from the previously cached one
+        """
+        key = (node, int(vmid))
+        previous = self._entries.get(key)
+        changed = previous is None or previous['digest'] is None or previous['digest'] != config.get('digest')
+        if not changed:
+            # Keep the previous object so memoised values derived from it stay valid
+            config = previous['config']
+        self._entries.put(key, {
+            'config': config,
+            'digest': config.get('digest'),
+            'fetched_at': time.time()
+        })
+        return changed
+
+    def fetch(self, node, vmid, loader):
+        """Return the cached config, calling loader() to fetch it when needed"""
+        config = self.get(node, vmid)
+        if config is None:
+            config = loader()
+            self.put(node, vmid, config)
+            config = self._entries.get((node, int(vmid)))['config']
+        return config
+
+    async def fetch_async(self, node, vmid, loader):
+        """Like fetch, for a coroutine loader"""
+        config = self.get(node, vmid)
+        if config is None:
+            config = await loader()
+            self.put(node, vmid, config)
+            config = self._entries.get((node, int(vmid)))['config']
+        return config
+
+    def invalidate(self, vmid):
+        """Drop a guest's config on every node"""
+        vmid = int(vmid)
+        for key in self._entries.keys():
+            if key[1] == vmid:
+                self._entries.pop(key)
+                self.invalidations += 1
+
+    def invalidate_from_tasks(self, tasks):
+        """Drop configs of guests touched by tasks started since the last call
+
+        Args:
+            tasks: entries from /cluster/tasks
+        """
+        last_task_time = self._last_task_time
+        for task in tasks:
+            # Running tasks are picked up again once they have an end time
+            seen = max(task.get('starttime', 0), task.get('endtime', 0))
+            last_task_time = max(last_task_time, seen)
+            if seen < self._last_task_time:
+                continue
+            if task.get('type') in CONFIG_CHANGING_TASKS and str(task.get('id', '')).isdigit():
+                self.invalidate(task['id'])
+        self._last_task_time = last_task_time
+
+    def clear(self):
+        self._entries.clear()
+        self._last_task_time = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations
+        }
+
+
+guest_config_cache = GuestConfigCache()
@@ -0,0 +1,149 @@
+import json
+import threading
+from flask import current_app
+from sqlalchemy import func
+from models import ClusterMetrics, NodeUpdateStatus, LatestHostState, db
+from utils.latest_state import latest_guest_counts
+from utils.live_updates import dashboard_metrics
+from utils.metrics_collector import format_uptime
+from utils.snapshot import get_latest_snapshot
+
+
+def host_update_statuses():
+    """Update status of every host as shown on the dashboard, in one query"""
+    return {
+        status.node_name: {
+            'updates_available': status.updates_available,
+            'reboot_required': status.reboot_required,
+            'last_checked': status.last_checked
+        }
+        for status in NodeUpdateStatus.query.all()
+    }
+
+
+def _no_update_status():
+    return {'updates_available': 0, 'reboot_required': False, 'last_checked': None}
+
+
+def hosts_from_snapshot(snapshot):
+    """Per-host dashboard entries from the latest collection snapshot"""
+    update_statuses = host_update_statuses()
+    hosts_metrics = {}
+    for node in snapshot.collected_nodes():
+        hosts_metrics[node.name] = {
+            'ip_address': node.ip_address,
+            'cpu_usage': node.cpu * 100,
+            'cpu_cores': node.maxcpu,
+            'memory_usage': (node.mem / node.maxmem) * 100 if node.maxmem else 0,
+            'memory_total': node.maxmem,
+            'disk_usage': (node.disk / node.maxdisk) * 100 if node.maxdisk else 0,
+            'uptime': node.uptime,
+            'uptime_formatted': format_uptime(node.uptime),
+            'update_status': update_statuses.get(node.name, _no_update_status())
+        }
+    return hosts_metrics
+
+
+def guest_counts_from_snapshot(snapshot):
+    """(online, total) VM and container counts from the latest collection snapshot"""
+    vms = [guest for guest in snapshot.guests if guest.is_vm]
+    containers = [guest for guest in snapshot.guests if not guest.is_vm]
+    return (
+        (sum(1 for vm in vms if vm.status == 'running'), len(vms)),
+        (sum(1 for ct in containers if ct.status == 'running'), len(containers))
+    )
+
+
+def hosts_from_db():
+    """Per-host dashboard entries from the latest host state table"""
+    update_statuses = host_update_statuses()
+    hosts_metrics = {}
+    latest_hosts = LatestHostState.query.all()
+    for metric in latest_hosts:
+        hosts_metrics[metric.node_name] = {
+            'ip_address': metric.ip_address,
+            'cpu_usage': metric.cpu_usage,
+            'cpu_cores': metric.cpu_cores,
+            'memory_usage': metric.memory_usage,
+            'memory_total': metric.memory_total,
+            'disk_usage': metric.disk_usage,
+            'uptime': metric.uptime,
+            'uptime_formatted': metric.uptime_formatted,
+            'update_status': update_statuses.get(metric.node_name, _no_update_status())
+        }
+    return hosts_metrics
+
+
+def guest_counts_from_db():
+    """(online, total) VM and container counts from the latest guest state table"""
+    return latest_guest_counts()
+
+
+class DashboardSummaryCache:
+    """Dashboard summary computed once per collection cycle
+
+    The summary (metric cards and per-host entries) is keyed by the latest
+    ClusterMetrics id and the newest node update check, both read from the
+    database, so it changes when any process commits a cycle or an update
+    check finishes. Each process computes it once per key, serialised JSON
+    included, and every request and user is served from that object.
+
+    Hosts and guest counts come from the collection snapshot only when this
+    process collected the cycle the key refers to; a web app running next
+    to worker.py reads them from the latest state tables.
+    """
+
+    def __init__(self):
+        self._key = None
+        self._summary = None
+        self._body = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._key = None
+
+    @staticmethod
+    def _current_key():
+        cycle_id = db.session.query(func.max(ClusterMetrics.id)).scalar() or 0
+        last_checked, statuses = db.session.query(
+            func.max(NodeUpdateStatus.last_checked), func.count(NodeUpdateStatus.id)
+        ).one()
+        checked = last_checked.strftime('%Y%m%d%H%M%S%f') if last_checked else '0'
+        return f"summary-{cycle_id}-{checked}-{statuses}"
+
+    def _compute(self):
+        cluster_metrics = ClusterMetrics.query.order_by(ClusterMetrics.id.desc()).first()
+        snapshot = cluster_metrics and get_latest_snapshot(
+            max_age=current_app.config.get('SNAPSHOT_MAX_AGE', 120), cycle_id=cluster_metrics.id)
+        if snapshot:
+            hosts = hosts_from_snapshot(snapshot)
+            vm_counts, container_counts = guest_counts_from_snapshot(snapshot)
+        else:
+            hosts = hosts_from_db()
+            vm_counts, container_counts = guest_counts_from_db()
+        return {
+            'cycle_id': cluster_metrics.id if cluster_metrics else None,
+            'last_updated': cluster_metrics.timestamp if cluster_metrics else None,
+            'total_nodes': cluster_metrics.node_count if cluster_metrics else 0,
+            'metrics': dashboard_metrics(cluster_metrics, vm_counts, container_counts),
+            'hosts': dict(sorted(hosts.items()))
+        }
+
+    def get(self):
+        """(key, summary, json_body) for the current cycle; needs an app context
+
+        The summary is shared between requests and must not be modified.
+        """
+        key = self._current_key()
+        with self._lock:
+            if key != self._key:
+                summary = self._compute()
+                self._body = json.dumps(summary, default=lambda value: value.isoformat())
+                self._summary = summary
+                self._key = key
+                print(f"[Dashboard] Computed summary {key}")
+            return self._key, self._summary, self._body
+
+
+dashboard_summary = DashboardSummaryCache()
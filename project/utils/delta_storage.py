@@ -0,0 +1,231 @@
+import math
+import threading
+from datetime import timedelta
+from flask import current_app
+from sqlalchemy import select
+from models import VMMetrics, ContainerMetrics, ClusterMetrics, LatestGuestState, db
+from utils.latest_queries import latest_rows
+
+# Guest metrics tables that support change-only storage: model -> (entity id column name, latest state type)
+DELTA_MODELS = {
+    VMMetrics: ('vmid', 'qemu'),
+    ContainerMetrics: ('container_id', 'lxc'),
+}
+
+VALUE_FIELDS = ('cpu_usage', 'memory_usage', 'disk_usage')
+# Any change in these is always stored
+IDENTITY_FIELDS = ('node_name', 'name', 'status')
+
+# Guest rows stamped this close to a cycle's ClusterMetrics timestamp belong to that cycle
+CYCLE_TOLERANCE = timedelta(seconds=2)
+
+
+class DeltaFilter:
+    """Drops guest samples that did not change since the last stored one
+
+    A sample is stored when the guest is new to this process, its node,
+    name or status changed, any usage value moved more than `tolerance`
+    percentage points, or the last stored sample is `heartbeat` seconds old.
+    What was stored is only remembered once the cycle's transaction commits,
+    so a failed commit does not leave gaps.
+    """
+
+    def __init__(self, tolerance=1.0, heartbeat=600):
+        self.tolerance = tolerance
+        self.heartbeat = timedelta(seconds=heartbeat)
+        self._stored = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def configure(self, tolerance=None, heartbeat=None):
+        if tolerance is not None:
+            self.tolerance = tolerance
+        if heartbeat is not None:
+            self.heartbeat = timedelta(seconds=heartbeat)
+
+    def _changed(self, row, last):
+        if last is None or row['timestamp'] - last['timestamp'] >= self.heartbeat:
+            return True
+        if any(row[field] != last[field] for field in IDENTITY_FIELDS):
+            return True
+        for field in VALUE_FIELDS:
+            if (row[field] is None) != (last[field] is None):
+                return True
+            if row[field] is not None and abs(row[field] - last[field]) > self.tolerance:
+                return True
+        return False
+
+    def filter(self, model, rows):
+        """Rows of one guest metrics table that need to be stored this cycle"""
+        id_field = DELTA_MODELS[model][0]
+        kept = []
+        with self._lock:
+            for row in rows:
+                key = (model.__tablename__, row[id_field])
+                if self._changed(row, self._stored.get(key)):
+                    kept.append(row)
+                    self._pending[key] = row
+        return kept
+
+    def commit(self, now=None):
+        """Remember the rows passed by filter() since the last commit or rollback"""
+        with self._lock:
+            self._stored.update(self._pending)
+            self._pending.clear()
+            if now is not None:
+                # Forget guests that have not been stored for a while (deleted or on failed nodes)
+                expired = now - 2 * self.heartbeat
+                self._stored = {key: row for key, row in self._stored.items() if row['timestamp'] >= expired}
+
+    def rollback(self):
+        with self._lock:
+            self._pending.clear()
+
+    def clear(self):
+        with self._lock:
+            self._stored.clear()
+            self._pending.clear()
+
+
+delta_filter = DeltaFilter()
+
+
+def delta_enabled():
+    return current_app.config.get('METRICS_STORAGE_MODE', 'full') == 'delta'
+
+
+def fill_max_age():
+    """How long a stored guest sample stays valid when reading
+
+    Zero in full mode, where every cycle has its own row. In delta mode a
+    sample is carried until the next heartbeat is due, plus one slow cycle.
+    """
+    if not delta_enabled():
+        return timedelta(0)
+    return timedelta(seconds=current_app.config.get('METRICS_DELTA_HEARTBEAT', 600)
+                     + current_app.config.get('METRICS_MAX_INTERVAL', 300))
+
+
+def forward_fill(samples, timestamps, key, max_age, tolerance=CYCLE_TOLERANCE):
+    """Expand change-only samples onto collection cycle timestamps
+
+    Args:
+        samples: dicts with a 'timestamp', in ascending timestamp order
+        timestamps: ascending cycle timestamps to produce values for
+        key: function returning the entity a sample belongs to
+        max_age: timedelta a sample is carried forward for at most
+        tolerance: timedelta a sample may be stamped off its own cycle by,
+            capped at half the distance to the neighbouring cycles
+
+    Returns:
+        list: one dict per entity and cycle, in timestamp order, with the
+        cycle's timestamp and 'filled' set when the value was carried forward
+    """
+    filled = []
+    last = {}
+    index = 0
+    for position, timestamp in enumerate(timestamps):
+        earliest, latest = timestamp - tolerance, timestamp + tolerance
+        if position:
+            earliest = max(earliest, timestamp - (timestamp - timestamps[position - 1]) / 2)
+        if position + 1 < len(timestamps):
+            latest = min(latest, timestamp + (timestamps[position + 1] - timestamp) / 2)
+        own = set()
+        while index < len(samples) and samples[index]['timestamp'] <= latest:
+            sample = samples[index]
+            last[key(sample)] = sample
+            if sample['timestamp'] >= earliest:
+                own.add(key(sample))
+            index += 1
+        for entity, sample in last.items():
+            if entity in own:
+                filled.append(dict(sample, timestamp=timestamp, filled=False))
+            elif timestamp - sample['timestamp'] <= max_age:
+                filled.append(dict(sample, timestamp=timestamp, filled=True))
+    return filled
+
+
+def filled_guest_samples(model, start, end, ids=(), batch_rows=5000):
+    """Samples of a guest metrics table in [start, end) as if every cycle was stored
+
+    Cycles are read from ClusterMetrics a window at a time, sized so a
+    window yields about `batch_rows` rows, and the last stored sample of
+    each guest is carried from one window to the next, so memory use does
+    not grow with the length of the range.
+
+    Args:
+        ids: guest ids to limit the samples to
+
+    Yields:
+        list: forward_fill() rows of one window of cycles
+    """
+    id_field, guest_type = DELTA_MODELS[model]
+    table = model.__table__
+    id_column = table.c[id_field]
+    max_age = fill_max_age()
+    guests = len(ids) or LatestGuestState.query.filter_by(guest_type=guest_type).count()
+    window = max(1, batch_rows // max(guests, 1))
+    filters = [id_column.in_(ids)] if ids else []
+
+    # Rows are read up to CYCLE_TOLERANCE either side of the cycles they belong to
+    seed = latest_rows(model, (id_column,), since=start - max_age, before=start - CYCLE_TOLERANCE, filters=filters)
+    carried = {row[id_field]: dict(row) for row in db.session.execute(seed).mappings()}
+    after = None
+    while True:
+        # One cycle more than the window, to know where the window's rows end
+        cycles = db.session.query(ClusterMetrics.timestamp).distinct().filter(
+            ClusterMetrics.timestamp > after if after else ClusterMetrics.timestamp >= start,
+            ClusterMetrics.timestamp < end
+        ).order_by(ClusterMetrics.timestamp).limit(window + 1)
+        cycles = [timestamp for (timestamp,) in cycles]
+        if not cycles:
+            return
+        until = cycles[-1] + CYCLE_TOLERANCE
+        if len(cycles) > window:
+            following = cycles.pop()
+            until = min(until, cycles[-1] + (following - cycles[-1]) / 2)
+        stored = select(table).where(
+            *filters,
+            table.c.timestamp > rows_until if after else table.c.timestamp >= start - CYCLE_TOLERANCE,
+            table.c.timestamp <= until
+        ).order_by(table.c.timestamp, table.c.id)
+        samples = sorted(carried.values(), key=lambda sample: sample['timestamp'])
+        samples += [dict(row) for row in db.session.execute(stored).mappings()]
+        yield forward_fill(samples, cycles, lambda sample: sample[id_field], max_age)
+
+        expired = cycles[-1] - max_age
+        carried = {sample[id_field]: sample for sample in samples if max_age and sample['timestamp'] >= expired}
+        after, rows_until = cycles[-1], until
+
+
+def recent_guest_samples(model, limit=100):
+    """Latest samples of a guest metrics table, newest first, as if every cycle was stored
+
+    Reads the last cycles from ClusterMetrics (written every cycle), the
+    guest rows stored during them and, in delta mode, each guest's last
+    row from before the window to fill from.
+    """
+    id_field, guest_type = DELTA_MODELS[model]
+    table = model.__table__
+    guests = LatestGuestState.query.filter_by(guest_type=guest_type).count()
+    cycles = [timestamp for (timestamp,) in db.session.query(ClusterMetrics.timestamp)
+              .order_by(ClusterMetrics.timestamp.desc())
+              .limit(math.ceil(limit / max(guests, 1)) + 1)]
+    if not cycles:
+        return []
+    cycles.reverse()
+    max_age = fill_max_age()
+
+    # Rows stamped slightly off their cycle still count for it
+    window = select(table).where(table.c.timestamp >= cycles[0] - CYCLE_TOLERANCE,
+                                 table.c.timestamp <= cycles[-1] + CYCLE_TOLERANCE)
+    samples = [dict(row) for row in db.session.execute(window.order_by(table.c.timestamp)).mappings()]
+    if max_age:
+        seed = latest_rows(model, (table.c[id_field],), since=cycles[0] - max_age,
+                           before=cycles[0] - CYCLE_TOLERANCE)
+        seed = sorted((dict(row) for row in db.session.execute(seed).mappings()), key=lambda row: row['timestamp'])
+        samples = seed + samples
+
+    rows = forward_fill(samples, cycles, lambda sample: sample[id_field], max_age)
+    rows.sort(key=lambda row: row['timestamp'], reverse=True)
+    return rows[:limit]
@@ -0,0 +1,113 @@
+import csv
+import io
+import json
+import time
+import zlib
+from datetime import datetime
+from sqlalchemy import select
+from models import ClusterMetrics, MetricsRollup, db
+from utils.rollups import RAW_SOURCES, TIERS
+from utils.delta_storage import DELTA_MODELS, delta_enabled, filled_guest_samples
+
+# Response content type per export format
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Rows fetched per round trip from the server-side cursor, and written per chunk
+EXPORT_BATCH = 5000
+
+
+def export_query(entity, start, end, ids=(), node=None, tier='raw'):
+    """Rows of one metrics table in [start, end), oldest first
+
+    Args:
+        entity: 'host', 'vm', 'container' or, for raw samples only, 'cluster'
+        start, end: naive UTC datetimes
+        ids: node names or guest ids to limit the export to
+        node: only rows recorded on this node
+        tier: 'raw' for the stored samples (only the changed ones for
+            guests in delta storage mode, see export_batches()) or a rollup
+            tier from TIERS
+    """
+    if tier == 'raw':
+        table = ClusterMetrics.__table__ if entity == 'cluster' else RAW_SOURCES[entity][0].__table__
+        id_column = None if entity == 'cluster' else table.c[RAW_SOURCES[entity][1].key]
+        time_column = table.c.timestamp
+        query = select(table)
+    elif tier in TIERS:
+        table = MetricsRollup.__table__
+        id_column = table.c.entity_id
+        time_column = table.c.bucket_start
+        query = select(table).where(table.c.tier == tier, table.c.entity_type == entity)
+        ids = [str(entity_id) for entity_id in ids]
+    else:
+        raise ValueError(f"Unknown tier: {tier}")
+
+    if ids and id_column is not None:
+        query = query.where(id_column.in_(ids))
+    if node and 'node_name' in table.c:
+        query = query.where(table.c.node_name == node)
+    return query.where(time_column >= start, time_column < end).order_by(time_column, table.c.id)
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_batches(entity, start, end, ids=(), node=None, tier='raw'):
+    """Column names and batches of rows to export, see export_query() for the arguments
+
+    Raw VM and container samples in delta storage mode are forward filled
+    onto every collection cycle, as if every cycle had been stored; a
+    'filled' column tells carried values from stored ones.
+    """
+    if tier == 'raw' and entity in RAW_SOURCES and RAW_SOURCES[entity][0] in DELTA_MODELS and delta_enabled():
+        model = RAW_SOURCES[entity][0]
+        columns = list(model.__table__.c.keys()) + ['filled']
+        # The node filter goes on the filled rows, so a guest that migrated carries its new node
+        batches = ([tuple(row[column] for column in columns) for row in batch if not node or row['node_name'] == node]
+                   for batch in filled_guest_samples(model, start, end, ids, EXPORT_BATCH))
+        return columns, batches
+    result = db.session.execute(export_query(entity, start, end, ids, node, tier)
+                                .execution_options(yield_per=EXPORT_BATCH))
+    return list(result.keys()), result.partitions()
+
+
+def export_rows(columns, batches, fmt='ndjson'):
+    """Stream batches of rows as NDJSON or CSV text chunks
+
+    Rows come from export_batches(), through a server-side cursor
+    EXPORT_BATCH at a time, and each batch is written out before the next
+    one is fetched, so memory use does not grow with the size of the export.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    started = time.monotonic()
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if fmt == 'csv':
+        writer.writerow(columns)
+
+    exported = 0
+    for batch in batches:
+        if fmt == 'csv':
+            writer.writerows([_value(value) for value in row] for row in batch)
+        else:
+            out.writelines(json.dumps(dict(zip(columns, map(_value, row)))) + '\n' for row in batch)
+        exported += len(batch)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    # Header of an empty CSV export
+    if out.tell():
+        yield out.getvalue()
+    print(f"[Export] Streamed {exported} rows as {fmt} in {time.monotonic() - started:.1f}s")
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a stream of text chunks on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
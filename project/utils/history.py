@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select
+from models import ClusterMetrics, MetricsRollup, RollupWatermark, db
+from utils.rollups import TIERS, RAW_SOURCES, retention_days
+from utils.delta_storage import DELTA_MODELS, fill_max_age, forward_fill
+from utils.metrics_buffer import metrics_buffer
+
+METRICS = ('cpu', 'memory', 'disk')
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+
+# The finest source is used as long as it has at most this many samples per
+# requested point, so LTTB has some detail to choose from but never scans more
+OVERSAMPLE = 4
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def lttb(points, threshold):
+    """Downsample (x, y) points with Largest-Triangle-Three-Buckets
+
+    Keeps the first and last point and, from each of threshold - 2 equal
+    buckets in between, the point forming the largest triangle with the
+    point kept before it and the average of the next bucket. Peaks and dips
+    survive, unlike with plain averaging or picking every n-th point.
+
+    Args:
+        points: (x, y) pairs sorted by x
+        threshold: number of points to return, at least 3
+
+    Returns:
+        list: at most `threshold` of the input points, in order
+    """
+    if threshold < 3:
+        raise ValueError(f"LTTB needs a threshold of at least 3, got {threshold}")
+    count = len(points)
+    if count <= threshold:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (count - 2) / (threshold - 2)
+    kept = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket, the third corner of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, count)
+        next_points = points[next_start:next_end]
+        avg_x = sum(x for x, _ in next_points) / len(next_points)
+        avg_y = sum(y for _, y in next_points) / len(next_points)
+
+        kept_x, kept_y = points[kept]
+        best_area = -1
+        for j in range(int(i * every) + 1, next_start):
+            x, y = points[j]
+            area = abs((kept_x - avg_x) * (y - kept_y) - (kept_x - x) * (avg_y - kept_y))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        kept = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def choose_source(start, end, points, now=None):
+    """Finest source ('raw' or a rollup tier) that still covers start and fits the point budget"""
+    now = now or datetime.utcnow()
+    retention = retention_days()
+    span = (end - start).total_seconds()
+    sources = [('raw', current_app.config.get('METRICS_INTERVAL', 30))]
+    sources += [(tier, spec['seconds']) for tier, spec in TIERS.items()]
+
+    retained = [(source, seconds) for source, seconds in sources
+                if start >= now - timedelta(days=retention[source])]
+    for source, seconds in retained:
+        if span / seconds <= points * OVERSAMPLE:
+            return source
+    # Too long a range for every tier, or older than all of them: the coarsest tier it is
+    return retained[-1][0] if retained else list(TIERS)[-1]
+
+
+def _segments(source, start, end):
+    """Split [start, end) into (source, start, end) pieces
+
+    A rollup tier only reaches up to its watermark; the newer part of the
+    range is read from the next finer tiers and finally the raw table.
+    """
+    chain = ['raw'] + list(TIERS)
+    segments = []
+    for current in reversed(chain[:chain.index(source) + 1]):
+        if start >= end:
+            break
+        if current == 'raw':
+            until = end
+        else:
+            watermark = db.session.get(RollupWatermark, current)
+            until = min(end, watermark.processed_until) if watermark else start
+        if until > start:
+            segments.append((current, start, until))
+            start = until
+    return segments
+
+
+def _raw_samples(entity_type, entity_id, start, end):
+    # Recent cycles are held in memory by the collecting process, every cycle in full
+    if metrics_buffer.covers(start):
+        samples = metrics_buffer.series(entity_type, entity_id, start, end)
+        if samples is not None:
+            return samples
+
+    model, column = RAW_SOURCES[entity_type]
+    table = model.__table__
+    rows = select(table.c.timestamp, table.c.cpu_usage, table.c.memory_usage, table.c.disk_usage).where(
+        table.c[column.key] == entity_id
+    )
+    samples = [dict(row) for row in db.session.execute(
+        rows.where(table.c.timestamp >= start, table.c.timestamp < end).order_by(table.c.timestamp)
+    ).mappings()]
+
+    max_age = fill_max_age() if model in DELTA_MODELS else timedelta(0)
+    if not max_age:
+        return samples
+    # Change-only storage: carry each stored sample onto the cycles it stood for
+    seed = db.session.execute(
+        rows.where(table.c.timestamp >= start - max_age, table.c.timestamp < start)
+        .order_by(table.c.timestamp.desc()).limit(1)
+    ).mappings().first()
+    cycles = [timestamp for (timestamp,) in db.session.query(ClusterMetrics.timestamp)
+              .filter(ClusterMetrics.timestamp >= start, ClusterMetrics.timestamp < end)
+              .order_by(ClusterMetrics.timestamp)]
+    return forward_fill(([dict(seed)] if seed else []) + samples, cycles, lambda sample: entity_id, max_age)
+
+
+def _rollup_samples(tier, entity_type, entity_id, start, end):
+    rollups = db.session.query(
+        MetricsRollup.bucket_start, MetricsRollup.cpu_avg, MetricsRollup.memory_avg, MetricsRollup.disk_avg
+    ).filter(
+        MetricsRollup.tier == tier,
+        MetricsRollup.entity_type == entity_type,
+        MetricsRollup.entity_id == str(entity_id),
+        MetricsRollup.bucket_start >= start,
+        MetricsRollup.bucket_start < end
+    ).order_by(MetricsRollup.bucket_start)
+    return [dict(timestamp=bucket_start, cpu_usage=cpu, memory_usage=memory, disk_usage=disk)
+            for bucket_start, cpu, memory, disk in rollups]
+
+
+def history(entity_type, entity_id, start, end, points=DEFAULT_POINTS, metrics=METRICS):
+    """Usage history of one host, VM or container, reduced to at most `points` per metric
+
+    Args:
+        entity_type: 'host', 'vm' or 'container'
+        entity_id: node name, vmid or container id
+        start, end: naive UTC datetimes, end exclusive
+        points: points per metric, 3 to MAX_POINTS
+        metrics: any of METRICS
+
+    Returns:
+        dict: the source used and, per metric, [epoch milliseconds, percent] pairs.
+        Rollup buckets are plotted at their start with their average.
+    """
+    source = choose_source(start, end, points)
+    samples = []
+    for segment, segment_start, segment_end in _segments(source, start, end):
+        if segment == 'raw':
+            samples += _raw_samples(entity_type, entity_id, segment_start, segment_end)
+        else:
+            samples += _rollup_samples(segment, entity_type, entity_id, segment_start, segment_end)
+
+    series = {}
+    for metric in metrics:
+        field = f"{metric}_usage"
+        values = [((sample['timestamp'] - EPOCH).total_seconds(), sample[field])
+                  for sample in samples if sample[field] is not None]
+        series[metric] = [[round(x * 1000), y] for x, y in lttb(values, points)]
+    return {'source': source, 'samples': len(samples), 'series': series}
@@ -0,0 +1,44 @@
+import calendar
+from flask import request, make_response
+from sqlalchemy import func
+from models import ClusterMetrics, DashboardLog, db
+
+# Clients may keep responses but must revalidate them on every use
+CACHE_CONTROL = 'private, no-cache'
+
+
+def conditional(etag, build, last_modified=None):
+    """Answer 304 Not Modified if the client already has this version
+
+    Args:
+        etag: version token of the data, e.g. from metrics_version()
+        build: function returning the full response, only called when needed
+        last_modified: naive UTC datetime of the data, optional
+    """
+    if request.if_none_match:
+        # If-Modified-Since is ignored when If-None-Match is sent
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        fresh = bool(last_modified and request.if_modified_since
+                     and calendar.timegm(last_modified.utctimetuple())
+                     <= calendar.timegm(request.if_modified_since.utctimetuple()))
+
+    response = make_response('', 304) if fresh else make_response(build())
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def metrics_version():
+    """(etag, last_modified) of the metrics tables: the latest collection cycle"""
+    latest = db.session.query(ClusterMetrics.id, ClusterMetrics.timestamp).order_by(ClusterMetrics.id.desc()).first()
+    if latest is None:
+        return 'cycle-0', None
+    return f"cycle-{latest.id}", latest.timestamp
+
+
+def logs_version():
+    """ETag of the dashboard log: log entries are only ever added"""
+    return f"log-{db.session.query(func.max(DashboardLog.id)).scalar() or 0}"
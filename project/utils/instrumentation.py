@@ -0,0 +1,254 @@
+import bisect
+import hmac
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels))
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            state['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state['count'] if state else 0
+
+    def _render_value(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state['counts']):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, ('le', _format_value(float(bound))))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    """Process-local set of metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Collector
+COLLECTION_CYCLE_SECONDS = registry.histogram(
+    'pcm_collection_cycle_seconds', 'Duration of a metrics collection cycle')
+COLLECTION_CYCLES = registry.counter(
+    'pcm_collection_cycles_total', 'Metrics collection cycles by result', ('result',))
+COLLECTION_PHASE_SECONDS = registry.histogram(
+    'pcm_collection_phase_seconds', 'Time spent per collection phase (per node for node phases)', ('phase',))
+COLLECTION_NODE_FAILURES = registry.counter(
+    'pcm_collection_node_failures_total', 'Nodes that could not be collected', ('node',))
+COLLECTION_GUEST_FAILURES = registry.counter(
+    'pcm_collection_guest_failures_total', 'Guests that could not be collected', ('type',))
+ROWS_WRITTEN = registry.counter(
+    'pcm_rows_written_total', 'Metrics rows written per table', ('table',))
+ROWS_SUPPRESSED = registry.counter(
+    'pcm_rows_suppressed_total', 'Unchanged guest samples not stored in delta mode', ('table',))
+COLLECTION_SKIPPED = registry.counter(
+    'pcm_collection_skipped_total', 'Collection cycles skipped because one was still running, missed or not run on the leader')
+COLLECTION_LATE = registry.counter(
+    'pcm_collection_late_total', 'Collection cycles that started late')
+COLLECTION_INTERVAL = registry.gauge(
+    'pcm_collection_interval_seconds', 'Current adaptive collection interval')
+BUFFER_BYTES = registry.gauge(
+    'pcm_metrics_buffer_bytes', 'Memory held by the in-memory buffer of recent cycles')
+
+# Dashboard log
+LOG_ENTRIES = registry.counter(
+    'pcm_log_entries_total', 'Dashboard log entries written or dropped by the log sink', ('result',))
+
+# Proxmox API
+API_REQUESTS = registry.counter(
+    'pcm_proxmox_api_requests_total', 'Proxmox API requests by endpoint and status', ('endpoint', 'status'))
+API_REQUEST_SECONDS = registry.histogram(
+    'pcm_proxmox_api_request_seconds', 'Proxmox API request latency by endpoint', ('endpoint',))
+
+# Web app
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'pcm_http_request_seconds', 'Flask request latency by route', ('route', 'method', 'status'))
+
+_API_PATH = re.compile(r'.*?/api2/json/')
+
+
+def api_endpoint(path):
+    """Collapse node names and guest ids so endpoints group well, e.g. nodes/{node}/qemu/{vmid}/config"""
+    parts = _API_PATH.sub('', path.split('?', 1)[0]).strip('/').split('/')
+    for index in range(1, len(parts)):
+        if parts[index - 1] == 'nodes':
+            parts[index] = '{node}'
+        elif parts[index - 1] in ('qemu', 'lxc') and parts[index].isdigit():
+            parts[index] = '{vmid}'
+    return '/'.join(parts)
+
+
+def record_api_call(path, status, seconds):
+    endpoint = api_endpoint(path)
+    API_REQUESTS.inc(endpoint=endpoint, status=status)
+    API_REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+
+
+def requests_hook(response, *args, **kwargs):
+    """requests response hook recording Proxmox API calls"""
+    record_api_call(response.request.path_url, response.status_code, response.elapsed.total_seconds())
+
+
+def bearer_token_valid(header, token):
+    """Whether an Authorization header carries the bearer token"""
+    scheme, _, value = (header or '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(value.strip().encode(), token.encode())
+
+
+def start_metrics_server(port, host='0.0.0.0', token=None):
+    """Serve /metrics from a background thread, for processes without the web app
+
+    With a token, requests without 'Authorization: Bearer <token>' are refused.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            if token and not bearer_token_valid(self.headers.get('Authorization'), token):
+                self.send_error(401)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    print(f"[Metrics] Serving /metrics on port {port}")
+    return server
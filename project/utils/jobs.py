@@ -0,0 +1,104 @@
+from models import CollectionRequest, db
+from utils.collection_scheduler import collection_scheduler
+from utils.leader import leader_election
+from utils.metrics_collector import collect_metrics_job
+from utils.node_updater import check_all_nodes_updates, run_due_updates
+from utils.partitioning import ensure_partitions
+from utils.rollups import rollup_job, retention_job
+
+
+def _leader_job(app, name, func):
+    """Wrap a job so it runs in an app context, and only on the elected leader
+
+    The wrapped job returns False when it was skipped because this instance
+    is not the leader.
+    """
+    def run():
+        with app.app_context():
+            if not leader_election.is_leader():
+                return False
+            try:
+                func()
+            except Exception as e:
+                print(f"[Scheduler] Error during {name}: {str(e)}")
+                db.session.rollback()
+            return True
+    run.__name__ = f"run_{name.replace(' ', '_')}"
+    return run
+
+
+def _partition_maintenance(app):
+    def run():
+        if app.config['METRICS_PARTITIONING']:
+            ensure_partitions(app.config['METRICS_PARTITION_DAYS_AHEAD'])
+        retention_job()
+    return run
+
+
+def trigger_collection():
+    """Run a manual metrics collection cycle on the collector leader
+
+    A process that runs the scheduled jobs and is the leader collects right
+    away. Any other process, such as the web app with RUN_SCHEDULER=false,
+    records a CollectionRequest for the leader to pick up instead of
+    collecting next to it.
+
+    Returns:
+        str: 'collected', 'running' if a cycle is already running on this
+        process, or 'requested'
+    """
+    if collection_scheduler.scheduled and leader_election.is_leader():
+        return 'collected' if collection_scheduler.run_cycle() else 'running'
+    db.session.add(CollectionRequest())
+    db.session.commit()
+    return 'requested'
+
+
+def run_requested_collection():
+    """Leader job: run one collection cycle if other processes requested one"""
+    latest = db.session.query(db.func.max(CollectionRequest.id)).scalar()
+    # A running cycle may have started before the request, it is handled on a later poll
+    if latest is None or collection_scheduler.running:
+        return
+    CollectionRequest.query.filter(CollectionRequest.id <= latest).delete(synchronize_session=False)
+    db.session.commit()
+    print("[Scheduler] Running requested metrics collection...")
+    collection_scheduler.run_cycle()
+
+
+def start_jobs(app, scheduler):
+    """Register every scheduled job on an APScheduler scheduler and start it
+
+    Used by the web app when RUN_SCHEDULER is enabled and by worker.py.
+    Each job first checks leader_election, so running several schedulers
+    against one PostgreSQL database still collects metrics only once.
+    """
+    with app.app_context():
+        leader_election.init_engine(db.engine)
+
+    def collect():
+        print("[Scheduler] Running scheduled metrics collection...")
+        collect_metrics_job()
+        print("[Scheduler] Scheduled metrics collection completed")
+
+    # Metrics collection reschedules itself after every cycle so runs never overlap
+    collection_scheduler.start(scheduler, _leader_job(app, 'metrics collection', collect),
+                               delay=app.config['METRICS_INTERVAL'])
+    scheduler.add_job(func=_leader_job(app, 'requested collection', run_requested_collection),
+                      trigger="interval", seconds=app.config['COLLECT_REQUEST_POLL_INTERVAL'], max_instances=1)
+    scheduler.add_job(func=_leader_job(app, 'update check', check_all_nodes_updates),
+                      trigger="interval", hours=24)
+    scheduler.add_job(func=_leader_job(app, 'scheduled updates', run_due_updates),
+                      trigger="interval", seconds=app.config['UPDATE_POLL_INTERVAL'], max_instances=1)
+    scheduler.add_job(func=_leader_job(app, 'rollups', rollup_job),
+                      trigger="interval", seconds=app.config['METRICS_ROLLUP_INTERVAL'], max_instances=1)
+    scheduler.add_job(func=_leader_job(app, 'retention', _partition_maintenance(app)),
+                      trigger="interval", hours=1, max_instances=1)
+
+    # Run metrics collection immediately
+    print("[Scheduler] Running initial metrics collection...")
+    if collection_scheduler.run_cycle():
+        print("[Scheduler] Initial metrics collection completed")
+
+    print("[Scheduler] Starting background jobs")
+    scheduler.start()
@@ -0,0 +1,89 @@
+from sqlalchemy import and_, func, select
+from models import HostMetrics, VMMetrics, ContainerMetrics, db
+
+LATEST_METHODS = ('auto', 'distinct_on', 'row_number', 'max_join')
+
+
+def _auto_method(dialect):
+    if dialect.name == 'postgresql':
+        return 'distinct_on'
+    # SQLite answers max() per group straight from the (entity, timestamp) index,
+    # much faster than sorting every row for ROW_NUMBER()
+    if dialect.name == 'sqlite':
+        return 'max_join'
+    return 'row_number'
+
+
+def latest_rows(model, keys, since=None, before=None, filters=(), method='auto'):
+    """Select the newest row per entity from a metrics history table
+
+    The newest row is picked by timestamp, then id, so an entity with
+    several rows at the same timestamp still yields one row.
+
+    Args:
+        model: history model, e.g. HostMetrics
+        keys: columns identifying an entity, e.g. (VMMetrics.vmid,)
+        since: only consider rows at or after this time. Bounding the
+            search this way lets the (entity, timestamp) and timestamp
+            indexes skip most of the history.
+        before: only consider rows older than this time, to read the
+            state as it was at that point
+        filters: extra WHERE clauses, applied before picking the newest row
+        method: 'distinct_on' (PostgreSQL), 'row_number' (window function),
+            'max_join' (max(timestamp) per entity joined back, also works
+            without window functions) or 'auto' to pick for the current database
+
+    Returns:
+        Select: all columns of the model's table, one row per entity
+    """
+    if method not in LATEST_METHODS:
+        raise ValueError(f"Unknown latest row method: {method}")
+    if method == 'auto':
+        method = _auto_method(db.session.get_bind().dialect)
+
+    table = model.__table__
+    keys = [table.c[key.key] for key in keys]
+    conditions = list(filters)
+    if since is not None:
+        conditions.append(table.c.timestamp >= since)
+    if before is not None:
+        conditions.append(table.c.timestamp < before)
+
+    if method == 'distinct_on':
+        return (select(table).where(*conditions).distinct(*keys)
+                .order_by(*keys, table.c.timestamp.desc(), table.c.id.desc()))
+
+    if method == 'row_number':
+        rank = func.row_number().over(partition_by=keys, order_by=(table.c.timestamp.desc(), table.c.id.desc()))
+        ranked = select(table, rank.label('row_rank')).where(*conditions).subquery()
+        return select(*[ranked.c[column.name] for column in table.c]).where(ranked.c.row_rank == 1)
+
+    newest = select(*keys, func.max(table.c.timestamp).label('newest')).where(*conditions).group_by(*keys).subquery()
+    # Highest id among rows tied on the newest timestamp
+    picked = select(func.max(table.c.id)).join(newest, and_(
+        table.c.timestamp == newest.c.newest,
+        *[key == newest.c[key.name] for key in keys]
+    )).where(*conditions).group_by(*keys)
+    return select(table).where(table.c.id.in_(picked))
+
+
+def latest_objects(model, keys, **options):
+    """latest_rows() loaded as model instances"""
+    return db.session.scalars(select(model).from_statement(latest_rows(model, keys, **options))).all()
+
+
+def latest_hosts(**options):
+    """Newest HostMetrics row of every node"""
+    return latest_objects(HostMetrics, (HostMetrics.node_name,), **options)
+
+
+def latest_vms(node_name=None, **options):
+    """Newest VMMetrics row of every VM, optionally only VMs whose newest row is on node_name"""
+    vms = latest_objects(VMMetrics, (VMMetrics.vmid,), **options)
+    return [vm for vm in vms if node_name is None or vm.node_name == node_name]
+
+
+def latest_containers(node_name=None, **options):
+    """Newest ContainerMetrics row of every container, optionally only those on node_name"""
+    containers = latest_objects(ContainerMetrics, (ContainerMetrics.container_id,), **options)
+    return [ct for ct in containers if node_name is None or ct.node_name == node_name]
@@ -0,0 +1,106 @@
+from sqlalchemy.dialects import postgresql, sqlite
+from models import (
+    HostMetrics, VMMetrics, ContainerMetrics,
+    LatestHostState, LatestGuestState, db
+)
+
+_UPSERT_DIALECTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _upsert(model, rows):
+    """Insert rows, updating existing ones on primary key conflict"""
+    if not rows:
+        return
+    table = model.__table__
+    insert = _UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if insert is None:
+        for row in rows:
+            db.session.merge(model(**row))
+        db.session.flush()
+        return
+
+    statement = insert(table)
+    keys = [column.name for column in table.primary_key.columns]
+    statement = statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: statement.excluded[name] for name in rows[0] if name not in keys}
+    )
+    db.session.execute(statement, rows)
+
+
+def _guest_state_rows(rows, guest_type, id_key, cycle_id):
+    return [dict(
+        guest_type=guest_type,
+        vmid=row[id_key],
+        node_name=row['node_name'],
+        name=row['name'],
+        status=row['status'],
+        cpu_usage=row['cpu_usage'],
+        memory_usage=row['memory_usage'],
+        disk_usage=row['disk_usage'],
+        cycle_id=cycle_id,
+        timestamp=row['timestamp']
+    ) for row in rows]
+
+
+def update_latest_state(batches, snapshot, cycle_id, failed_vms=(), failed_containers=()):
+    """Upsert the current host and guest state from one collection cycle
+
+    Runs in the collector's transaction. Hosts no longer in the cluster are
+    removed, as are guests that a node collected this cycle no longer lists.
+    Rows for nodes that failed to collect, and for listed guests whose own
+    fetch failed, are kept as they were; their older cycle_id marks them stale.
+
+    Args:
+        batches: rows per metrics model as built by build_metric_rows
+        snapshot: the cycle's CollectionSnapshot
+        cycle_id: id of the cycle's ClusterMetrics row
+        failed_vms: vmids of listed VMs that could not be fetched
+        failed_containers: vmids of listed containers that could not be fetched
+    """
+    host_rows = [dict(row, cycle_id=cycle_id) for row in batches[HostMetrics]]
+    guest_rows = (_guest_state_rows(batches[VMMetrics], 'qemu', 'vmid', cycle_id)
+                  + _guest_state_rows(batches[ContainerMetrics], 'lxc', 'container_id', cycle_id))
+
+    _upsert(LatestHostState, host_rows)
+    _upsert(LatestGuestState, guest_rows)
+
+    LatestHostState.query.filter(
+        LatestHostState.node_name.notin_([node.name for node in snapshot.nodes])
+    ).delete(synchronize_session=False)
+
+    collected = [node.name for node in snapshot.collected_nodes()]
+    if not collected:
+        return
+    listed = {'qemu': set(failed_vms), 'lxc': set(failed_containers)}
+    for guest in snapshot.guests:
+        listed[guest.guest_type].add(guest.vmid)
+    for guest_type, vmids in listed.items():
+        LatestGuestState.query.filter(
+            LatestGuestState.node_name.in_(collected),
+            LatestGuestState.guest_type == guest_type,
+            LatestGuestState.vmid.notin_(vmids)
+        ).delete(synchronize_session=False)
+
+
+def latest_guest_counts():
+    """(online, total) VM and container counts in a single query"""
+    counts = {'qemu': (0, 0), 'lxc': (0, 0)}
+    rows = db.session.query(
+        LatestGuestState.guest_type,
+        db.func.sum(db.case((LatestGuestState.status == 'running', 1), else_=0)),
+        db.func.count()
+    ).group_by(LatestGuestState.guest_type).all()
+    for guest_type, running, total in rows:
+        counts[guest_type] = (int(running or 0), total)
+    return counts['qemu'], counts['lxc']
+
+
+def latest_node_guests(node_name, status='running'):
+    """vmids of VMs and containers on a node, from the latest state"""
+    rows = db.session.query(LatestGuestState.guest_type, LatestGuestState.vmid).filter(
+        LatestGuestState.node_name == node_name,
+        LatestGuestState.status == status
+    ).all()
+    return ([vmid for guest_type, vmid in rows if guest_type == 'qemu'],
+            [vmid for guest_type, vmid in rows if guest_type == 'lxc'])
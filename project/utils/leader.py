@@ -0,0 +1,83 @@
+import threading
+from sqlalchemy import text
+
+# Arbitrary application-wide key for pg_try_advisory_lock
+LEADER_LOCK_ID = 7310420125
+
+
+class LeaderElection:
+    """Elects one process to run the scheduled jobs across all replicas
+
+    On PostgreSQL the leader holds a session-level advisory lock on its own
+    connection, so leadership passes to another replica as soon as the
+    leader's connection goes away. Other databases cannot be shared between
+    hosts in this setup, so the only process is always the leader.
+    """
+
+    def __init__(self, lock_id=LEADER_LOCK_ID):
+        self.lock_id = lock_id
+        self._engine = None
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def init_engine(self, engine):
+        self._engine = engine
+
+    def _connection_alive(self):
+        try:
+            self._connection.execute(text("SELECT 1"))
+            self._connection.commit()
+            return True
+        except Exception:
+            return False
+
+    def _release_connection(self):
+        try:
+            self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+
+    def is_leader(self):
+        """Return True if this process holds (or has just acquired) leadership"""
+        if self._engine is None or self._engine.dialect.name != 'postgresql':
+            return True
+
+        with self._lock:
+            if self._connection is not None:
+                if self._connection_alive():
+                    return True
+                print("[Leader] Lost the leader connection, giving up leadership")
+                self._release_connection()
+
+            try:
+                connection = self._engine.connect()
+                acquired = connection.execute(
+                    text("SELECT pg_try_advisory_lock(:lock_id)"), {'lock_id': self.lock_id}
+                ).scalar()
+                connection.commit()
+            except Exception as e:
+                print(f"[Leader] Failed to take part in leader election: {str(e)}")
+                return False
+
+            if not acquired:
+                connection.close()
+                return False
+            self._connection = connection
+            print("[Leader] This process is now the scheduler leader")
+            return True
+
+    def resign(self):
+        """Release leadership, e.g. on shutdown"""
+        with self._lock:
+            if self._connection is None:
+                return
+            try:
+                self._connection.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {'lock_id': self.lock_id})
+                self._connection.commit()
+            except Exception:
+                pass
+            self._release_connection()
+
+
+leader_election = LeaderElection()
@@ -0,0 +1,249 @@
+import json
+import queue
+import threading
+import time
+from sqlalchemy import func
+from models import ClusterMetrics, DashboardLog, LatestHostState, LatestGuestState, db
+
+# Statuses included in the log stream, as returned by GET /api/logs
+LOG_STATUSES = ('info', 'warning')
+# New log entries sent per poll at most; the client can reload /api/logs for more
+MAX_LOGS_PER_POLL = 200
+
+
+def dashboard_metrics(cluster_metrics, vm_counts, container_counts):
+    """Metric cards shown on the dashboard
+
+    Args:
+        cluster_metrics: latest ClusterMetrics row or None
+        vm_counts: (running, total) VMs
+        container_counts: (running, total) containers
+    """
+    cpu_percent = (cluster_metrics.used_cpu / cluster_metrics.total_cpu) * 100 if cluster_metrics and cluster_metrics.total_cpu > 0 else 0
+    memory_percent = (cluster_metrics.used_memory / cluster_metrics.total_memory) * 100 if cluster_metrics and cluster_metrics.total_memory > 0 else 0
+    return {
+        'vms': {'current': vm_counts[0], 'total': vm_counts[1]},
+        'containers': {'current': container_counts[0], 'total': container_counts[1]},
+        'cpu': {
+            'usage': round(cpu_percent),
+            'cores': cluster_metrics.total_cpu if cluster_metrics else 0
+        },
+        'memory': {
+            'usage': round(memory_percent),
+            'used': f"{cluster_metrics.used_memory / (1024**3):.1f}GiB" if cluster_metrics else "0GiB",
+            'total': f"{cluster_metrics.total_memory / (1024**3):.1f}GiB" if cluster_metrics else "0GiB"
+        }
+    }
+
+
+def _host_state(host):
+    return {
+        'ip_address': host.ip_address,
+        'cpu_usage': round(host.cpu_usage or 0, 1),
+        'cpu_cores': host.cpu_cores,
+        'memory_usage': round(host.memory_usage or 0, 1),
+        'memory_total': host.memory_total,
+        'disk_usage': round(host.disk_usage or 0, 1),
+        'uptime_formatted': host.uptime_formatted
+    }
+
+
+def _guest_state(guest):
+    # Rounded so small fluctuations do not count as changes
+    return {
+        'node_name': guest.node_name,
+        'name': guest.name,
+        'status': guest.status,
+        'cpu_usage': round(guest.cpu_usage or 0, 1),
+        'memory_usage': round(guest.memory_usage or 0, 1),
+        'disk_usage': round(guest.disk_usage or 0, 1)
+    }
+
+
+def _diff(previous, current):
+    """(changed entries, removed keys) between two state dicts"""
+    changed = {key: value for key, value in current.items() if previous.get(key) != value}
+    removed = sorted(key for key in previous if key not in current)
+    return changed, removed
+
+
+def _event(name, data, event_id=None):
+    lines = [f"event: {name}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+class _Subscriber:
+    __slots__ = ('queue', 'dropped')
+
+    def __init__(self, size):
+        self.queue = queue.Queue(size)
+        self.dropped = False
+
+
+class LiveUpdates:
+    """Fans dashboard changes out to Server-Sent Events clients
+
+    One poller thread per web process checks the latest ClusterMetrics and
+    DashboardLog ids every poll_interval seconds while clients are
+    connected. After each collection cycle it computes a single delta of
+    the changed host and guest state and queues the same encoded message
+    to every client, so the work is per cycle rather than per viewer.
+    Clients that fall more than queue_size messages behind are dropped and
+    get the full state again when their EventSource reconnects.
+    """
+
+    def __init__(self, poll_interval=2, heartbeat=15, queue_size=32):
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._reset()
+
+    def configure(self, poll_interval=None, heartbeat=None, queue_size=None):
+        if poll_interval is not None:
+            self.poll_interval = poll_interval
+        if heartbeat is not None:
+            self.heartbeat = heartbeat
+        if queue_size is not None:
+            self.queue_size = queue_size
+
+    def _reset(self):
+        self._cycle_id = None
+        self._log_id = None
+        self._hosts = {}
+        self._guests = {}
+        self._state_message = None
+
+    def subscribe(self):
+        """Register a client; returns it with the full state message to send first"""
+        subscriber = _Subscriber(self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            state = self._state_message
+            self._wake.set()
+        return subscriber, state
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, message):
+        with self._lock:
+            for subscriber in list(self._subscribers):
+                try:
+                    subscriber.queue.put_nowait(message)
+                except queue.Full:
+                    subscriber.dropped = True
+                    self._subscribers.discard(subscriber)
+                    print("[Live] Dropped a client that fell behind")
+
+    def _state(self):
+        cluster_metrics = db.session.get(ClusterMetrics, self._cycle_id) if self._cycle_id else None
+        vms = [guest for key, guest in self._guests.items() if key.startswith('qemu/')]
+        containers = [guest for key, guest in self._guests.items() if key.startswith('lxc/')]
+        return dashboard_metrics(
+            cluster_metrics,
+            (sum(1 for vm in vms if vm['status'] == 'running'), len(vms)),
+            (sum(1 for ct in containers if ct['status'] == 'running'), len(containers))
+        )
+
+    def _poll_cycle(self, cycle_id):
+        hosts = {host.node_name: _host_state(host) for host in LatestHostState.query.all()}
+        guests = {f"{guest.guest_type}/{guest.vmid}": _guest_state(guest) for guest in LatestGuestState.query.all()}
+        changed_hosts, removed_hosts = _diff(self._hosts, hosts)
+        changed_guests, removed_guests = _diff(self._guests, guests)
+        first = self._state_message is None
+        self._cycle_id, self._hosts, self._guests = cycle_id, hosts, guests
+
+        summary = self._state()
+        state_message = _event('state', {
+            'cycle_id': cycle_id, 'summary': summary, 'hosts': hosts, 'guests': guests
+        }, cycle_id)
+        with self._lock:
+            self._state_message = state_message
+        if first:
+            self.publish(state_message)
+        else:
+            self.publish(_event('cycle', {
+                'cycle_id': cycle_id,
+                'summary': summary,
+                'hosts': changed_hosts,
+                'removed_hosts': removed_hosts,
+                'guests': changed_guests,
+                'removed_guests': removed_guests
+            }, cycle_id))
+            print(f"[Live] Cycle {cycle_id}: {len(changed_hosts)} hosts and {len(changed_guests)} guests changed")
+
+    def _poll_logs(self, log_id):
+        logs = DashboardLog.query.filter(
+            DashboardLog.id > self._log_id,
+            DashboardLog.status.in_(LOG_STATUSES)
+        ).order_by(DashboardLog.id).limit(MAX_LOGS_PER_POLL).all()
+        self._log_id = logs[-1].id if len(logs) == MAX_LOGS_PER_POLL else log_id
+        if logs:
+            self.publish(_event('logs', {'logs': [log.to_dict() for log in logs]}))
+
+    def poll(self):
+        """Check for a new cycle and new log entries; needs an app context"""
+        cycle_id = db.session.query(func.max(ClusterMetrics.id)).scalar()
+        log_id = db.session.query(func.max(DashboardLog.id)).scalar() or 0
+        if self._log_id is None:
+            # Clients load earlier entries from /api/logs
+            self._log_id = log_id
+        elif log_id > self._log_id:
+            self._poll_logs(log_id)
+        if self._state_message is None or cycle_id != self._cycle_id:
+            self._poll_cycle(cycle_id)
+
+    def _run(self, app):
+        while True:
+            with self._lock:
+                idle = not self._subscribers
+                if idle:
+                    # Nothing to send; start from a fresh state when a client connects
+                    self._wake.clear()
+                    self._reset()
+            if idle:
+                self._wake.wait()
+                continue
+            try:
+                with app.app_context():
+                    try:
+                        self.poll()
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"[Live] Failed to poll for updates: {str(e)}")
+            time.sleep(self.poll_interval)
+
+    def start(self, app):
+        """Start the poller thread once per process"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(app,), name='live-updates', daemon=True)
+                self._thread.start()
+
+    def stream(self):
+        """Generator of Server-Sent Events for one client"""
+        subscriber, state = self.subscribe()
+        try:
+            yield f"retry: {int(self.poll_interval * 1000)}\n\n".encode()
+            if state is not None:
+                yield state
+            while not subscriber.dropped:
+                try:
+                    yield subscriber.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # Comment line, keeps proxies from closing the connection and detects gone clients
+                    yield b": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+live_updates = LiveUpdates()
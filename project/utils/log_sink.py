@@ -0,0 +1,198 @@
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from flask import current_app
+from models import DashboardLog, db
+from utils.bulk_writer import write_rows
+from utils.instrumentation import LOG_ENTRIES
+
+LOG_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+# Attempts to write a batch before its entries are dropped
+WRITE_ATTEMPTS = 3
+
+# Length of DashboardLog.action; longer actions would fail the whole batch
+MAX_ACTION_LENGTH = 255
+
+
+class LogSink:
+    """Writes dashboard log entries in batches from a background thread
+
+    log() only queues the entry. A writer thread inserts the queue in one
+    batch once `batch_size` entries are waiting or `flush_interval` seconds
+    after the first one arrived. The queue holds at most `max_queue`
+    entries; when it is full the policy decides what happens:
+
+        drop_oldest: the oldest queued entry makes room (default)
+        drop_newest: the new entry is dropped
+        block: log() waits up to `block_timeout` seconds for room, then drops it
+
+    With LOG_SINK_ASYNC disabled entries are committed right away instead.
+    """
+
+    def __init__(self, flush_interval=0.5, batch_size=200, max_queue=10000, policy='drop_oldest', block_timeout=1.0):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._queue = deque()
+        self._in_flight = 0
+        self._flushing = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {'queued': 0, 'written': 0, 'dropped': 0, 'failed_batches': 0}
+
+    def configure(self, flush_interval=None, batch_size=None, max_queue=None, policy=None, block_timeout=None):
+        if policy is not None and policy not in LOG_POLICIES:
+            raise ValueError(f"Unknown log sink policy: {policy}")
+        with self._cond:
+            if flush_interval is not None:
+                self.flush_interval = flush_interval
+            if batch_size is not None:
+                self.batch_size = batch_size
+            if max_queue is not None:
+                self.max_queue = max_queue
+            if policy is not None:
+                self.policy = policy
+            if block_timeout is not None:
+                self.block_timeout = block_timeout
+
+    def log(self, node_name, action, status='info', details=None):
+        """Record a dashboard log entry
+
+        Args:
+            node_name: node the entry is about, or None
+            action: message shown in the dashboard log
+            status: 'info', 'warning', 'error' or 'critical'
+            details: text, or a dict or list stored as JSON
+
+        Returns:
+            bool: False if the entry was dropped because the queue was full
+        """
+        entry = dict(
+            node_name=node_name,
+            action=action[:MAX_ACTION_LENGTH],
+            status=status,
+            details=details if details is None or isinstance(details, str) else json.dumps(details),
+            created_at=datetime.utcnow()
+        )
+        if not current_app.config.get('LOG_SINK_ASYNC', True):
+            db.session.add(DashboardLog(**entry))
+            db.session.commit()
+            return True
+
+        self._start(current_app._get_current_object())
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                if self.policy == 'drop_oldest':
+                    self._queue.popleft()
+                    self._dropped(1)
+                elif self.policy == 'drop_newest' or not self._cond.wait_for(
+                        lambda: len(self._queue) < self.max_queue, self.block_timeout):
+                    self._dropped(1)
+                    return False
+            self._queue.append(entry)
+            self._stats['queued'] += 1
+            self._cond.notify_all()
+        return True
+
+    def _dropped(self, count):
+        self._stats['dropped'] += count
+        LOG_ENTRIES.inc(count, result='dropped')
+
+    def _start(self, app):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, args=(app,), name='log-sink', daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        """Wait for a full batch, the flush interval or a flush() and take up to batch_size entries"""
+        with self._cond:
+            while not self._queue and not self._stopping:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.batch_size and not (self._flushing or self._stopping):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._in_flight = len(batch)
+            # Room in the queue for producers blocked on it
+            self._cond.notify_all()
+            return batch
+
+    def _write(self, batch):
+        try:
+            write_rows(DashboardLog, batch)
+            db.session.commit()
+            return True
+        except Exception as e:
+            print(f"[LogSink] Failed to write {len(batch)} log entries: {str(e)}")
+            db.session.rollback()
+            return False
+
+    def _run(self, app):
+        with app.app_context():
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                failures = 0
+                while not self._write(batch):
+                    failures += 1
+                    if failures == WRITE_ATTEMPTS:
+                        break
+                    time.sleep(self.flush_interval * failures)
+                db.session.remove()
+                with self._cond:
+                    self._stats['failed_batches'] += failures
+                    if failures == WRITE_ATTEMPTS:
+                        self._dropped(len(batch))
+                    else:
+                        self._stats['written'] += len(batch)
+                        LOG_ENTRIES.inc(len(batch), result='written')
+                    self._in_flight = 0
+                    self._cond.notify_all()
+
+    def flush(self, timeout=5.0):
+        """Write everything queued so far
+
+        Returns:
+            bool: False if entries were still pending after `timeout` seconds
+        """
+        with self._cond:
+            if not self._queue and not self._in_flight:
+                return True
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(lambda: not self._queue and not self._in_flight, timeout)
+            finally:
+                self._flushing -= 1
+
+    def stop(self, timeout=5.0):
+        """Write what is queued and stop the writer thread"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._queue) + self._in_flight
+        return stats
+
+
+log_sink = LogSink()
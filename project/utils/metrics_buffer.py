@@ -0,0 +1,369 @@
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import func
+from models import (
+    HostMetrics, VMMetrics, ContainerMetrics, ClusterMetrics,
+    LatestHostState, LatestGuestState, db
+)
+from utils.rollups import RAW_SOURCES
+from utils.latest_queries import latest_objects
+from utils.instrumentation import BUFFER_BYTES
+
+METRICS = ('cpu', 'memory', 'disk')
+EPOCH = datetime(1970, 1, 1)
+
+# float32 per metric and cycle, plus bookkeeping per entity (dict entry, id, node name)
+VALUE_BYTES = np.dtype(np.float32).itemsize
+ENTITY_OVERHEAD = 200
+# Decimals returned; float32 holds about 7 significant digits
+PRECISION = 4
+
+
+def _epoch(timestamp):
+    return (timestamp - EPOCH).total_seconds()
+
+
+class _Table:
+    """Values of one entity type: a (ring position, slot) float32 array per metric, NaN where missing"""
+
+    def __init__(self, capacity):
+        self.width = 0
+        self.index = {}
+        self.ids = []
+        self.nodes = []
+        self.last_seen = np.empty(0, dtype=np.int64)
+        self.columns = {metric: np.empty((capacity, 0), dtype=np.float32) for metric in METRICS}
+        self.free = []
+
+    def nbytes(self, capacity, width=None):
+        width = self.width if width is None else width
+        return width * (capacity * len(METRICS) * VALUE_BYTES + ENTITY_OVERHEAD)
+
+    def resize(self, capacity, width):
+        """Widen every ring position to `width` slots, keeping the stored values"""
+        for metric, old in self.columns.items():
+            new = np.full((capacity, width), np.nan, dtype=np.float32)
+            new[:, :self.width] = old
+            self.columns[metric] = new
+        self.ids.extend([None] * (width - self.width))
+        self.nodes.extend([None] * (width - self.width))
+        self.last_seen = np.concatenate([self.last_seen, np.full(width - self.width, -1, dtype=np.int64)])
+        self.free.extend(range(width - 1, self.width - 1, -1))
+        self.width = width
+
+
+class MetricsBuffer:
+    """The last `cycles` collection cycles of host, VM and container usage, in memory
+
+    Filled by the collector after each committed cycle, so recent history,
+    top-N and averages are answered without a database round trip. Every
+    entity type keeps one float32 NumPy array per metric, a row per ring
+    position and a column per entity slot, so a cycle is stored with one
+    fancy-indexed assignment and averages and top-N are computed over
+    whole arrays. Slots of entities that have not been seen for a whole
+    ring are reused, and no more slots are added than fit in `max_bytes`.
+
+    A process that does not collect, like the web app next to worker.py,
+    follows the database instead: each new cycle is read from the latest
+    state tables (see sync()).
+    """
+
+    def __init__(self, cycles=120, max_bytes=64 * 1024 * 1024):
+        self.capacity = cycles
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._source = None
+        self._follower = None
+        self._reset()
+
+    def _reset(self):
+        self._timestamps = np.zeros(self.capacity, dtype=np.float64)
+        self._cycles = 0
+        self._cycle_id = None
+        self._tables = {entity_type: _Table(self.capacity) for entity_type in RAW_SOURCES}
+        self._stats = {'appends': 0, 'reads': 0, 'evicted': 0, 'rejected': 0, 'restarts': 0}
+
+    def configure(self, cycles=None, max_bytes=None):
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if cycles is not None and cycles != self.capacity:
+                self.capacity = cycles
+                self._reset()
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def nbytes(self):
+        return self._timestamps.nbytes + sum(table.nbytes(self.capacity) for table in self._tables.values())
+
+    def _slot(self, table, entity_id):
+        """Slot of an entity, allocating one if needed; None when over the memory budget"""
+        slot = table.index.get(entity_id)
+        if slot is not None:
+            return slot
+        if not table.free:
+            # Entities unseen for a whole ring no longer have any values stored
+            stale = np.flatnonzero((table.last_seen >= 0) & (table.last_seen < self._cycles - self.capacity))
+            for old in stale.tolist():
+                del table.index[table.ids[old]]
+                table.ids[old] = None
+                table.last_seen[old] = -1
+                table.free.append(old)
+            self._stats['evicted'] += len(stale)
+        if not table.free:
+            spare = self.max_bytes - self.nbytes()
+            per_slot = table.nbytes(self.capacity, 1)
+            grow = min(max(table.width, 16), spare // per_slot)
+            if grow <= 0:
+                self._stats['rejected'] += 1
+                return None
+            table.resize(self.capacity, table.width + grow)
+        slot = table.free.pop()
+        table.index[entity_id] = slot
+        table.ids[slot] = entity_id
+        return slot
+
+    def append(self, timestamp, batches, cycle_id=None):
+        """Store one collection cycle
+
+        Args:
+            timestamp: naive UTC datetime of the cycle
+            batches: metrics model -> column value dicts, as built by the collector
+            cycle_id: id of the cycle's ClusterMetrics row
+        """
+        with self._lock:
+            self._source = self._source or 'collector'
+            self._cycle_id = cycle_id
+            position = self._cycles % self.capacity
+            self._timestamps[position] = _epoch(timestamp)
+            for entity_type, (model, column) in RAW_SOURCES.items():
+                table = self._tables[entity_type]
+                slots, kept = [], []
+                for row in batches.get(model, []):
+                    slot = self._slot(table, row[column.key])
+                    if slot is None:
+                        continue
+                    table.nodes[slot] = row['node_name']
+                    slots.append(slot)
+                    kept.append(row)
+                # Slots may have been added above, so the ring position is cleared afterwards
+                slots = np.array(slots, dtype=np.intp)
+                table.last_seen[slots] = self._cycles
+                for metric, values in table.columns.items():
+                    field = f"{metric}_usage"
+                    values[position] = np.nan
+                    # None becomes NaN
+                    values[position, slots] = np.array([row[field] for row in kept], dtype=np.float32)
+            self._cycles += 1
+            self._stats['appends'] += 1
+            BUFFER_BYTES.set(self.nbytes())
+
+    def _positions(self, since=None, until=None):
+        """Ring positions of stored cycles in [since, until), oldest first"""
+        count = min(self._cycles, self.capacity)
+        positions = (np.arange(self._cycles - count, self._cycles)) % self.capacity
+        timestamps = self._timestamps[positions]
+        keep = np.ones(count, dtype=bool)
+        if since:
+            keep &= timestamps >= _epoch(since)
+        if until:
+            keep &= timestamps < _epoch(until)
+        return positions[keep]
+
+    def oldest(self):
+        """Timestamp of the oldest cycle held, None when empty"""
+        with self._lock:
+            if not self._cycles:
+                return None
+            position = self._cycles % self.capacity if self._cycles >= self.capacity else 0
+            return EPOCH + timedelta(seconds=float(self._timestamps[position]))
+
+    def covers(self, since):
+        """Whether every cycle from `since` onwards is held"""
+        oldest = self.oldest()
+        return oldest is not None and oldest <= since
+
+    def series(self, entity_type, entity_id, since=None, until=None):
+        """Samples of one entity in [since, until), oldest first, in the shape of raw history rows
+
+        Returns None for entities the buffer does not hold.
+        """
+        with self._lock:
+            self._stats['reads'] += 1
+            table = self._tables[entity_type]
+            slot = table.index.get(entity_id)
+            if slot is None:
+                return None
+            positions = self._positions(since, until)
+            # (cycle, metric) values of the entity, without the cycles it was missing from
+            values = np.stack([table.columns[metric][positions, slot] for metric in METRICS], axis=1)
+            present = ~np.isnan(values).all(axis=1)
+            values = np.round(values[present].astype(np.float64), PRECISION)
+            timestamps = self._timestamps[positions[present]]
+        return [
+            dict({f"{metric}_usage": None if value != value else value
+                  for metric, value in zip(METRICS, row)},
+                 timestamp=EPOCH + timedelta(seconds=timestamp))
+            for row, timestamp in zip(values.tolist(), timestamps.tolist())
+        ]
+
+    def _values(self, table, metric, since):
+        """(slots, values) of a metric: newest cycle, or the mean since `since`, for entities that have one"""
+        values = table.columns[metric]
+        if since:
+            block = values[self._positions(since)]
+            slots = np.flatnonzero((~np.isnan(block)).any(axis=0))
+            values = np.nanmean(block[:, slots], axis=0, dtype=np.float64)
+        else:
+            if not self._cycles:
+                return np.empty(0, dtype=np.intp), np.empty(0)
+            newest = values[(self._cycles - 1) % self.capacity]
+            slots = np.flatnonzero(~np.isnan(newest))
+            values = newest[slots].astype(np.float64)
+        return slots, np.round(values, PRECISION)
+
+    def averages(self, entity_type, metric='cpu', since=None):
+        """Mean of a metric per entity over the cycles since `since` (all held cycles by default)"""
+        with self._lock:
+            self._stats['reads'] += 1
+            table = self._tables[entity_type]
+            slots, values = self._values(table, metric, since or EPOCH)
+            return {table.ids[slot]: value for slot, value in zip(slots.tolist(), values.tolist())}
+
+    def latest(self, entity_type, metric='cpu'):
+        """Value of a metric per entity in the newest cycle"""
+        with self._lock:
+            self._stats['reads'] += 1
+            table = self._tables[entity_type]
+            slots, values = self._values(table, metric, None)
+            return {table.ids[slot]: value for slot, value in zip(slots.tolist(), values.tolist())}
+
+    def top(self, entity_type, metric='cpu', n=10, since=None):
+        """The n entities with the highest metric: newest value, or the average since `since`
+
+        Returns:
+            list: (entity id, node name, value) tuples, highest first
+        """
+        with self._lock:
+            self._stats['reads'] += 1
+            table = self._tables[entity_type]
+            slots, values = self._values(table, metric, since)
+            if len(values) > n:
+                best = np.argpartition(-values, n - 1)[:n] if n > 0 else np.empty(0, dtype=np.intp)
+                slots, values = slots[best], values[best]
+            order = np.argsort(-values, kind='stable')
+            return [(table.ids[slot], table.nodes[slot], value)
+                    for slot, value in zip(slots[order].tolist(), values[order].tolist())]
+
+    def sync(self):
+        """Append the newest cycle committed by another process; needs an app context
+
+        The latest state tables only hold the newest cycle, so when more than
+        one cycle was committed since the last sync the buffer starts over
+        from the newest one rather than hold a gap.
+
+        Returns:
+            bool: whether a cycle was appended
+        """
+        cycle = ClusterMetrics.query.order_by(ClusterMetrics.id.desc()).first()
+        with self._lock:
+            last = self._cycle_id
+        if cycle is None or cycle.id == last:
+            return False
+        hosts = LatestHostState.query.filter(LatestHostState.cycle_id >= cycle.id).all()
+        guests = LatestGuestState.query.filter(LatestGuestState.cycle_id >= cycle.id).all()
+        if any(row.cycle_id != cycle.id for row in hosts + guests):
+            # A newer cycle was committed meanwhile, the next sync picks it up
+            return False
+        missed = last is not None and ClusterMetrics.query.filter(ClusterMetrics.id > last).count() > 1
+
+        def usage(row, **entity):
+            return dict(entity, node_name=row.node_name, cpu_usage=row.cpu_usage,
+                        memory_usage=row.memory_usage, disk_usage=row.disk_usage)
+        batches = {
+            HostMetrics: [usage(host) for host in hosts],
+            VMMetrics: [usage(guest, vmid=guest.vmid) for guest in guests if guest.guest_type == 'qemu'],
+            ContainerMetrics: [usage(guest, container_id=guest.vmid) for guest in guests if guest.guest_type == 'lxc'],
+        }
+        with self._lock:
+            if missed:
+                print(f"[Buffer] Missed cycles before {cycle.id}, starting over")
+                stats = self._stats
+                self._reset()
+                self._stats = dict(stats, restarts=stats['restarts'] + 1)
+            self._source = 'database'
+            self.append(cycle.timestamp, batches, cycle.id)
+        return True
+
+    def _follow(self, app, interval):
+        while True:
+            try:
+                with app.app_context():
+                    try:
+                        self.sync()
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"[Buffer] Failed to read the latest cycle: {str(e)}")
+            time.sleep(interval)
+
+    def follow(self, app, interval=5):
+        """Keep the buffer filled from the database every `interval` seconds, once per process"""
+        with self._lock:
+            self._source = 'database'
+            if self._follower is None:
+                self._follower = threading.Thread(target=self._follow, args=(app, interval),
+                                                  name='metrics-buffer', daemon=True)
+                self._follower.start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(
+                source=self._source,
+                cycle_id=self._cycle_id,
+                cycles=min(self._cycles, self.capacity),
+                capacity=self.capacity,
+                entities={entity_type: len(table.index) for entity_type, table in self._tables.items()},
+                bytes=self.nbytes(),
+                max_bytes=self.max_bytes
+            )
+        oldest = self.oldest()
+        stats['oldest'] = oldest.isoformat() if oldest else None
+        return stats
+
+
+metrics_buffer = MetricsBuffer()
+
+
+def top_entities(entity_type, metric='cpu', n=10, window=None):
+    """Top-N entities by a metric, from the buffer when it holds the window, else the database
+
+    Args:
+        window: timedelta to average over, None for the newest sample
+
+    Returns:
+        list: (entity id, node name, value) tuples, highest first
+    """
+    now = datetime.utcnow()
+    since = now - window if window else None
+    if metrics_buffer.covers(since or now):
+        return metrics_buffer.top(entity_type, metric, n, since)
+
+    model, column = RAW_SOURCES[entity_type]
+    value = getattr(model, f"{metric}_usage")
+    if since is None:
+        rows = latest_objects(model, (column,), since=now - timedelta(hours=1))
+        rows = [(getattr(row, column.key), row.node_name, getattr(row, f"{metric}_usage"))
+                for row in rows if getattr(row, f"{metric}_usage") is not None]
+        return heapq.nlargest(n, rows, key=lambda row: row[2])
+    average = func.avg(value)
+    rows = db.session.query(column, func.max(model.node_name), average).filter(
+        model.timestamp >= since, value.isnot(None)
+    ).group_by(column).order_by(average.desc()).limit(n)
+    return [tuple(row) for row in rows]
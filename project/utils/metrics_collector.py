@@ -1,14 +1,76 @@
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
 from models import (
     ProxmoxCredentials, HostMetrics, VMMetrics, 
-    ContainerMetrics, ClusterMetrics, DashboardLog, db
+    ContainerMetrics, ClusterMetrics, db
 )
 from datetime import datetime
+from utils.snapshot import CollectionSnapshot, NodeState, GuestState, publish_snapshot
+from utils.config_cache import LRUCache, guest_config_cache
+from utils.proxmox_connection import connection_manager
+from utils.bulk_writer import write_metrics
+from utils.latest_state import update_latest_state
+from utils.delta_storage import DELTA_MODELS, delta_filter, delta_enabled
+from utils.metrics_buffer import metrics_buffer
+from utils.log_sink import log_sink
+from utils.instrumentation import (
+    COLLECTION_CYCLE_SECONDS, COLLECTION_CYCLES, COLLECTION_PHASE_SECONDS,
+    COLLECTION_NODE_FAILURES, COLLECTION_GUEST_FAILURES, ROWS_WRITTEN, ROWS_SUPPRESSED
+)
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+SIZE_UNITS = {
+    'K': 1024,
+    'M': 1024 ** 2,
+    'G': 1024 ** 3,
+    'T': 1024 ** 4,
+}
+
+# Parsed disk totals memoised by config digest
+_disk_totals = LRUCache(max_entries=10000)
+
+def parse_disk_size(value):
+    """Return the size in bytes of a disk definition such as 'local-lvm:vm-100-disk-0,size=32G'"""
+    for option in value.split(','):
+        if option.startswith('size='):
+            size_str = option[len('size='):]
+            unit = size_str[-1:].upper()
+            if unit in SIZE_UNITS:
+                return float(size_str[:-1]) * SIZE_UNITS[unit]
+            return float(size_str)
+    return 0
+
+def calculate_disk_total(config, is_vm=True):
+    """Total configured disk size of a VM or container in bytes
+
+    Results are memoised by config digest, so size strings are only parsed
+    again when the config actually changes.
+    """
+    digest = config.get('digest')
+    if digest:
+        cached = _disk_totals.get((digest, is_vm))
+        if cached is not None:
+            return cached
+
+    if is_vm:
+        disk_prefixes = ('scsi', 'virtio', 'ide', 'sata')
+    else:
+        disk_prefixes = ('mp', 'rootfs')
+
+    disk_total = 0
+    for key, value in config.items():
+        if any(key.startswith(prefix) for prefix in disk_prefixes):
+            if isinstance(value, str) and 'size=' in value:
+                disk_total += parse_disk_size(value)
+
+    if digest:
+        _disk_totals.put((digest, is_vm), disk_total)
+    return disk_total
+
 def calculate_disk_usage(config, disk_info, is_vm=True):
     """Calculate disk usage for a VM or container
     
@@ -26,19 +88,7 @@ def calculate_disk_usage(config, disk_info, is_vm=True):
     
     try:
         # Calculate total disk space
-        if is_vm:
-            disk_prefixes = ('scsi', 'virtio', 'ide', 'sata')
-        else:
-            disk_prefixes = ('mp', 'rootfs')
-            
-        for key, value in config.items():
-            if any(key.startswith(prefix) for prefix in disk_prefixes):
-                if 'size' in value:
-                    size_str = value.split(',')[0].replace('size=', '')
-                    if size_str.endswith('G'):
-                        disk_total += float(size_str[:-1]) * 1024 * 1024 * 1024
-                    elif size_str.endswith('M'):
-                        disk_total += float(size_str[:-1]) * 1024 * 1024
+        disk_total = calculate_disk_total(config, is_vm)
         
         # Calculate used disk space
         if is_vm:
@@ -68,9 +118,342 @@ def format_uptime(seconds):
     
     return " ".join(parts)
 
+def _ip_from_network(interfaces):
+    """Find the primary IP address of a node (usually from vmbr0) in its network config"""
+    for iface in interfaces:
+        if iface.get('iface') == 'vmbr0' and 'address' in iface:
+            return iface['address'].split('/')[0]
+    return None
+
+def _host_ip_address(proxmox, node_name):
+    """Find the primary IP address of a node"""
+    return _ip_from_network(proxmox.nodes(node_name).network.get())
+
+def _node_from_status(node_name, status):
+    """Normalise a nodes/{node}/status response"""
+    return {
+        'node': node_name,
+        'status': 'online',
+        'cpu': status['cpu'],
+        'maxcpu': status['cpuinfo']['cpus'],
+        'mem': status['memory']['used'],
+        'maxmem': status['memory']['total'],
+        'disk': status['rootfs']['used'],
+        'maxdisk': status['rootfs']['total'],
+        'uptime': status['uptime'],
+        'ip_address': None
+    }
+
+def _fetch_cluster_resources(proxmox):
+    """Fetch node and guest state from /cluster/resources in a single request
+
+    Only the fields /cluster/resources does not carry (host IP addresses and
+    guest disk sizes from the config) are left for the per-node workers.
+
+    Returns:
+        tuple: (nodes, guests, storage)
+    """
+    return _parse_cluster_resources(proxmox.cluster.resources.get())
+
+def _parse_cluster_resources(resources):
+    """Split a /cluster/resources response into normalised nodes, guests and storage"""
+    nodes = []
+    guests = []
+    storage = []
+    for res in resources:
+        res_type = res.get('type')
+        if res_type == 'node':
+            nodes.append({
+                'node': res['node'],
+                'status': res.get('status'),
+                'cpu': res.get('cpu', 0),
+                'maxcpu': res.get('maxcpu', 0),
+                'mem': res.get('mem', 0),
+                'maxmem': res.get('maxmem', 0),
+                'disk': res.get('disk', 0),
+                'maxdisk': res.get('maxdisk', 0),
+                'uptime': res.get('uptime', 0),
+                'ip_address': None
+            })
+        elif res_type in ('qemu', 'lxc'):
+            guests.append({
+                'type': res_type,
+                'node': res['node'],
+                'vmid': res['vmid'],
+                'name': res.get('name', ''),
+                'status': res.get('status'),
+                'current': res,
+                'config': None
+            })
+        elif res_type == 'storage':
+            storage.append(res)
+
+    return nodes, guests, storage
+
+def _fetch_node_list(proxmox):
+    """Fetch the node list only; everything else is left for the per-node workers
+
+    Returns:
+        tuple: (nodes, guests, storage)
+    """
+    return _parse_node_list(proxmox.nodes.get())
+
+def _parse_node_list(node_list):
+    nodes = [{'node': node['node'], 'status': node.get('status'), 'cpu': node.get('cpu', 0)}
+             for node in node_list]
+    return nodes, [], []
+
+def _guests_from_lists(node_name, guest_lists):
+    """Normalise the nodes/{node}/qemu and nodes/{node}/lxc lists of a node
+
+    Args:
+        guest_lists: mapping of guest type ('qemu' or 'lxc') to its list response
+    """
+    guests = []
+    for guest_type in ('qemu', 'lxc'):
+        for guest in guest_lists[guest_type]:
+            guests.append({
+                'type': guest_type,
+                'node': node_name,
+                'vmid': guest['vmid'],
+                'name': guest.get('name', ''),
+                'status': guest['status'],
+                'current': None,
+                'config': None
+            })
+    return guests
+
+def _new_node_result(node):
+    return {
+        'node': node,
+        'guests': [],
+        'failed_vms': [],
+        'failed_containers': [],
+        'error': None,
+        'duration': 0
+    }
+
+def _record_guest_failure(result, guest, error):
+    COLLECTION_GUEST_FAILURES.inc(type=guest['type'])
+    if guest['type'] == 'qemu':
+        print(f"[Metrics] Failed to collect metrics for VM {guest['vmid']}: {str(error)}")
+        result['failed_vms'].append(guest['vmid'])
+    else:
+        print(f"[Metrics] Failed to collect metrics for Container {guest['vmid']}: {str(error)}")
+        result['failed_containers'].append(guest['vmid'])
+
+def _guest_api(proxmox, guest):
+    """Return the proxmoxer resource for a VM or container"""
+    return getattr(proxmox.nodes(guest['node']), guest['type'])(guest['vmid'])
+
+def _collect_node(proxmox, node, guests, mode):
+    """Fetch everything still missing for one node and its guests
+
+    Runs in a worker thread, so it only talks to the Proxmox API and never
+    touches the database session.
+
+    Returns:
+        dict: node state, guests with status and config filled in, the
+        guests that could not be fetched and the time spent on the node
+    """
+    started = time.monotonic()
+    node_name = node['node']
+    result = _new_node_result(node)
+
+    try:
+        with COLLECTION_PHASE_SECONDS.time(phase='node_status'):
+            if mode == 'nodes':
+                node.update(_node_from_status(node_name, proxmox.nodes(node_name).status.get()))
+            node['ip_address'] = _host_ip_address(proxmox, node_name)
+        if mode == 'nodes':
+            with COLLECTION_PHASE_SECONDS.time(phase='guest_lists'):
+                guests = _guests_from_lists(node_name, {
+                    guest_type: getattr(proxmox.nodes(node_name), guest_type).get()
+                    for guest_type in ('qemu', 'lxc')
+                })
+    except Exception as e:
+        result['error'] = str(e)
+        result['duration'] = time.monotonic() - started
+        return result
+
+    details_started = time.monotonic()
+    for guest in guests:
+        try:
+            guest_api = _guest_api(proxmox, guest)
+            if guest['current'] is None:
+                guest['current'] = guest_api.status.current.get()
+            # Disk sizes are only available from the guest config
+            if 'cpu' in guest['current'] and guest['config'] is None:
+                guest['config'] = guest_config_cache.fetch(guest['node'], guest['vmid'], guest_api.config.get)
+            result['guests'].append(guest)
+        except Exception as e:
+            _record_guest_failure(result, guest, e)
+    COLLECTION_PHASE_SECONDS.observe(time.monotonic() - details_started, phase='guest_details')
+
+    result['duration'] = time.monotonic() - started
+    return result
+
+def _collect_nodes(proxmox, nodes, guests, mode, workers):
+    """Fan the per-node work out over a bounded thread pool
+
+    Returns:
+        list: one _collect_node result per online node, in node order
+    """
+    guests_by_node = {}
+    for guest in guests:
+        guests_by_node.setdefault(guest['node'], []).append(guest)
+
+    online_nodes = [node for node in nodes if node['status'] == 'online']
+    if not online_nodes:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(online_nodes))),
+                            thread_name_prefix='metrics-node') as executor:
+        futures = [
+            executor.submit(_collect_node, proxmox, node, guests_by_node.get(node['node'], []), mode)
+            for node in online_nodes
+        ]
+        return [future.result() for future in futures]
+
+def _build_snapshot(nodes, node_results, storage):
+    """Build the immutable CollectionSnapshot for this cycle from the worker results"""
+    guests = []
+    failed_nodes = []
+    for result in node_results:
+        if result['error']:
+            failed_nodes.append(result['node']['node'])
+        else:
+            guests.extend(GuestState.from_dict(guest) for guest in result['guests'])
+    return CollectionSnapshot(
+        nodes=[NodeState.from_dict(node) for node in nodes],
+        guests=guests,
+        storage=storage,
+        failed_nodes=failed_nodes
+    )
+
+def _host_metrics_row(node, timestamp):
+    """HostMetrics column values for a NodeState"""
+    return dict(
+        node_name=node.name,
+        ip_address=node.ip_address,
+        cpu_usage=node.cpu * 100,
+        cpu_cores=node.maxcpu,
+        memory_usage=(node.mem / node.maxmem) * 100,
+        memory_total=node.maxmem,
+        disk_usage=(node.disk / node.maxdisk) * 100,
+        uptime=node.uptime,
+        uptime_formatted=format_uptime(node.uptime),
+        timestamp=timestamp
+    )
+
+def _guest_metrics_row(guest, timestamp):
+    """VMMetrics or ContainerMetrics column values for a GuestState
+
+    Returns None for guests without CPU statistics.
+    """
+    current = guest.current
+    if 'cpu' not in current:
+        return None
+
+    disk_total, disk_used, error = calculate_disk_usage(guest.config, current, is_vm=guest.is_vm)
+
+    if error:
+        print(f"[Metrics] Failed to get disk info for {'VM' if guest.is_vm else 'Container'} {guest.vmid}: {error}")
+
+    row = dict(
+        node_name=guest.node,
+        name=guest.name,
+        status=guest.status,
+        cpu_usage=current.get('cpu', 0) * 100,
+        memory_usage=(current['mem'] / current['maxmem']) * 100 if 'mem' in current and 'maxmem' in current else 0,
+        disk_usage=(disk_used / disk_total * 100) if disk_total > 0 else 0,
+        timestamp=timestamp
+    )
+    if guest.is_vm:
+        row['vmid'] = guest.vmid
+    else:
+        row['container_id'] = guest.vmid
+    return row
+
+def build_metric_rows(snapshot, timestamp):
+    """Turn a collection snapshot into one batch of rows per metrics table
+
+    Returns:
+        tuple: (batches, failed_vms, failed_containers) where batches maps
+        each metrics model to a list of column value dicts
+    """
+    batches = {HostMetrics: [], VMMetrics: [], ContainerMetrics: [], ClusterMetrics: []}
+    failed_vms = []
+    failed_containers = []
+
+    for node in snapshot.collected_nodes():
+        batches[HostMetrics].append(_host_metrics_row(node, timestamp))
+
+    for guest in snapshot.guests:
+        try:
+            row = _guest_metrics_row(guest, timestamp)
+            if row is not None:
+                batches[VMMetrics if guest.is_vm else ContainerMetrics].append(row)
+        except Exception as e:
+            if guest.is_vm:
+                print(f"[Metrics] Failed to collect metrics for VM {guest.vmid}: {str(e)}")
+                failed_vms.append(guest.vmid)
+            else:
+                print(f"[Metrics] Failed to collect metrics for Container {guest.vmid}: {str(e)}")
+                failed_containers.append(guest.vmid)
+
+    batches[ClusterMetrics].append(dict(snapshot.totals(), timestamp=timestamp))
+    return batches, failed_vms, failed_containers
+
+def _invalidate_configs_from_tasks(tasks_loader):
+    """Drop cached guest configs touched by migrations or config changes"""
+    try:
+        guest_config_cache.invalidate_from_tasks(tasks_loader())
+    except Exception as e:
+        print(f"[Metrics] Failed to read cluster tasks, clearing guest config cache: {str(e)}")
+        guest_config_cache.clear()
+
+def _log_skipped_nodes(nodes):
+    for node in nodes:
+        if node['status'] != 'online':
+            print(f"[Metrics] Skipping node {node['node']} with status {node['status']}")
+
+def _collect_threaded(credentials, mode, workers):
+    """Collect through the shared proxmoxer session on a thread pool
+
+    Returns:
+        tuple: (nodes, storage, node_results)
+    """
+    print("[Metrics] Attempting to connect to Proxmox cluster...")
+    proxmox = credentials.get_proxmox_connection()
+    print("[Metrics] Successfully created Proxmox connection object")
+
+    if mode == 'nodes':
+        with COLLECTION_PHASE_SECONDS.time(phase='node_list'):
+            nodes, guests, storage = _fetch_node_list(proxmox)
+    else:
+        with COLLECTION_PHASE_SECONDS.time(phase='cluster_resources'):
+            nodes, guests, storage = _fetch_cluster_resources(proxmox)
+    print(f"[Metrics] Found {len(nodes)} nodes in cluster (mode={mode}, workers={workers})")
+
+    _invalidate_configs_from_tasks(proxmox.cluster.tasks.get)
+    _log_skipped_nodes(nodes)
+    return nodes, storage, _collect_nodes(proxmox, nodes, guests, mode, workers)
+
 def collect_metrics_job():
-    """Background job to collect metrics from Proxmox"""
+    """Background job to collect metrics from Proxmox
+
+    The collection mode is taken from the METRICS_COLLECTION_MODE setting:
+    'cluster' (default) reads everything from /cluster/resources, 'nodes'
+    queries every node and guest individually. METRICS_COLLECTOR_BACKEND
+    selects how the API is polled: 'threads' (default) runs per-node work on
+    up to METRICS_COLLECTOR_WORKERS threads, 'async' issues all requests
+    concurrently from utils.async_collector. All rows are committed together.
+    With METRICS_STORAGE_MODE=delta, guest samples that did not change since
+    the last stored one are skipped (see utils.delta_storage).
+    """
     print("\n[Metrics] Starting metrics collection...")
+    cycle_started = time.monotonic()
     
     credentials = ProxmoxCredentials.query.first()
     if not credentials:
@@ -80,162 +463,119 @@ def collect_metrics_job():
     print(f"[Metrics] Found credentials in database: hostname={credentials.hostname}, username={credentials.username}, verify_ssl={credentials.verify_ssl}, port={credentials.port}")
 
     try:
-        print("[Metrics] Attempting to connect to Proxmox cluster...")
-        proxmox = credentials.get_proxmox_connection()
-        print("[Metrics] Successfully created Proxmox connection object")
-        
-        # Initialize cluster totals
-        total_cores = 0
-        total_memory = 0
-        used_memory = 0
-        total_disk = 0
-        used_disk = 0
-        
-        nodes = proxmox.nodes.get()
-        print(f"[Metrics] Found {len(nodes)} nodes in cluster")
-        
-        # Collect host metrics
-        for node in nodes:
-            node_name = node['node']
-            status = proxmox.nodes(node_name).status.get()
-            network = proxmox.nodes(node_name).network.get()
-            
-            # Find the primary IP address (usually from vmbr0)
-            ip_address = None
-            for iface in network:
-                if iface.get('iface') == 'vmbr0' and 'address' in iface:
-                    ip_address = iface['address'].split('/')[0]
-                    break
-            
-            host_metrics = HostMetrics(
-                node_name=node_name,
-                ip_address=ip_address,
-                cpu_usage=status['cpu'] * 100,
-                cpu_cores=status['cpuinfo']['cpus'],
-                memory_usage=(status['memory']['used'] / status['memory']['total']) * 100,
-                memory_total=status['memory']['total'],
-                disk_usage=(status['rootfs']['used'] / status['rootfs']['total']) * 100,
-                uptime=status['uptime'],
-                uptime_formatted=format_uptime(status['uptime'])
+        mode = current_app.config.get('METRICS_COLLECTION_MODE', 'cluster')
+        backend = current_app.config.get('METRICS_COLLECTOR_BACKEND', 'threads')
+        guest_config_cache.configure(
+            max_entries=current_app.config.get('GUEST_CONFIG_CACHE_SIZE', 5000),
+            max_age=current_app.config.get('GUEST_CONFIG_CACHE_TTL', 600)
+        )
+
+        if backend == 'async':
+            from utils.async_collector import collect_async
+            nodes, storage, node_results = collect_async(
+                credentials, mode,
+                connections=current_app.config.get('METRICS_ASYNC_CONNECTIONS', 32),
+                per_node=current_app.config.get('METRICS_ASYNC_PER_NODE', 8),
+                timeout=current_app.config.get('METRICS_ASYNC_TIMEOUT', 60)
             )
-            db.session.add(host_metrics)
-            
-            # Collect VM metrics
-            failed_vms = []
-            for vm in proxmox.nodes(node_name).qemu.get():
-                try:
-                    vm_status = proxmox.nodes(node_name).qemu(vm['vmid']).status.current.get()
-                    if 'cpu' in vm_status:
-                        # Calculate disk usage
-                        vm_config = proxmox.nodes(node_name).qemu(vm['vmid']).config.get()
-                        vm_disk_info = proxmox.nodes(node_name).qemu(vm['vmid']).status.current.get()
-                        disk_total, disk_used, error = calculate_disk_usage(vm_config, vm_disk_info, is_vm=True)
-                        
-                        if error:
-                            print(f"[Metrics] Failed to get disk info for VM {vm['vmid']}: {error}")
-                            
-                        vm_metrics = VMMetrics(
-                            node_name=node_name,
-                            vmid=vm['vmid'],
-                            name=vm.get('name', ''),
-                            status=vm['status'],
-                            cpu_usage=vm_status.get('cpu', 0) * 100,
-                            memory_usage=(vm_status['mem'] / vm_status['maxmem']) * 100 if 'mem' in vm_status and 'maxmem' in vm_status else 0,
-                            disk_usage=(disk_used / disk_total * 100) if disk_total > 0 else 0
-                        )
-                        db.session.add(vm_metrics)
-                except Exception as e:
-                    print(f"[Metrics] Failed to collect metrics for VM {vm['vmid']}: {str(e)}")
-                    failed_vms.append(vm['vmid'])
-            
-            # Collect container metrics
-            failed_containers = []
-            for ct in proxmox.nodes(node_name).lxc.get():
-                try:
-                    ct_status = proxmox.nodes(node_name).lxc(ct['vmid']).status.current.get()
-                    if 'cpu' in ct_status:
-                        # Calculate disk usage
-                        ct_config = proxmox.nodes(node_name).lxc(ct['vmid']).config.get()
-                        ct_disk_info = proxmox.nodes(node_name).lxc(ct['vmid']).status.current.get()
-                        disk_total, disk_used, error = calculate_disk_usage(ct_config, ct_disk_info, is_vm=False)
-                        
-                        if error:
-                            print(f"[Metrics] Failed to get disk info for Container {ct['vmid']}: {error}")
-                            
-                        ct_metrics = ContainerMetrics(
-                            node_name=node_name,
-                            container_id=ct['vmid'],
-                            name=ct.get('name', ''),
-                            status=ct['status'],
-                            cpu_usage=ct_status.get('cpu', 0) * 100,
-                            memory_usage=(ct_status['mem'] / ct_status['maxmem']) * 100 if 'mem' in ct_status and 'maxmem' in ct_status else 0,
-                            disk_usage=(disk_used / disk_total * 100) if disk_total > 0 else 0
-                        )
-                        db.session.add(ct_metrics)
-                except Exception as e:
-                    print(f"[Metrics] Failed to collect metrics for Container {ct['vmid']}: {str(e)}")
-                    failed_containers.append(ct['vmid'])
-        
-        # Create consolidated metrics log entry
-        nodes = proxmox.nodes.get()
-        total_vms = sum(len(proxmox.nodes(node['node']).qemu.get()) for node in nodes)
-        total_containers = sum(len(proxmox.nodes(node['node']).lxc.get()) for node in nodes)
+        else:
+            nodes, storage, node_results = _collect_threaded(
+                credentials, mode, current_app.config.get('METRICS_COLLECTOR_WORKERS', 8)
+            )
+        snapshot = _build_snapshot(nodes, node_results, storage)
+
+        # Merge per-node results into a single transaction
+        failed_vms = []
+        failed_containers = []
+        node_timings = {}
+        for result in node_results:
+            node_name = result['node']['node']
+            node_timings[node_name] = round(result['duration'], 3)
+            if result['error']:
+                print(f"[Metrics] Failed to collect metrics for node {node_name} after {result['duration']:.2f}s: {result['error']}")
+                COLLECTION_NODE_FAILURES.inc(node=node_name)
+                continue
+            print(f"[Metrics] Collected node {node_name} in {result['duration']:.2f}s ({len(result['guests'])} guests)")
+            failed_vms.extend(result['failed_vms'])
+            failed_containers.extend(result['failed_containers'])
+
+        # Build host, VM, container and cluster rows, all stamped with the cycle time
+        with COLLECTION_PHASE_SECONDS.time(phase='build_rows'):
+            batches, failed_rows_vms, failed_rows_containers = build_metric_rows(snapshot, datetime.utcnow())
+        failed_vms.extend(failed_rows_vms)
+        failed_containers.extend(failed_rows_containers)
+
+        total_vms = sum(1 for guest in snapshot.guests if guest.is_vm) + sum(len(r['failed_vms']) for r in node_results)
+        total_containers = sum(1 for guest in snapshot.guests if not guest.is_vm) + sum(len(r['failed_containers']) for r in node_results)
+        failed_nodes = sorted(snapshot.failed_nodes)
         
         # Create metrics log entry with failure details if any
         metrics_summary = f"Gathering metrics for - {len(nodes)} Hosts, {total_vms} VMs, {total_containers} Containers"
+        details = {"node_timings": node_timings}
+        if failed_nodes:
+            details["failed_nodes"] = failed_nodes
+        if failed_vms or failed_containers:
+            details["failed_vms"] = failed_vms
+            details["failed_containers"] = failed_containers
         try:
-            log_entry = DashboardLog(
-                action=metrics_summary,
-                status='info' if not (failed_vms or failed_containers) else 'warning',
-                created_at=datetime.utcnow(),
-                details={"failed_vms": failed_vms, "failed_containers": failed_containers} if failed_vms or failed_containers else None
-            )
-            db.session.add(log_entry)
-            db.session.flush()  # Get the ID without committing
-            print(f"[Metrics] Created metrics log: id={log_entry.id}, action='{log_entry.action}', status='{log_entry.status}'")
+            status = 'info' if not (failed_nodes or failed_vms or failed_containers) else 'warning'
+            log_sink.log(None, metrics_summary, status, details)
+            print(f"[Metrics] Created metrics log: action='{metrics_summary}', status='{status}'")
         except Exception as e:
             print(f"[Metrics] Failed to create log entry: {str(e)}")
 
-        # Update cluster totals from host metrics
-        for node in proxmox.nodes.get():
-            status = proxmox.nodes(node['node']).status.get()
-            total_cores += status['cpuinfo']['cpus']
-            total_memory += status['memory']['total']
-            used_memory += status['memory']['used']
-            total_disk += status['rootfs']['total']
-            used_disk += status['rootfs']['used']
-
-        # Save cluster metrics
-        cluster_metrics = ClusterMetrics(
-            total_cpu=total_cores,
-            used_cpu=sum(node['cpu'] for node in proxmox.nodes.get()) * 100,
-            total_memory=total_memory,
-            used_memory=used_memory,
-            total_disk=total_disk,
-            used_disk=used_disk,
-            node_count=len(nodes)
-        )
-        db.session.add(cluster_metrics)
-        
         try:
+            commit_started = time.monotonic()
+            # The ClusterMetrics row id identifies the collection cycle
+            cluster_metrics = ClusterMetrics(**batches[ClusterMetrics][0])
+            db.session.add(cluster_metrics)
+            db.session.flush()
+
+            # Only changed guest samples are stored in delta mode; latest state always gets every row
+            stored = {model: rows for model, rows in batches.items() if model is not ClusterMetrics}
+            if delta_enabled():
+                delta_filter.configure(
+                    tolerance=current_app.config.get('METRICS_DELTA_TOLERANCE', 1.0),
+                    heartbeat=current_app.config.get('METRICS_DELTA_HEARTBEAT', 600)
+                )
+                for model in DELTA_MODELS:
+                    stored[model] = delta_filter.filter(model, batches[model])
+                    ROWS_SUPPRESSED.inc(len(batches[model]) - len(stored[model]), table=model.__tablename__)
+
+            # One batch per table and the latest state, committed together
+            written = write_metrics(stored, current_app.config.get('METRICS_BULK_METHOD', 'auto'))
+            update_latest_state(batches, snapshot, cluster_metrics.id, failed_vms, failed_containers)
             db.session.commit()
-            print(f"[Metrics] Successfully collected metrics from {len(nodes)} nodes")
+            delta_filter.commit(cluster_metrics.timestamp)
+            # Every sample, also those delta mode did not store
+            metrics_buffer.append(cluster_metrics.timestamp, batches, cluster_metrics.id)
+            # Lazy import, utils.dashboard_summary uses format_uptime from this module
+            from utils.dashboard_summary import dashboard_summary
+            dashboard_summary.invalidate()
+            COLLECTION_PHASE_SECONDS.observe(time.monotonic() - commit_started, phase='db_commit')
+            publish_snapshot(snapshot, cluster_metrics.id)
+            ROWS_WRITTEN.inc(table=ClusterMetrics.__table__.name)
+            for table, result in written.items():
+                ROWS_WRITTEN.inc(result['rows'], table=table)
+                print(f"[Metrics] Wrote {result['rows']} {table} rows via {result['method']} in {result['seconds']:.3f}s")
+            COLLECTION_CYCLE_SECONDS.observe(time.monotonic() - cycle_started)
+            COLLECTION_CYCLES.inc(result='success')
+            print(f"[Metrics] Successfully collected metrics from {len(batches[HostMetrics])} nodes in {time.monotonic() - cycle_started:.2f}s")
             print("[Metrics] Database commit successful")
         except Exception as e:
             print(f"[Metrics] Failed to commit to database: {str(e)}")
+            COLLECTION_CYCLES.inc(result='commit_failed')
             db.session.rollback()
+            delta_filter.rollback()
     
     except Exception as e:
         error_msg = f"Failed to collect metrics: {str(e)}"
         print(f"[Metrics] {error_msg}")
+        COLLECTION_CYCLES.inc(result='failed')
+        # Log in again on the next cycle in case the session went stale
+        connection_manager.invalidate()
         try:
-            log_entry = DashboardLog(
-                action=error_msg,
-                status='error',
-                created_at=datetime.utcnow()
-            )
-            db.session.add(log_entry)
-            db.session.commit()
+            log_sink.log(None, error_msg, 'error')
         except Exception as log_error:
             print(f"[Metrics] Failed to log error: {str(log_error)}")
             db.session.rollback()
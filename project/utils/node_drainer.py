@@ -1,62 +1,70 @@
 import os
-import json
 import time
 from typing import List, Tuple, Dict, Optional
+from flask import current_app
 from proxmoxer import ProxmoxAPI
-from models import db, DashboardLog, VMMetrics, ContainerMetrics, DrainedVM, ProxmoxCredentials
+from models import db, DrainedVM, ProxmoxCredentials
+from utils.snapshot import get_latest_snapshot
+from utils.latest_state import latest_node_guests
+from utils.log_sink import log_sink
+
+def get_fresh_snapshot():
+    """Return the latest collection snapshot if it is recent enough to plan with"""
+    return get_latest_snapshot(max_age=current_app.config.get('SNAPSHOT_MAX_AGE', 120))
 
 def get_node_vms(node_name: str) -> Tuple[List[int], List[int]]:
     """Get all VMs and containers running on a node"""
-    vms = VMMetrics.query.filter_by(
-        node_name=node_name,
-        status='running'
-    ).with_entities(VMMetrics.vmid).distinct().all()
-    
-    containers = ContainerMetrics.query.filter_by(
-        node_name=node_name,
-        status='running'
-    ).with_entities(ContainerMetrics.container_id).distinct().all()
-    
-    return [vm.vmid for vm in vms], [ct.container_id for ct in containers]
+    snapshot = get_fresh_snapshot()
+    if snapshot:
+        return ([guest.vmid for guest in snapshot.guests_on(node_name, 'qemu', 'running')],
+                [guest.vmid for guest in snapshot.guests_on(node_name, 'lxc', 'running')])
+
+    return latest_node_guests(node_name)
 
 class NodeDrainer:
     def __init__(self):
         """Initialize the NodeDrainer"""
-        self.proxmox = None
-        self.has_credentials = False
         self._init_proxmox_connection()
         self.get_node_vms = get_node_vms  # Add reference to the function
+
+    @staticmethod
+    def _get_credentials():
+        creds = ProxmoxCredentials.query.first()
+        if creds and creds.hostname and creds.has_auth():
+            return creds
+        return None
+
+    @property
+    def has_credentials(self) -> bool:
+        return self._get_credentials() is not None
+
+    @property
+    def proxmox(self):
+        """Shared Proxmox session, looked up on use so credential changes are picked up"""
+        creds = self._get_credentials()
+        return creds.get_proxmox_connection() if creds else None
     
     def _init_proxmox_connection(self):
-        """Initialize Proxmox connection using stored credentials"""
+        """Check for stored credentials and log a warning if they are missing"""
         try:
             # Try to get credentials from database
             creds = ProxmoxCredentials.query.first()
             if creds and creds.hostname:
-                if creds.username and creds.password:
-                    self.proxmox = creds.get_proxmox_connection()
-                    self.has_credentials = True
-                else:
-                    log = DashboardLog(
-                        action="Proxmox credentials not configured - Please configure credentials in Settings > Proxmox Connection. You can use either username/password or API token authentication.",
-                        status='warning'
-                    )
-                    db.session.add(log)
-                    db.session.commit()
+                if not creds.has_auth():
+                    log_sink.log(None, "Proxmox credentials not configured - Please configure credentials in Settings > Proxmox Connection. You can use either username/password or API token authentication.", 'warning')
                     print("Warning: No valid Proxmox credentials configured")
             else:
-                log = DashboardLog(
-                    action="Proxmox connection not configured - Please configure your Proxmox server connection in Settings > Proxmox Connection.",
-                    status='warning'
-                )
-                db.session.add(log)
-                db.session.commit()
+                log_sink.log(None, "Proxmox connection not configured - Please configure your Proxmox server connection in Settings > Proxmox Connection.", 'warning')
                 print("Warning: No Proxmox connection configured")
         except Exception as e:
             print(f"Warning: Could not initialize Proxmox connection: {str(e)}")
         
     def get_available_nodes(self, exclude_node: str) -> List[str]:
         """Get list of available nodes excluding the one being drained"""
+        snapshot = get_fresh_snapshot()
+        if snapshot:
+            return [node.name for node in snapshot.collected_nodes() if node.name != exclude_node]
+
         nodes = []
         for node in self.proxmox.nodes.get():
             if node['node'] != exclude_node and node['status'] == 'online':
@@ -64,23 +72,36 @@ class NodeDrainer:
         return nodes
         
     def get_node_resources(self, node_name: str) -> Dict:
-        """Get resource usage for a node"""
+        """Get resource usage for a node (CPU in cores)"""
+        snapshot = get_fresh_snapshot()
+        if snapshot and snapshot.node(node_name):
+            return snapshot.node_resources(node_name)
+
         node = self.proxmox.nodes(node_name)
         status = node.status.get()
+        maxcpu = status['cpuinfo']['cpus']
         return {
-            'cpu': status['cpu'],
-            'maxcpu': status['maxcpu'],
+            'cpu': status['cpu'] * maxcpu,
+            'maxcpu': maxcpu,
             'mem': status['memory']['used'],
             'maxmem': status['memory']['total']
         }
         
-    def find_best_target_node(self, nodes: List[str], required_cpu: float, required_mem: int) -> Optional[str]:
-        """Find the best node to migrate to based on resource availability"""
+    def find_best_target_node(self, nodes: List[str], required_cpu: float, required_mem: int,
+                              node_resources: Optional[Dict[str, Dict]] = None) -> Optional[str]:
+        """Find the best node to migrate to based on resource availability
+
+        node_resources can hold already known resources per node, so a drain
+        only looks each target node up once.
+        """
         best_node = None
         best_score = float('inf')
         
         for node in nodes:
-            resources = self.get_node_resources(node)
+            if node_resources is not None and node in node_resources:
+                resources = node_resources[node]
+            else:
+                resources = self.get_node_resources(node)
             cpu_usage = resources['cpu'] / resources['maxcpu']
             mem_usage = resources['mem'] / resources['maxmem']
             
@@ -170,13 +191,7 @@ class NodeDrainer:
         if not self.has_credentials:
             # Without credentials, we can only track VMs/containers in our database
             vms, containers = self.get_node_vms(node_name)
-            log = DashboardLog(
-                node_name=node_name,
-                action=f"Cannot drain node - Proxmox credentials not configured",
-                status='warning'
-            )
-            db.session.add(log)
-            db.session.commit()
+            log_sink.log(node_name, f"Cannot drain node - Proxmox credentials not configured", 'warning')
             return vms, containers
 
         failed_vms = []
@@ -187,6 +202,13 @@ class NodeDrainer:
         if not target_nodes:
             raise Exception("No available target nodes found")
             
+        # Look up target node resources once and account for each placement
+        node_resources = {node: dict(self.get_node_resources(node)) for node in target_nodes}
+
+        def reserve(target_node, cpu, mem):
+            node_resources[target_node]['cpu'] += cpu
+            node_resources[target_node]['mem'] += mem
+
         # Get all VMs and containers
         vms = self.proxmox.nodes(node_name).qemu.get()
         containers = self.proxmox.nodes(node_name).lxc.get()
@@ -197,20 +219,16 @@ class NodeDrainer:
                 vmid = vm['vmid']
                 if self.can_migrate_vm(node_name, vmid):
                     # Find best target node based on VM's resource usage
+                    required_cpu = vm.get('cpu', 1) * vm.get('cpus', 1)
+                    required_mem = vm.get('maxmem', 1024*1024*1024)
                     target_node = self.find_best_target_node(
-                        target_nodes,
-                        vm.get('cpu', 1),
-                        vm.get('maxmem', 1024*1024*1024)
+                        target_nodes, required_cpu, required_mem, node_resources
                     )
                     
                     if target_node and self.migrate_vm(node_name, vmid, target_node):
+                        reserve(target_node, required_cpu, required_mem)
                         # Log successful migration
-                        log = DashboardLog(
-                            node_name=node_name,
-                            action=f"Migrated VM {vmid} to {target_node}",
-                            status='info'
-                        )
-                        db.session.add(log)
+                        log_sink.log(node_name, f"Migrated VM {vmid} to {target_node}")
                     else:
                         failed_vms.append(vmid)
                 else:
@@ -220,24 +238,19 @@ class NodeDrainer:
         for ct in containers:
             if ct['status'] == 'running':
                 ctid = ct['vmid']
+                required_cpu = ct.get('cpu', 1) * ct.get('cpus', 1)
+                required_mem = ct.get('maxmem', 512*1024*1024)
                 target_node = self.find_best_target_node(
-                    target_nodes,
-                    ct.get('cpu', 1),
-                    ct.get('maxmem', 512*1024*1024)
+                    target_nodes, required_cpu, required_mem, node_resources
                 )
                 
                 if target_node and self.migrate_container(node_name, ctid, target_node):
+                    reserve(target_node, required_cpu, required_mem)
                     # Log successful migration
-                    log = DashboardLog(
-                        node_name=node_name,
-                        action=f"Migrated container {ctid} to {target_node}",
-                        status='info'
-                    )
-                    db.session.add(log)
+                    log_sink.log(node_name, f"Migrated container {ctid} to {target_node}")
                 else:
                     failed_containers.append(ctid)
                     
-        db.session.commit()
         return failed_vms, failed_containers
         
     def shutdown_vms(self, node_name: str, vm_ids: List[int], container_ids: List[int]) -> bool:
@@ -264,17 +277,11 @@ class NodeDrainer:
                 )
                 db.session.add(drained_vm)
                 
-            log = DashboardLog(
-                node_name=node_name,
-                action=f"Cannot shutdown VMs/containers - Proxmox credentials not configured",
-                status='warning',
-                details=json.dumps({
-                    'vms': vm_ids,
-                    'containers': container_ids
-                })
-            )
-            db.session.add(log)
             db.session.commit()
+            log_sink.log(node_name, f"Cannot shutdown VMs/containers - Proxmox credentials not configured", 'warning', {
+                'vms': vm_ids,
+                'containers': container_ids
+            })
             return True
 
         if not self.proxmox:
@@ -321,18 +328,12 @@ class NodeDrainer:
                 )
                 db.session.add(drained_vm)
                 
-            # Log the operation
-            log = DashboardLog(
-                node_name=node_name,
-                action=f"Initiated shutdown of VMs {vm_ids} and containers {container_ids}",
-                status='warning',
-                details=json.dumps({
-                    'vms': {str(vmid): name for vmid, name in vm_names.items()},
-                    'containers': {str(ctid): name for ctid, name in container_names.items()}
-                })
-            )
-            db.session.add(log)
             db.session.commit()
+            # Log the operation
+            log_sink.log(node_name, f"Initiated shutdown of VMs {vm_ids} and containers {container_ids}", 'warning', {
+                'vms': {str(vmid): name for vmid, name in vm_names.items()},
+                'containers': {str(ctid): name for ctid, name in container_names.items()}
+            })
             
             return True
         except Exception as e:
@@ -1,10 +1,15 @@
 import paramiko
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask import current_app
 from models import (
-    DashboardLog, NodeUpdateStatus, HostMetrics, 
+    NodeUpdateStatus, HostMetrics, 
     ProxmoxCredentials, UpdateSchedule, db
 )
+from utils.latest_queries import latest_hosts
+from utils.log_sink import log_sink
+
+# Nodes without host metrics for this long are not checked for updates
+HOST_LOOKBACK = timedelta(hours=1)
 
 def check_node_updates(node_name, ip_address):
     """Check for system updates on a node via SSH"""
@@ -23,13 +28,7 @@ def check_node_updates(node_name, ip_address):
         ssh.connect(ip_address, username=ssh_username, password=credentials.password)
         
         # Log checking for updates
-        log_entry = DashboardLog(
-            node_name=node_name,
-            action=f"{node_name} - checking for updates",
-            status='info'
-        )
-        db.session.add(log_entry)
-        db.session.commit()  # Commit immediately to ensure log is saved
+        log_sink.log(node_name, f"{node_name} - checking for updates")
         
         # Update package lists
         _, stdout, stderr = ssh.exec_command('apt update 2>&1')
@@ -40,13 +39,7 @@ def check_node_updates(node_name, ip_address):
             raise Exception(f"Failed to update package lists: {update_output}\n{update_error}")
             
         # Log the apt update
-        log_entry = DashboardLog(
-            node_name=node_name,
-            action=f"{node_name} - apt update completed",
-            status='info'
-        )
-        db.session.add(log_entry)
-        db.session.commit()
+        log_sink.log(node_name, f"{node_name} - apt update completed")
         
         # Get list of updates
         _, stdout, _ = ssh.exec_command('apt list --upgradable 2>/dev/null | grep -v "Listing..."')
@@ -55,14 +48,9 @@ def check_node_updates(node_name, ip_address):
         
         # Log each update if there are any
         if updates_count > 0:
-            log_entry = DashboardLog(
-                node_name=node_name,
-                action=f"{node_name} - {updates_count} updates found:",
-                status='warning'
-            )
-            db.session.add(log_entry)
+            log_sink.log(node_name, f"{node_name} - {updates_count} updates found:", 'warning')
             
-            # Log each package update
+            # Log each package update, the sink writes them in one batch
             for update in updates_list:
                 if update.strip():  # Skip empty lines
                     try:
@@ -76,22 +64,10 @@ def check_node_updates(node_name, ip_address):
                         else:
                             version_info = package_info[1].split(']')[-1].strip()
                         
-                        log_entry = DashboardLog(
-                            node_name=node_name,
-                            action=f"{node_name} - Package: {package_name} -> {version_info}",
-                            status='info'
-                        )
-                        db.session.add(log_entry)
+                        log_sink.log(node_name, f"{node_name} - Package: {package_name} -> {version_info}")
                     except Exception as parse_error:
                         # If parsing fails, log the raw update line
-                        log_entry = DashboardLog(
-                            node_name=node_name,
-                            action=f"{node_name} - Update: {update}",
-                            status='info'
-                        )
-                        db.session.add(log_entry)
-            
-            db.session.commit()
+                        log_sink.log(node_name, f"{node_name} - Update: {update}")
         
         # Check if reboot is required
         _, stdout, _ = ssh.exec_command('test -f /var/run/reboot-required && echo "yes" || echo "no"')
@@ -101,40 +77,19 @@ def check_node_updates(node_name, ip_address):
         
         # Log results based on conditions
         if updates_count == 0:
-            log_entry = DashboardLog(
-                node_name=node_name,
-                action=f"{node_name} - no updates found",
-                status='info'
-            )
+            log_sink.log(node_name, f"{node_name} - no updates found")
         else:
-            log_entry = DashboardLog(
-                node_name=node_name,
-                action=f"{node_name} - {updates_count} updates found",
-                status='warning'
-            )
-        db.session.add(log_entry)
+            log_sink.log(node_name, f"{node_name} - {updates_count} updates found", 'warning')
         
         if reboot_required:
-            log_entry = DashboardLog(
-                node_name=node_name,
-                action=f"{node_name} - requires reboot",
-                status='warning'
-            )
-            db.session.add(log_entry)
+            log_sink.log(node_name, f"{node_name} - requires reboot", 'warning')
         
-        db.session.commit()
         return updates_count, reboot_required
     except Exception as e:
         error_msg = str(e)
         print(f"Failed to check updates for node {node_name}: {error_msg}")
         # Log the error
-        log_entry = DashboardLog(
-            node_name=node_name,
-            action=f"Failed to check updates: {error_msg}",
-            status='error'
-        )
-        db.session.add(log_entry)
-        db.session.commit()
+        log_sink.log(node_name, f"Failed to check updates: {error_msg}", 'error')
         return None, None
 
 def check_all_nodes_updates():
@@ -142,14 +97,11 @@ def check_all_nodes_updates():
     with current_app.app_context():
         print(f"\n[{datetime.now()}] Starting update check...")
         try:
-            # Get all nodes from host metrics
-            latest_host_metrics = db.session.query(
-                HostMetrics.node_name,
-                HostMetrics.ip_address,
-                db.func.max(HostMetrics.timestamp)
-            ).group_by(HostMetrics.node_name, HostMetrics.ip_address).all()
+            # Nodes that reported recently, with their current IP address
+            latest_host_metrics = latest_hosts(since=datetime.utcnow() - HOST_LOOKBACK)
             
-            for node_name, ip_address, _ in latest_host_metrics:
+            for host in latest_host_metrics:
+                node_name, ip_address = host.node_name, host.ip_address
                 # Get or create node update status
                 update_status = NodeUpdateStatus.query.filter_by(node_name=node_name).first()
                 if not update_status:
@@ -174,14 +126,9 @@ def check_all_nodes_updates():
         except Exception as e:
             error_msg = str(e)
             print(f"[Updates] Failed to check updates: {error_msg}")
-            # Log the error
-            log_entry = DashboardLog(
-                action=f"Update check failed: {error_msg}",
-                status='error'
-            )
-            db.session.add(log_entry)
-            db.session.commit()
             db.session.rollback()
+            # Log the error
+            log_sink.log(None, f"Update check failed: {error_msg}", 'error')
 
 def execute_update(update_id):
     """Execute a scheduled update"""
@@ -211,13 +158,7 @@ def execute_update(update_id):
                 nodes_to_update = [n['node'] for n in proxmox.nodes.get()]
             
             for node_name in nodes_to_update:
-                log_entry = DashboardLog(
-                    node_name=node_name,
-                    action=f"Starting update process for node {node_name}",
-                    status='info'
-                )
-                db.session.add(log_entry)
-                db.session.commit()
+                log_sink.log(node_name, f"Starting update process for node {node_name}")
                 
                 # Get Proxmox credentials
                 credentials = ProxmoxCredentials.query.first()
@@ -257,12 +198,7 @@ def execute_update(update_id):
                     reboot_required = stdout.read().decode().strip() == "yes"
                     
                     if reboot_required:
-                        log_entry = DashboardLog(
-                            node_name=node_name,
-                            action=f"Node {node_name} requires reboot after update",
-                            status='warning'
-                        )
-                        db.session.add(log_entry)
+                        log_sink.log(node_name, f"Node {node_name} requires reboot after update", 'warning')
                     
                     ssh.close()
                     
@@ -278,3 +214,13 @@ def execute_update(update_id):
             update.error_message = str(e)
             update.completed_at = datetime.utcnow()
             db.session.commit()
+
+def run_due_updates():
+    """Background job to execute scheduled updates whose time has come"""
+    due = UpdateSchedule.query.filter(
+        UpdateSchedule.status == 'scheduled',
+        UpdateSchedule.scheduled_time <= datetime.utcnow()
+    ).order_by(UpdateSchedule.scheduled_time).all()
+    for update in due:
+        print(f"[Updates] Running scheduled update {update.id} for {update.node_name or 'all nodes'}")
+        execute_update(update.id)
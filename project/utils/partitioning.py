@@ -0,0 +1,166 @@
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from models import HostMetrics, VMMetrics, ContainerMetrics, ClusterMetrics, DashboardLog, db
+
+# Raw metrics tables that grow with the number of guests
+PARTITIONED_MODELS = (HostMetrics, VMMetrics, ContainerMetrics)
+
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def ensure_metric_indexes():
+    """Create missing indexes on the metrics and dashboard log tables
+
+    db.create_all() does not add indexes to tables that already exist.
+    """
+    bind = db.engine
+    for model in PARTITIONED_MODELS + (ClusterMetrics, DashboardLog):
+        for index in model.__table__.indexes:
+            index.create(bind, checkfirst=True)
+
+
+def partitioning_supported():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def is_partitioned(table_name):
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :name AND c.relnamespace = to_regnamespace(current_schema())::oid"
+    ), {'name': table_name}).first() is not None
+
+
+def _partition_name(table_name, day):
+    return f"{table_name}_p{day:%Y%m%d}"
+
+
+def _convert_table(model):
+    """Turn an existing metrics table into a table partitioned by day on timestamp
+
+    The existing rows stay where they are: the old table is attached as a
+    single partition covering every day up to and including the day of its
+    newest row (at least everything before today), and is dropped as a whole
+    once all of it has expired. Daily partitions start after it.
+    """
+    table = model.__table__
+    name = table.name
+    legacy = f"{name}_legacy"
+    today = datetime.utcnow().date()
+
+    db.session.execute(text(f'ALTER TABLE {name} RENAME TO {legacy}'))
+    db.session.execute(text(
+        f'UPDATE {legacy} SET "timestamp" = now() AT TIME ZONE \'utc\' WHERE "timestamp" IS NULL'
+    ))
+    # Rows collected today, or stamped just now above, have to fall inside the legacy partition
+    newest = db.session.execute(text(f'SELECT max("timestamp") FROM {legacy}')).scalar()
+    upper = max(today, newest.date() + timedelta(days=1)) if newest else today
+
+    statements = [
+        f'ALTER TABLE {legacy} ALTER COLUMN "timestamp" SET NOT NULL',
+        # The partition key has to be part of the primary key
+        f'ALTER TABLE {legacy} DROP CONSTRAINT {name}_pkey',
+        f'ALTER TABLE {legacy} ADD CONSTRAINT {legacy}_pkey PRIMARY KEY (id, "timestamp")',
+        f'CREATE TABLE {name} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE ("timestamp")',
+        f'ALTER TABLE {name} ADD CONSTRAINT {name}_pkey PRIMARY KEY (id, "timestamp")',
+        # Keep the id sequence alive when the legacy partition is dropped
+        f'ALTER SEQUENCE {name}_id_seq OWNED BY {name}.id',
+    ]
+    for index in table.indexes:
+        statements.append(f'ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_legacy')
+    for statement in statements:
+        db.session.execute(text(statement))
+
+    connection = db.session.connection()
+    for index in table.indexes:
+        index.create(connection)
+
+    db.session.execute(text(
+        f"ALTER TABLE {name} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ('{upper.isoformat()}')"
+    ))
+    print(f"[Partitioning] Converted {name} to daily partitions")
+
+
+def ensure_partitions(days_ahead=2):
+    """Create the daily partitions for today and the next days_ahead days
+
+    Days already covered by an existing partition, such as the legacy
+    partition of a converted table, are skipped.
+    """
+    today = datetime.utcnow().date()
+    last = today + timedelta(days=days_ahead)
+    for model in PARTITIONED_MODELS:
+        name = model.__table__.name
+        partitions = _partitions(name)
+        first = max(today, partitions[-1][1].date()) if partitions else today
+        for offset in range((last - first).days + 1):
+            day = first + timedelta(days=offset)
+            partition = _partition_name(name, day)
+            db.session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {name} "
+                f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+            ))
+    db.session.commit()
+
+
+def setup_partitioning(days_ahead=2):
+    """Partition the raw metrics tables by day on PostgreSQL
+
+    Safe to run on every start: tables that are already partitioned are
+    left alone and only missing daily partitions are created.
+
+    Returns:
+        bool: True if partitioning is active
+    """
+    if not partitioning_supported():
+        print("[Partitioning] Metrics partitioning needs PostgreSQL, skipping")
+        return False
+    try:
+        for model in PARTITIONED_MODELS:
+            if not is_partitioned(model.__table__.name):
+                # Lock out concurrent writers while the table is swapped
+                db.session.execute(text(f"LOCK TABLE {model.__table__.name} IN ACCESS EXCLUSIVE MODE"))
+                _convert_table(model)
+        db.session.commit()
+        ensure_partitions(days_ahead)
+        return True
+    except Exception as e:
+        print(f"[Partitioning] Failed to set up partitioning: {str(e)}")
+        db.session.rollback()
+        return False
+
+
+def _partitions(table_name):
+    """(partition name, upper bound) for each partition of a table"""
+    rows = db.session.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :name"
+    ), {'name': table_name}).all()
+    partitions = []
+    for partition, bound in rows:
+        match = _UPPER_BOUND.search(bound or '')
+        if match:
+            partitions.append((partition, datetime.fromisoformat(match.group(1))))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def drop_expired_partitions(model, cutoff):
+    """Drop every partition of a model's table that ends at or before cutoff
+
+    Returns:
+        list: names of the dropped partitions
+    """
+    name = model.__table__.name
+    if not partitioning_supported() or not is_partitioned(name):
+        return []
+    dropped = []
+    for partition, upper in _partitions(name):
+        if upper > cutoff:
+            break
+        db.session.execute(text(f"ALTER TABLE {name} DETACH PARTITION {partition}"))
+        db.session.execute(text(f"DROP TABLE {partition}"))
+        dropped.append(partition)
+    if dropped:
+        print(f"[Partitioning] Dropped expired partitions: {', '.join(dropped)}")
+    return dropped
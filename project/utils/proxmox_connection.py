@@ -0,0 +1,186 @@
+import hashlib
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from proxmoxer import ProxmoxAPI
+from utils.instrumentation import requests_hook
+
+# Proxmox tickets are valid for two hours
+TICKET_LIFETIME = 7200
+
+
+class ProxmoxConnectionManager:
+    """Process-wide, long-lived Proxmox API session
+
+    One authenticated ProxmoxAPI object is shared by the collector, the
+    drainer, the updater and the web routes. Its HTTP session keeps
+    connections alive in a pool sized for the collector's worker threads.
+    Password logins are renewed before the ticket expires. API tokens never
+    need a login at all. The session is rebuilt whenever the stored
+    credentials change.
+    """
+
+    def __init__(self, pool_size=10, ticket_renew_age=3600, check_interval=30):
+        self.pool_size = pool_size
+        self.ticket_renew_age = ticket_renew_age
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._proxmox = None
+        self._fingerprint = None
+        self._auth_type = None
+        self._created_at = None
+        self._last_check = None
+        self._stats = {
+            'logins': 0,
+            'reuses': 0,
+            'renewals': 0,
+            'failures': 0,
+            'invalidations': 0
+        }
+
+    def configure(self, pool_size=None, ticket_renew_age=None, check_interval=None):
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if ticket_renew_age is not None:
+            self.ticket_renew_age = ticket_renew_age
+        if check_interval is not None:
+            self.check_interval = check_interval
+
+    @staticmethod
+    def _fingerprint_for(credentials):
+        secret = credentials.token_value if credentials.token_name else credentials.password
+        return (
+            credentials.hostname,
+            credentials.port,
+            credentials.username,
+            credentials.token_name,
+            hashlib.sha256((secret or '').encode()).hexdigest(),
+            bool(credentials.verify_ssl)
+        )
+
+    def _connect(self, credentials):
+        """Log in (or set up token auth) and build a pooled session"""
+        verify = credentials.verify_ssl
+        if not verify:
+            requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
+
+        kwargs = dict(verify_ssl=verify, port=credentials.port)
+        if credentials.token_name and credentials.token_value:
+            kwargs.update(token_name=credentials.token_name, token_value=credentials.token_value)
+        else:
+            kwargs.update(password=credentials.password)
+        proxmox = ProxmoxAPI(credentials.hostname, user=credentials.username, **kwargs)
+
+        session = proxmox._store['session']
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.hooks['response'].append(requests_hook)
+        if hasattr(session.auth, 'renew_age'):
+            # proxmoxer renews the ticket on the next request once it is this old
+            session.auth.renew_age = self.ticket_renew_age
+        return proxmox
+
+    def _ticket_age(self):
+        auth = self._proxmox._store['session'].auth if self._proxmox else None
+        if auth is None or not hasattr(auth, 'birth_time'):
+            return None
+        return time.monotonic() - auth.birth_time
+
+    def get_connection(self, credentials):
+        """Return the shared connection for the given credentials"""
+        fingerprint = self._fingerprint_for(credentials)
+        with self._lock:
+            if self._proxmox is not None and self._fingerprint == fingerprint:
+                ticket_age = self._ticket_age()
+                if ticket_age is None or ticket_age < TICKET_LIFETIME - 60:
+                    self._stats['reuses'] += 1
+                    return self._proxmox
+                # Too old to be renewed with the current ticket, log in again
+                self._stats['renewals'] += 1
+                print(f"[Proxmox] Ticket is {ticket_age:.0f}s old, logging in again")
+
+            try:
+                self._proxmox = self._connect(credentials)
+            except Exception as e:
+                self._stats['failures'] += 1
+                self._proxmox = None
+                self._fingerprint = None
+                print(f"[ERROR] Failed to connect: {str(e)}")
+                raise
+
+            self._fingerprint = fingerprint
+            self._auth_type = credentials.auth_type
+            self._created_at = time.time()
+            self._last_check = None
+            self._stats['logins'] += 1
+            print(f"[Proxmox] Opened {self._auth_type} session to {credentials.hostname}:{credentials.port}")
+            return self._proxmox
+
+    def check_connection(self, credentials):
+        """Verify the connection, reusing a recent result
+
+        Returns:
+            tuple: (connected, error)
+        """
+        fingerprint = self._fingerprint_for(credentials)
+        with self._lock:
+            last_check = self._last_check
+            if (last_check and last_check[1] == fingerprint
+                    and time.time() - last_check[0] < self.check_interval):
+                return last_check[2], last_check[3]
+
+        try:
+            self.get_connection(credentials).version.get()
+            connected, error = True, None
+        except Exception as e:
+            self.invalidate()
+            connected, error = False, str(e)
+
+        with self._lock:
+            self._last_check = (time.time(), fingerprint, connected, error)
+        return connected, error
+
+    def last_check_time(self):
+        """time.time() of the last connection check, None if it was invalidated"""
+        with self._lock:
+            return self._last_check[0] if self._last_check else None
+
+    def invalidate(self):
+        """Drop the shared session so the next caller logs in again"""
+        with self._lock:
+            if self._proxmox is not None:
+                self._stats['invalidations'] += 1
+                try:
+                    self._proxmox._store['session'].close()
+                except Exception:
+                    pass
+            self._proxmox = None
+            self._fingerprint = None
+            self._last_check = None
+
+    def stats(self):
+        """Session and HTTP connection pool statistics"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['connected'] = self._proxmox is not None
+            stats['auth_type'] = self._auth_type if self._proxmox else None
+            stats['session_age'] = round(time.time() - self._created_at, 1) if self._proxmox else None
+            ticket_age = self._ticket_age()
+            stats['ticket_age'] = round(ticket_age, 1) if ticket_age is not None else None
+            stats['pool_size'] = self.pool_size
+            stats['pools'] = []
+            if self._proxmox is not None:
+                adapter = self._proxmox._store['session'].get_adapter('https://')
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools[key]
+                    stats['pools'].append({
+                        'host': f"{pool.host}:{pool.port}",
+                        'connections_opened': pool.num_connections,
+                        'requests': pool.num_requests,
+                        'idle_connections': pool.pool.qsize() if pool.pool else 0
+                    })
+            return stats
+
+
+connection_manager = ProxmoxConnectionManager()
@@ -0,0 +1,289 @@
+import calendar
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import current_app
+from models import (
+    HostMetrics, VMMetrics, ContainerMetrics, ClusterMetrics,
+    MetricsRollup, RollupWatermark, db
+)
+from utils.bulk_writer import write_rows
+from utils.partitioning import drop_expired_partitions
+from utils.archive import archive_enabled, archive_expired, day_start
+from utils.delta_storage import DELTA_MODELS, delta_enabled, filled_guest_samples
+
+# Rollup tiers in compaction order: bucket size in seconds and the tier they are built from
+TIERS = OrderedDict([
+    ('1m', {'seconds': 60, 'source': 'raw'}),
+    ('15m', {'seconds': 900, 'source': '1m'}),
+    ('1h', {'seconds': 3600, 'source': '15m'}),
+])
+
+# Raw tables per entity type: (model, entity id column)
+RAW_SOURCES = OrderedDict([
+    ('host', (HostMetrics, HostMetrics.node_name)),
+    ('vm', (VMMetrics, VMMetrics.vmid)),
+    ('container', (ContainerMetrics, ContainerMetrics.container_id)),
+])
+
+DEFAULT_RETENTION_DAYS = {'raw': 7, '1m': 14, '15m': 90, '1h': 730}
+
+# Longest time span compacted per tier in one run, so a backlog is worked off incrementally
+MAX_SPAN = timedelta(hours=6)
+
+# Samples newer than this are left for the next run, in case a cycle is still committing
+GRACE = timedelta(seconds=30)
+
+
+def floor_time(timestamp, seconds):
+    """Round a naive UTC datetime down to a multiple of seconds"""
+    epoch = calendar.timegm(timestamp.utctimetuple())
+    return datetime.utcfromtimestamp(epoch - epoch % seconds)
+
+
+def retention_days():
+    """Retention in days per tier ('raw', '1m', '15m', '1h')"""
+    retention = dict(DEFAULT_RETENTION_DAYS)
+    retention.update(current_app.config.get('METRICS_RETENTION_DAYS', {}))
+    return retention
+
+
+class _Bucket:
+    """Running min/avg/max for one entity in one bucket"""
+    __slots__ = ('node_name', 'samples', 'sums', 'mins', 'maxs')
+
+    def __init__(self):
+        self.node_name = None
+        self.samples = 0
+        self.sums = [0.0, 0.0, 0.0]
+        self.mins = [None, None, None]
+        self.maxs = [None, None, None]
+
+    def add(self, node_name, values, samples=1, mins=None, maxs=None):
+        """Add raw values, or pre-aggregated averages with their min/max"""
+        self.node_name = node_name
+        self.samples += samples
+        mins = mins or values
+        maxs = maxs or values
+        for i, value in enumerate(values):
+            if value is None:
+                continue
+            self.sums[i] += value * samples
+            if mins[i] is not None and (self.mins[i] is None or mins[i] < self.mins[i]):
+                self.mins[i] = mins[i]
+            if maxs[i] is not None and (self.maxs[i] is None or maxs[i] > self.maxs[i]):
+                self.maxs[i] = maxs[i]
+
+    def row(self, tier, entity_type, entity_id, bucket_start):
+        avgs = [total / self.samples if self.samples else None for total in self.sums]
+        return dict(
+            tier=tier,
+            entity_type=entity_type,
+            entity_id=str(entity_id),
+            node_name=self.node_name,
+            bucket_start=bucket_start,
+            samples=self.samples,
+            cpu_min=self.mins[0], cpu_avg=avgs[0], cpu_max=self.maxs[0],
+            memory_min=self.mins[1], memory_avg=avgs[1], memory_max=self.maxs[1],
+            disk_min=self.mins[2], disk_avg=avgs[2], disk_max=self.maxs[2]
+        )
+
+
+def _raw_samples(model, entity_column, start, end):
+    """(entity id, node, timestamp, cpu, memory, disk) of every sample of a raw table in [start, end)"""
+    if model in DELTA_MODELS and delta_enabled():
+        # Change-only storage: count a stored value once for every cycle it stood for
+        for batch in filled_guest_samples(model, start, end):
+            for row in batch:
+                yield (row[entity_column.key], row['node_name'], row['timestamp'],
+                       row['cpu_usage'], row['memory_usage'], row['disk_usage'])
+        return
+    yield from db.session.query(
+        entity_column, model.node_name, model.timestamp,
+        model.cpu_usage, model.memory_usage, model.disk_usage
+    ).filter(model.timestamp >= start, model.timestamp < end).yield_per(5000)
+
+
+def _aggregate_raw(tier_seconds, start, end):
+    """Bucket raw samples in [start, end) per entity"""
+    buckets = {}
+    for entity_type, (model, entity_column) in RAW_SOURCES.items():
+        for entity_id, node_name, timestamp, cpu, memory, disk in _raw_samples(model, entity_column, start, end):
+            key = (entity_type, entity_id, floor_time(timestamp, tier_seconds))
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = _Bucket()
+            bucket.add(node_name, (cpu, memory, disk))
+    return buckets
+
+
+def _aggregate_tier(source_tier, tier_seconds, start, end):
+    """Bucket a finer rollup tier in [start, end) per entity"""
+    buckets = {}
+    query = MetricsRollup.query.filter(
+        MetricsRollup.tier == source_tier,
+        MetricsRollup.bucket_start >= start,
+        MetricsRollup.bucket_start < end
+    ).order_by(MetricsRollup.bucket_start).yield_per(5000)
+    for rollup in query:
+        key = (rollup.entity_type, rollup.entity_id, floor_time(rollup.bucket_start, tier_seconds))
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = _Bucket()
+        bucket.add(
+            rollup.node_name,
+            (rollup.cpu_avg, rollup.memory_avg, rollup.disk_avg),
+            samples=rollup.samples,
+            mins=(rollup.cpu_min, rollup.memory_min, rollup.disk_min),
+            maxs=(rollup.cpu_max, rollup.memory_max, rollup.disk_max)
+        )
+    return buckets
+
+
+def _earliest_source_time(source):
+    if source == 'raw':
+        candidates = [db.session.query(db.func.min(model.timestamp)).scalar() for model, _ in RAW_SOURCES.values()]
+    else:
+        candidates = [db.session.query(db.func.min(MetricsRollup.bucket_start)).filter(MetricsRollup.tier == source).scalar()]
+    candidates = [candidate for candidate in candidates if candidate is not None]
+    return min(candidates) if candidates else None
+
+
+def _source_watermark(source, now):
+    """Time up to which the source of a tier is complete"""
+    if source == 'raw':
+        return now - GRACE
+    watermark = db.session.get(RollupWatermark, source)
+    return watermark.processed_until if watermark else None
+
+
+def compact_tier(tier, now=None):
+    """Roll complete buckets since the tier's watermark up into MetricsRollup
+
+    Returns:
+        int: number of rollup rows written
+    """
+    now = now or datetime.utcnow()
+    tier_seconds = TIERS[tier]['seconds']
+    source = TIERS[tier]['source']
+
+    source_until = _source_watermark(source, now)
+    if source_until is None:
+        return 0
+    end = floor_time(source_until, tier_seconds)
+
+    watermark = db.session.get(RollupWatermark, tier)
+    if watermark is None:
+        earliest = _earliest_source_time(source)
+        if earliest is None:
+            return 0
+        watermark = RollupWatermark(tier=tier, processed_until=floor_time(earliest, tier_seconds))
+        db.session.add(watermark)
+
+    start = watermark.processed_until
+    end = min(end, start + MAX_SPAN)
+    if end <= start:
+        return 0
+
+    if source == 'raw':
+        buckets = _aggregate_raw(tier_seconds, start, end)
+    else:
+        buckets = _aggregate_tier(source, tier_seconds, start, end)
+
+    rows = [bucket.row(tier, entity_type, entity_id, bucket_start)
+            for (entity_type, entity_id, bucket_start), bucket in buckets.items()]
+    write_rows(MetricsRollup, rows)
+    watermark.processed_until = end
+    db.session.commit()
+    return len(rows)
+
+
+def compact_rollups(now=None):
+    """Compact every tier incrementally, finest first
+
+    Returns:
+        dict: rollup rows written per tier
+    """
+    now = now or datetime.utcnow()
+    written = {}
+    for tier in TIERS:
+        written[tier] = 0
+        # Work off any backlog up to where the source tier is complete, one span at a time
+        while True:
+            watermark = db.session.get(RollupWatermark, tier)
+            before = watermark.processed_until if watermark else None
+            written[tier] += compact_tier(tier, now)
+            watermark = db.session.get(RollupWatermark, tier)
+            source_until = _source_watermark(TIERS[tier]['source'], now)
+            # Spans without samples write nothing but still move the watermark
+            if not watermark or source_until is None or watermark.processed_until == before:
+                break
+            if watermark.processed_until >= floor_time(source_until, TIERS[tier]['seconds']):
+                break
+    return written
+
+
+def apply_retention(now=None):
+    """Delete raw samples and rollups older than their tier's retention
+
+    Data is only deleted once the next tier has been built from it, and raw
+    samples only once they are archived when METRICS_ARCHIVE_DIR is set.
+
+    Returns:
+        dict: rows deleted per tier
+    """
+    now = now or datetime.utcnow()
+    retention = retention_days()
+    deleted = {}
+
+    def safe_cutoff(tier, consumer):
+        cutoff = now - timedelta(days=retention[tier])
+        if consumer:
+            watermark = db.session.get(RollupWatermark, consumer)
+            processed = watermark.processed_until if watermark else datetime.min
+            cutoff = min(cutoff, processed)
+        return cutoff
+
+    raw_cutoff = safe_cutoff('raw', '1m')
+    archiving = archive_enabled()
+    if archiving:
+        # Only whole days are archived, the rest of the last day waits for the next run
+        raw_cutoff = day_start(raw_cutoff)
+    deleted['raw'] = 0
+    for model in (HostMetrics, VMMetrics, ContainerMetrics, ClusterMetrics):
+        if archiving:
+            archive_expired(model, raw_cutoff)
+        # Whole expired days go with their partition, the rest is deleted row by row
+        drop_expired_partitions(model, raw_cutoff)
+        deleted['raw'] += model.query.filter(model.timestamp < raw_cutoff).delete(synchronize_session=False)
+
+    tiers = list(TIERS)
+    for index, tier in enumerate(tiers):
+        consumer = tiers[index + 1] if index + 1 < len(tiers) else None
+        cutoff = safe_cutoff(tier, consumer)
+        deleted[tier] = MetricsRollup.query.filter(
+            MetricsRollup.tier == tier,
+            MetricsRollup.bucket_start < cutoff
+        ).delete(synchronize_session=False)
+
+    db.session.commit()
+    return deleted
+
+
+def rollup_job():
+    """Scheduled job: compact new samples into the rollup tiers"""
+    try:
+        written = compact_rollups()
+        print(f"[Rollups] Compacted rollups: {written}")
+    except Exception as e:
+        print(f"[Rollups] Failed to compact rollups: {str(e)}")
+        db.session.rollback()
+
+
+def retention_job():
+    """Scheduled job: expire raw samples and rollups past their retention"""
+    try:
+        deleted = apply_retention()
+        print(f"[Rollups] Applied retention: {deleted}")
+    except Exception as e:
+        print(f"[Rollups] Failed to apply retention: {str(e)}")
+        db.session.rollback()
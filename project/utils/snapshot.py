@@ -0,0 +1,193 @@
+import threading
+import time
+from types import MappingProxyType
+
+_EMPTY = MappingProxyType({})
+
+
+class _Frozen:
+    """Base class for immutable, slotted state objects"""
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__[:3])
+        return f"<{type(self).__name__} {fields}>"
+
+
+class NodeState(_Frozen):
+    """Resource state of a single Proxmox node"""
+    __slots__ = ('name', 'status', 'cpu', 'maxcpu', 'mem', 'maxmem',
+                 'disk', 'maxdisk', 'uptime', 'ip_address')
+
+    @classmethod
+    def from_dict(cls, node):
+        return cls(
+            name=node['node'],
+            status=node.get('status'),
+            cpu=node.get('cpu', 0),
+            maxcpu=node.get('maxcpu', 0),
+            mem=node.get('mem', 0),
+            maxmem=node.get('maxmem', 0),
+            disk=node.get('disk', 0),
+            maxdisk=node.get('maxdisk', 0),
+            uptime=node.get('uptime', 0),
+            ip_address=node.get('ip_address')
+        )
+
+    @property
+    def online(self):
+        return self.status == 'online'
+
+
+class GuestState(_Frozen):
+    """Resource state of a VM ('qemu') or container ('lxc')"""
+    __slots__ = ('guest_type', 'vmid', 'node', 'name', 'status',
+                 'current', 'config')
+
+    @classmethod
+    def from_dict(cls, guest):
+        return cls(
+            guest_type=guest['type'],
+            vmid=guest['vmid'],
+            node=guest['node'],
+            name=guest.get('name', ''),
+            status=guest.get('status'),
+            current=MappingProxyType(dict(guest['current'] or {})),
+            config=MappingProxyType(dict(guest['config'] or {}))
+        )
+
+    @property
+    def is_vm(self):
+        return self.guest_type == 'qemu'
+
+    @property
+    def cpu(self):
+        """CPU usage as a fraction of the guest's vCPUs"""
+        return self.current.get('cpu', 0)
+
+    @property
+    def maxcpu(self):
+        return self.current.get('maxcpu', self.current.get('cpus', 1))
+
+    @property
+    def mem(self):
+        return self.current.get('mem', 0)
+
+    @property
+    def maxmem(self):
+        return self.current.get('maxmem', 0)
+
+
+class CollectionSnapshot(_Frozen):
+    """Immutable view of the cluster taken once per collection cycle
+
+    Built by collect_metrics_job and shared with the node drainer and the
+    dashboard, so they can read node and guest state without calling the
+    Proxmox API again. Snapshots only live in the process that collected
+    them: when worker.py runs the collection, the web app has none and
+    reads the latest state tables instead.
+    """
+    __slots__ = ('taken_at', 'nodes', 'guests', 'storage', 'failed_nodes',
+                 '_nodes_by_name', '_guests_by_node')
+
+    def __init__(self, nodes=(), guests=(), storage=(), failed_nodes=(), taken_at=None):
+        nodes = tuple(nodes)
+        guests = tuple(guests)
+        guests_by_node = {}
+        for guest in guests:
+            guests_by_node.setdefault(guest.node, []).append(guest)
+        super().__init__(
+            taken_at=taken_at if taken_at is not None else time.time(),
+            nodes=nodes,
+            guests=guests,
+            storage=tuple(MappingProxyType(dict(entry)) for entry in storage),
+            failed_nodes=frozenset(failed_nodes),
+            _nodes_by_name=MappingProxyType({node.name: node for node in nodes}),
+            _guests_by_node=MappingProxyType({name: tuple(items) for name, items in guests_by_node.items()})
+        )
+
+    @property
+    def age(self):
+        """Seconds since the snapshot was taken"""
+        return time.time() - self.taken_at
+
+    def node(self, name):
+        return self._nodes_by_name.get(name)
+
+    def collected_nodes(self):
+        """Online nodes whose state was collected successfully"""
+        return [node for node in self.nodes if node.online and node.name not in self.failed_nodes]
+
+    def guests_on(self, node_name, guest_type=None, status=None):
+        """Guests currently placed on a node, optionally filtered"""
+        return [
+            guest for guest in self._guests_by_node.get(node_name, ())
+            if (guest_type is None or guest.guest_type == guest_type)
+            and (status is None or guest.status == status)
+        ]
+
+    def node_resources(self, name):
+        """CPU (in cores) and memory usage of a node, as used for drain placement"""
+        node = self.node(name)
+        if node is None:
+            return None
+        return {
+            'cpu': node.cpu * node.maxcpu,
+            'maxcpu': node.maxcpu,
+            'mem': node.mem,
+            'maxmem': node.maxmem
+        }
+
+    def totals(self):
+        """Cluster-wide totals as stored in ClusterMetrics"""
+        collected = self.collected_nodes()
+        return {
+            'total_cpu': sum(node.maxcpu for node in collected),
+            'used_cpu': sum(node.cpu for node in self.nodes) * 100,
+            'total_memory': sum(node.maxmem for node in collected),
+            'used_memory': sum(node.mem for node in collected),
+            'total_disk': sum(node.maxdisk for node in collected),
+            'used_disk': sum(node.disk for node in collected),
+            'node_count': len(self.nodes)
+        }
+
+
+_latest = (None, None)
+_latest_lock = threading.Lock()
+
+
+def publish_snapshot(snapshot, cycle_id=None):
+    """Make a snapshot the current one for this process
+
+    Args:
+        cycle_id: id of the ClusterMetrics row the snapshot's cycle wrote
+    """
+    global _latest
+    with _latest_lock:
+        _latest = (snapshot, cycle_id)
+
+
+def get_latest_snapshot(max_age=None, cycle_id=None):
+    """Return the most recent snapshot of this process
+
+    Returns None if there is none, it is older than max_age seconds, or a
+    cycle_id is given and the snapshot belongs to a different cycle.
+    """
+    snapshot, snapshot_cycle = _latest
+    if snapshot is None:
+        return None
+    if max_age is not None and snapshot.age > max_age:
+        return None
+    if cycle_id is not None and snapshot_cycle != cycle_id:
+        return None
+    return snapshot
@@ -0,0 +1,30 @@
+"""Standalone scheduler process
+
+Runs metrics collection, rollups, retention, update checks and scheduled
+updates, so the web app can run under several WSGI workers with
+RUN_SCHEDULER=false. Several workers may run side by side: on PostgreSQL
+an advisory lock elects the one that actually does the work.
+
+    python worker.py
+"""
+import os
+
+# The web app's module-level scheduler must not start in this process
+os.environ['RUN_SCHEDULER'] = 'false'
+
+from apscheduler.schedulers.blocking import BlockingScheduler
+from app import app
+from utils.jobs import start_jobs
+from utils.leader import leader_election
+from utils.instrumentation import start_metrics_server
+
+if __name__ == '__main__':
+    # The web app's /metrics does not see this process, so serve our own
+    start_metrics_server(int(os.environ.get('WORKER_METRICS_PORT', 9105)), token=app.config['METRICS_TOKEN'])
+    scheduler = BlockingScheduler()
+    try:
+        start_jobs(app, scheduler)
+    except (KeyboardInterrupt, SystemExit):
+        print("[Worker] Shutting down")
+    finally:
+        leader_election.resign()